@@ -6,13 +6,15 @@ This script analyzes tickers to identify buying opportunities based on the RSI(2
 4. System Status: The system will not look for buy signals if the S&P 500 is in a downtrend or if the VIX is too high.
 """
 
-import yfinance as yf
-import pandas_ta as ta
 import pandas as pd
 import os
 import numpy as np
 from datetime import datetime
 from markets import get_tickers_from_csv
+from indicators import compute_indicators, sma
+import rules
+import screening
+import downloader
 
 # --- CONFIGURATION ---
 PRIORITIZATION_METHOD = "RSI"  # Options: 'RSI', 'RSI_DESC', 'A-Z', 'Z-A', 'HV_DESC', 'ADX_DESC'
@@ -21,6 +23,7 @@ VIX_PROTECTION = 45 # VIX threshold to shut off system (0 = disabled). System re
 PANIC_BUTTON = False # If True, sell all open positions when VIX protection is triggered
 SP500_ENTRY_THRESHOLD = 1.02 # S&P 500 must be above SMA(200) * this value to open positions (e.g., 1.01 = 1% above SMA)
 POSITIONS_FILE = "positions.txt"
+SIGNAL_RULES = rules.RULES # Entry/exit rules (see rules.py), shared with backtest.py
 
 # ANSI color codes for terminal output
 class Colors:
@@ -45,6 +48,7 @@ def save_positions(positions):
 
 def get_market_sentiment_data():
     """Downloads S&P 500 and VIX data to determine market sentiment."""
+    import yfinance as yf
     print("--> Downloading S&P 500 and VIX data for market sentiment analysis...")
     # Download S&P 500 data
     sp500_data = yf.download('^GSPC', period="2y", interval="1d", progress=False)
@@ -54,7 +58,7 @@ def get_market_sentiment_data():
     if isinstance(sp500_data.columns, pd.MultiIndex):
         sp500_data.columns = sp500_data.columns.get_level_values(0)
     sp500_data.columns = sp500_data.columns.str.lower()
-    sp500_data['sma_200'] = ta.sma(sp500_data['close'], length=200)
+    sp500_data['sma_200'] = sma(sp500_data['close'], 200)
 
     # Download VIX data
     vix_data = yf.download('^VIX', period="1y", interval="1d", progress=False)
@@ -68,12 +72,15 @@ def get_market_sentiment_data():
 
     return sp500_data.iloc[-1], vix_data.iloc[-1] if vix_data is not None else None
 
-def analyze_ticker(ticker_symbol, strategy_type):
+def analyze_ticker(ticker_symbol, strategy_type, df=None):
     """
     Analyzes a single ticker and returns its signals and other data.
+    If df is None, the last 2 years of daily data are downloaded.
     Returns None if data is insufficient.
     """
-    df = yf.download(ticker_symbol, period="2y", interval="1d", progress=False)
+    if df is None:
+        import yfinance as yf
+        df = yf.download(ticker_symbol, period="2y", interval="1d", progress=False)
     
     if len(df) < 200:
         return None
@@ -82,20 +89,11 @@ def analyze_ticker(ticker_symbol, strategy_type):
         df.columns = df.columns.get_level_values(0)
     df.columns = df.columns.str.lower()
 
-    # Calculate indicators
-    df["sma_200"] = ta.sma(df["close"], length=200)
-    df["sma_5"] = ta.sma(df["close"], length=5)
-    df["rsi_2"] = ta.rsi(df["close"], length=2)
-    df['log_returns'] = np.log(df['close'] / df['close'].shift(1))
-    df['hv_100'] = df['log_returns'].rolling(window=100).std() * np.sqrt(252)
-    if all(c in df.columns for c in ['high', 'low', 'close']):
-        adx_df = ta.adx(df["high"], df["low"], df["close"], length=14)
-        if adx_df is not None and not adx_df.empty:
-            df['adx_14'] = adx_df.iloc[:, 0]
-        else:
-            df['adx_14'] = np.nan
-    else:
-        df['adx_14'] = np.nan
+    # Calculate indicators (ADX is NaN if high/low are not available)
+    high = df["high"] if "high" in df.columns else df["close"] * np.nan
+    low = df["low"] if "low" in df.columns else df["close"] * np.nan
+    for name, values in compute_indicators(df["close"], high, low).items():
+        df[name] = values
 
     latest = df.iloc[-1]
     if pd.isna(latest["sma_200"]) or pd.isna(latest["sma_5"]) or pd.isna(latest["rsi_2"]):
@@ -114,40 +112,106 @@ def analyze_ticker(ticker_symbol, strategy_type):
         "strategy": None
     }
 
-    # Normal Strategy Conditions
-    if strategy_type in ["NORMAL", "BOTH"]:
-        is_uptrend = latest["close"] > latest["sma_200"]
-        is_oversold = latest["rsi_2"] < 5
-        is_exit_zone = latest["close"] > latest["sma_5"]
-        adx_strong_trend = latest["adx_14"] >= 50 if not pd.isna(latest["adx_14"]) else False
+    # Entry and exit rules on the latest bar (see rules.py)
+    signals = rules.evaluate_rules(SIGNAL_RULES, {name: df[name].to_numpy()[-1:] for name in df.columns})
+    apply_signals(analysis, {name: values[0] for name, values in signals.items()}, strategy_type)
+    return analysis
 
-        is_entry_zone = latest["close"] < latest["sma_5"]
-        if is_uptrend and is_oversold and is_entry_zone and not adx_strong_trend:
+def apply_signals(analysis, signals, strategy_type):
+    """Sets the buy / exit flags and the strategy of an analysis from the signals of its latest bar. A NORMAL signal takes precedence over an INVERSE one."""
+    for side in ["NORMAL", "INVERSE"]:
+        if strategy_type not in [side, "BOTH"]:
+            continue
+        if signals[f"is_buy_signal_{side.lower()}"] and not analysis["is_buy_signal"]:
             analysis["is_buy_signal"] = True
-            analysis["strategy"] = "NORMAL"
-        if is_exit_zone:
+            analysis["strategy"] = side
+        if signals[f"is_exit_signal_{side.lower()}"] and not analysis["is_exit_signal"]:
             analysis["is_exit_signal"] = True
-            analysis["strategy"] = "NORMAL"
-
-    # Inverse Strategy Conditions
-    if strategy_type in ["INVERSE", "BOTH"]:
-        is_downtrend = latest["close"] < latest["sma_200"]
-        is_overbought = latest["rsi_2"] > 95
-        is_exit_zone_inverse = latest["close"] < latest["sma_5"]
-        is_entry_zone_inverse = latest["close"] > latest["sma_5"]
-        if not analysis["is_buy_signal"] and is_downtrend and is_overbought and is_entry_zone_inverse:
-             analysis["is_buy_signal"] = True
-             analysis["strategy"] = "INVERSE"
-        if is_exit_zone_inverse:
-            if not analysis["is_exit_signal"]: # Prevent overwrite if NORMAL exit already triggered
-                analysis["is_exit_signal"] = True
-                analysis["strategy"] = "INVERSE"
+            analysis["strategy"] = side
 
-    return analysis
+def download_universe(tickers):
+    """Downloads the last 2 years of daily data of the tickers in rate-limited batches (see downloader.py)."""
+    start = (pd.Timestamp.today() - pd.DateOffset(years=2)).strftime("%Y-%m-%d")
+    frames, status = downloader.download(tickers, downloader.yfinance_provider(start, None))
+    downloader.print_status_report(status)
+    # A batch has the dates of all its tickers: keep the ones each ticker traded, as a download of the ticker alone
+    return {ticker: df.dropna(how='all') for ticker, df in frames.items()}
 
+def screen_tickers(frames, strategy_type, verbose=True):
+    """
+    Screens the latest bar of every ticker in stages (see screening.py): the trend and setup checks run on the
+    whole universe at once and the ADX and HV are only computed for the tickers that pass them.
 
-if __name__ == "__main__":
-    sp500_latest, vix_latest = get_market_sentiment_data()
+    Args:
+        frames (dict): ticker -> DataFrame of its daily bars (as downloaded).
+
+    Returns:
+        dict: ticker -> analysis (as analyze_ticker) of the tickers with a buy signal.
+    """
+    tickers, close, high, low = [], [], [], []
+    for ticker, df in frames.items():
+        if len(df) < 200:
+            continue
+        columns = df.columns.get_level_values(0) if isinstance(df.columns, pd.MultiIndex) else df.columns
+        df = df.set_axis(columns.str.lower(), axis=1)
+        tickers.append(ticker)
+        close.append(df["close"].to_numpy(dtype=float))
+        high.append(df["high"].to_numpy(dtype=float) if "high" in df.columns else close[-1] * np.nan)
+        low.append(df["low"].to_numpy(dtype=float) if "low" in df.columns else close[-1] * np.nan)
+
+    # Tickers with the same number of bars are stacked into one (bars, tickers) block, so the indicators of a
+    # block are computed at once with the same results as for each ticker alone
+    lengths = np.array([len(values) for values in close], dtype=np.int64)
+
+    def compute(names, columns):
+        result = {name: np.empty((1, len(columns))) for name in names}
+        for length in np.unique(lengths[columns]):
+            in_block = lengths[columns] == length
+            block = columns[in_block]
+            block_close = np.column_stack([close[j] for j in block])
+            indicator_names = [name for name in names if name != "close"]
+            computed = compute_indicators(block_close, np.column_stack([high[j] for j in block]), np.column_stack([low[j] for j in block]),
+                                            names=indicator_names) if indicator_names else {}
+            for name in names:
+                result[name][0, in_block] = block_close[-1] if name == "close" else computed[name][-1]
+        return result
+
+    sides = [side for side in ["NORMAL", "INVERSE"] if strategy_type in [side, "BOTH"]]
+    eligible = np.ones((1, len(tickers)), dtype=bool)
+    values, _, signals, report = screening.screen(compute, eligible, SIGNAL_RULES, sides, required=["sma_200", "sma_5", "rsi_2"])
+    if verbose:
+        screening.print_report(report)
+
+    analyses = {}
+    buy = np.logical_or.reduce([signals[f"is_buy_signal_{side.lower()}"][0] for side in sides]) if sides else np.zeros(len(tickers), dtype=bool)
+    for j in np.flatnonzero(buy):
+        analysis = {
+            "ticker": tickers[j],
+            "price": values["close"][0, j],
+            "rsi": values["rsi_2"][0, j],
+            "hv": values["hv_100"][0, j],
+            "adx": values["adx_14"][0, j],
+            "sma5": values["sma_5"][0, j],
+            "is_buy_signal": False,
+            "is_exit_signal": False,
+            "is_oversold": False,
+            "strategy": None
+        }
+        apply_signals(analysis, {name: signal[0, j] for name, signal in signals.items()}, strategy_type)
+        analyses[tickers[j]] = analysis
+    return analyses
+
+
+def shut_off_reason(sp500_price, sp500_sma200, vix_value):
+    """Returns why the system is off for the given market values ("VIX" or "S&P 500"), or None if it is on."""
+    if VIX_PROTECTION > 0 and vix_value > VIX_PROTECTION:
+        return "VIX"
+    if sp500_price < sp500_sma200:
+        return "S&P 500"
+    return None
+
+def check_system_state(sp500_latest, vix_latest):
+    """Prints the system state (VIX protection and S&P 500 trend) for the latest market data and returns True if it is shut off."""
     system_shut_off = False
 
     if sp500_latest is None:
@@ -156,15 +220,14 @@ if __name__ == "__main__":
     else:
         sp500_price = sp500_latest['close']
         sp500_sma200 = sp500_latest['sma_200']
-        is_sp500_bearish = sp500_price < sp500_sma200
-        is_sp500_strong = sp500_price > (sp500_sma200 * SP500_ENTRY_THRESHOLD)
         vix_value = vix_latest['close'] if vix_latest is not None else 0
 
         # System State Logic
-        if VIX_PROTECTION > 0 and vix_value > VIX_PROTECTION:
+        reason = shut_off_reason(sp500_price, sp500_sma200, vix_value)
+        if reason == "VIX":
             system_shut_off = True
             print(f"{Colors.RED}SYSTEM OFF: VIX ({vix_value:.2f}) is above the configured threshold of {VIX_PROTECTION}.{Colors.RESET}")
-        elif is_sp500_bearish:
+        elif reason == "S&P 500":
             system_shut_off = True
             print(f"{Colors.RED}SYSTEM OFF: S&P 500 is in a downtrend (Price: {sp500_price:.2f} < SMA200: {sp500_sma200:.2f}).{Colors.RESET}")
         
@@ -180,6 +243,27 @@ if __name__ == "__main__":
             print(f"{Colors.GREEN}SYSTEM ON: Market conditions are favorable for opening new positions.{Colors.RESET}")
             print(f"-> S&P 500 Price: {sp500_price:.2f} (SMA200: {sp500_sma200:.2f})")
             if VIX_PROTECTION > 0: print(f"-> VIX: {vix_value:.2f} (Threshold: {VIX_PROTECTION})")
+    return system_shut_off
+
+def sort_buy_signals(buy_signals):
+    """Sorts the buy signals in place by PRIORITIZATION_METHOD."""
+    if PRIORITIZATION_METHOD == 'RSI':
+        buy_signals.sort(key=lambda x: x['rsi'])
+    elif PRIORITIZATION_METHOD == 'RSI_DESC':
+        buy_signals.sort(key=lambda x: x['rsi'], reverse=True)
+    elif PRIORITIZATION_METHOD == 'A-Z':
+        buy_signals.sort(key=lambda x: x['ticker'])
+    elif PRIORITIZATION_METHOD == 'Z-A':
+        buy_signals.sort(key=lambda x: x['ticker'], reverse=True)
+    elif PRIORITIZATION_METHOD == 'HV_DESC':
+        buy_signals.sort(key=lambda x: x['hv'] if not pd.isna(x['hv']) else 0, reverse=True)
+    elif PRIORITIZATION_METHOD == 'ADX_DESC':
+        buy_signals.sort(key=lambda x: x['adx'] if not pd.isna(x['adx']) else 0, reverse=True)
+
+def main():
+    """Checks held positions for exits, scans all markets for new signals and updates the positions file."""
+    sp500_latest, vix_latest = get_market_sentiment_data()
+    system_shut_off = check_system_state(sp500_latest, vix_latest)
     
     held_positions = load_positions()
     new_positions = held_positions.copy()
@@ -222,13 +306,14 @@ if __name__ == "__main__":
         blacklisted_tickers = set(all_blacklisted_tickers)
         print(f"--> Analyzing {len(unique_tickers)} unique tickers.")
         
+        # The universe is downloaded in batches and screened in stages (cheap checks first, see screening.py)
+        scan_tickers = [ticker for ticker in unique_tickers if ticker not in held_positions]
+        analyses = screen_tickers(download_universe(scan_tickers), STRATEGY_TYPE)
+
         buy_signals = []
         blacklist_buy_signals = []
-        for ticker in unique_tickers:
-            if ticker in held_positions:
-                continue
-            
-            analysis = analyze_ticker(ticker, STRATEGY_TYPE)
+        for ticker in scan_tickers:
+            analysis = analyses.get(ticker)
 
             if analysis and analysis["is_buy_signal"]:
                 if ticker in blacklisted_tickers:
@@ -244,18 +329,7 @@ if __name__ == "__main__":
             print(f"\n--- Strong Buy Signals (Sorted by {PRIORITIZATION_METHOD}) ---")
             
             # Sort normal buy signals
-            if PRIORITIZATION_METHOD == 'RSI':
-                buy_signals.sort(key=lambda x: x['rsi'])
-            elif PRIORITIZATION_METHOD == 'RSI_DESC':
-                buy_signals.sort(key=lambda x: x['rsi'], reverse=True)
-            elif PRIORITIZATION_METHOD == 'A-Z':
-                buy_signals.sort(key=lambda x: x['ticker'])
-            elif PRIORITIZATION_METHOD == 'Z-A':
-                buy_signals.sort(key=lambda x: x['ticker'], reverse=True)
-            elif PRIORITIZATION_METHOD == 'HV_DESC':
-                buy_signals.sort(key=lambda x: x['hv'] if not pd.isna(x['hv']) else 0, reverse=True)
-            elif PRIORITIZATION_METHOD == 'ADX_DESC':
-                buy_signals.sort(key=lambda x: x['adx'] if not pd.isna(x['adx']) else 0, reverse=True)
+            sort_buy_signals(buy_signals)
             
             # Print sorted normal signals
             for signal in buy_signals:
@@ -271,3 +345,6 @@ if __name__ == "__main__":
 
     save_positions(new_positions)
     print("\nPositions file updated.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,340 @@
+"""
+This script replays analyzer.py on every trading day of a date range ("what would the analyzer have
+printed on each of the last 500 days?") in one pass over the prepared data, instead of faking the date
+and rerunning the scanner once per day.
+
+For every date it applies the same logic as analyzer.main on the data known at that date:
+
+1. System state: off if the VIX is above VIX_PROTECTION or the S&P 500 is below its SMA(200)
+   (analyzer.shut_off_reason).
+2. Exits: held positions with an exit signal (analyzer.SIGNAL_RULES, see rules.py) leave the positions list.
+3. Buys (only if the system is on): tickers of the market files that were not held at the start of the day
+   and have a buy signal, split into BUY and BLACKLISTED BUY, the BUY ones sorted by PRIORITIZATION_METHOD
+   (analyzer.sort_buy_signals). The BUY tickers are added to the positions list.
+
+The positions list evolves from day to day as positions.txt would (starting empty or from a positions
+file). The buy rules are screened for the whole (dates, tickers) panel in stages (see screening.py): the
+ADX and HV are only read or computed for the tickers that pass the trend and setup checks on some date of the
+range. Only the positions list is stepped day by day. On dates a ticker's market was closed, its last
+completed bar is used, as the analyzer would see it.
+
+The prepared panel only has the backtest universe (backtest.load_universe leaves the blacklisted tickers out),
+so with --prepared the tickers of the market files and positions it lacks are downloaded for its dates and
+their indicators computed on demand.
+
+Usage:
+    python asof.py --prepared --days 500
+    python asof.py --prepared --start 2025-01-01 --end 2025-06-30 --positions positions.txt
+"""
+
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+import analyzer
+import backtest
+import downloader
+import panel_store
+import screening
+from indicators import compute_indicators
+from markets import get_tickers_from_csv
+
+# ==============================================================================
+# --- CONFIGURATION ---
+# ==============================================================================
+DAYS = 500 # Trading days replayed when no --start is given (ending on the last date of the data)
+MIN_BARS = 200 # The analyzer needs 200 bars of history (analyzer.analyze_ticker)
+REQUIRED_COLUMNS = ["sma_200", "sma_5", "rsi_2"] # ... and these indicators (analyzer.analyze_ticker)
+OUTPUT_DIR = "docs/comparatives/asof"
+# ==============================================================================
+
+SIGNAL_COLUMNS = ["date", "kind", "rank", "ticker", "strategy", "price", "rsi", "hv", "adx"]
+
+def load_markets():
+    """Returns the sorted unique tickers of the market files in data/ and the set of blacklisted tickers (as analyzer.main)."""
+    market_files = [os.path.join("data", f) for f in os.listdir("data") if f.endswith(".csv")]
+    all_tickers, all_blacklisted_tickers = [], []
+    for f in market_files:
+        tickers, blacklist = get_tickers_from_csv(f)
+        all_tickers.extend(tickers)
+        all_blacklisted_tickers.extend(blacklist)
+    return sorted(set(all_tickers)), set(all_blacklisted_tickers)
+
+def replay(compute, traded, tickers, dates, market, start, end, universe, blacklisted, initial_positions=(), verbose=True):
+    """
+    Replays the analyzer on every date of dates[start:end].
+
+    Args:
+        compute (callable): compute(names, columns) -> {name: (end - start, len(columns)) array} of the indicator
+            columns ('close', 'sma_200', 'rsi_2'...) of the given ticker columns on dates[start:end] (see screening.py).
+        traded (np.ndarray): (dates, tickers) bool, True on the dates each ticker traded.
+        tickers (list): Tickers of the columns.
+        dates (pd.DatetimeIndex): Dates of the rows.
+        market (dict): 'sp500_close', 'sp500_sma', 'vix' arrays aligned with dates (NaN if not available).
+        start, end (int): Row range to replay.
+        universe (list): Tickers scanned for buys (sorted, as the analyzer does).
+        blacklisted (set): Blacklisted tickers.
+        initial_positions (list): Positions list at the start of the range.
+
+    Returns:
+        tuple: (daily summary DataFrame, signals DataFrame with SIGNAL_COLUMNS, final positions list).
+    """
+    # Signals of the whole range at once, screened in stages; a ticker needs MIN_BARS bars and REQUIRED_COLUMNS
+    # (analyzer.analyze_ticker). Held positions need their exit signals even if they are not in the universe
+    column_of = {ticker: j for j, ticker in enumerate(tickers)}
+    universe_columns = np.array([column_of[ticker] for ticker in universe if ticker in column_of], dtype=np.int64)
+    bars = np.cumsum(np.asarray(traded, dtype=bool), axis=0)[start:end]
+    sides = [side for side in ["NORMAL", "INVERSE"] if analyzer.STRATEGY_TYPE in [side, "BOTH"]]
+    window, valid, signals, report = screening.screen(compute, bars >= MIN_BARS, analyzer.SIGNAL_RULES, sides, required=REQUIRED_COLUMNS,
+                                                      columns=universe_columns, extra_columns=[column_of[t] for t in initial_positions if t in column_of])
+    if verbose:
+        screening.print_report(report, cells_label="ticker-days")
+    # Same precedence as analyzer.analyze_ticker: the first side with a buy (exit) signal sets it, and the reported
+    # strategy is the side of the last signal set (e.g. INVERSE for a NORMAL buy on a bar with an INVERSE exit)
+    is_buy = np.zeros(valid.shape, dtype=bool)
+    is_exit = np.zeros(valid.shape, dtype=bool)
+    strategy = np.full(valid.shape, -1, dtype=np.int8)
+    for k, side in enumerate(sides):
+        new_buy = valid & signals[f"is_buy_signal_{side.lower()}"] & ~is_buy
+        is_buy |= new_buy
+        strategy[new_buy] = k
+        new_exit = valid & signals[f"is_exit_signal_{side.lower()}"] & ~is_exit
+        is_exit |= new_exit
+        strategy[new_exit] = k
+
+    candidate_rows, candidate_positions = np.nonzero(is_buy[:, universe_columns])
+    candidates_by_row = np.split(universe_columns[candidate_positions], np.searchsorted(candidate_rows, np.arange(1, end - start)))
+
+    def analysis(row, j):
+        return {"ticker": tickers[j], "strategy": sides[strategy[row, j]], "price": window["close"][row, j], "rsi": window["rsi_2"][row, j],
+                "hv": window["hv_100"][row, j], "adx": window["adx_14"][row, j]}
+
+    positions = list(initial_positions)
+    summary, signal_rows = [], []
+    for row in range(end - start):
+        i = start + row
+        date = dates[i]
+        vix_value = market["vix"][i] if not np.isnan(market["vix"][i]) else 0
+        reason = analyzer.shut_off_reason(market["sp500_close"][i], market["sp500_sma"][i], vix_value)
+        held_positions = list(positions)
+
+        exits = []
+        for ticker in held_positions:
+            j = column_of.get(ticker)
+            if j is not None and is_exit[row, j]:
+                exits.append(analysis(row, j))
+                positions.remove(ticker)
+
+        buy_signals, blacklist_buy_signals = [], []
+        if reason is None:
+            held = set(held_positions)
+            for j in candidates_by_row[row]:
+                ticker = tickers[j]
+                if ticker in held:
+                    continue
+                signal = analysis(row, j)
+                if ticker in blacklisted:
+                    blacklist_buy_signals.append(signal)
+                else:
+                    buy_signals.append(signal)
+                    if ticker not in positions:
+                        positions.append(ticker)
+            analyzer.sort_buy_signals(buy_signals)
+            blacklist_buy_signals.sort(key=lambda x: x['ticker'])
+
+        for kind, signals_of_kind in [("EXIT", exits), ("BUY", buy_signals), ("BLACKLISTED BUY", blacklist_buy_signals)]:
+            for rank, signal in enumerate(signals_of_kind, 1):
+                signal_rows.append((date, kind, rank, signal["ticker"], signal["strategy"], signal["price"], signal["rsi"], signal["hv"], signal["adx"]))
+        summary.append({
+            "date": date,
+            "system": "ON" if reason is None else f"OFF ({reason})",
+            "panic": reason is not None and analyzer.PANIC_BUTTON and bool(held_positions),
+            "held": len(held_positions),
+            "exits": len(exits),
+            "buys": len(buy_signals),
+            "blacklisted": len(blacklist_buy_signals),
+            "positions": len(positions),
+        })
+
+    summary_df = pd.DataFrame(summary).set_index("date") if summary else pd.DataFrame()
+    signals_df = pd.DataFrame(signal_rows, columns=SIGNAL_COLUMNS)
+    return summary_df, signals_df, positions
+
+def panel_source(columns_by_name, start, end):
+    """Returns the compute function of replay over prepared (dates, tickers) arrays: only the requested ticker columns are read."""
+    def compute(names, columns):
+        return {name: np.asarray(columns_by_name[name][start:end][:, columns], dtype=float) for name in names}
+    return compute
+
+def indicator_source(close, high, low, traded, start, end):
+    """Returns the compute function of replay that calculates the indicators of the requested ticker columns on demand."""
+    safe_close = np.where(close <= 0, 1e-10, close) # As backtest.calculate_signals
+    def compute(names, columns):
+        indicator_names = [name for name in names if name != "close"]
+        computed = compute_indicators(safe_close[:, columns], high[:, columns], low[:, columns], traded=traded[:, columns],
+                                      names=indicator_names) if indicator_names else {}
+        return {name: (close[:, columns] if name == "close" else computed[name])[start:end] for name in names}
+    return compute
+
+def combined_source(panel_compute, extra_compute, num_panel_columns):
+    """
+    Returns the compute function of replay over the panel columns followed by extra columns: the requested
+    columns below `num_panel_columns` are read with panel_compute and the others computed with extra_compute.
+    """
+    def compute(names, columns):
+        columns = np.asarray(columns, dtype=np.int64)
+        in_panel = columns < num_panel_columns
+        parts = []
+        if in_panel.any():
+            parts.append(panel_compute(names, columns[in_panel]))
+        if not in_panel.all():
+            parts.append(extra_compute(names, columns[~in_panel] - num_panel_columns))
+        order = np.argsort(np.concatenate([np.flatnonzero(in_panel), np.flatnonzero(~in_panel)]), kind='stable')
+        return {name: np.hstack([part[name] for part in parts])[:, order] for name in names}
+    return compute
+
+def download_missing(tickers, dates):
+    """
+    Downloads the tickers missing from the prepared panel (e.g. the blacklisted ones, which backtest.load_universe
+    leaves out) and aligns them to its dates as backtest.align_data does.
+
+    Returns:
+        tuple: (downloaded tickers, {'close', 'high', 'low', 'traded': (dates, tickers) array}).
+    """
+    print(f"Downloading {len(tickers)} tickers that are not in the prepared data...")
+    end = (dates[-1] + pd.Timedelta(days=1)).strftime("%Y-%m-%d")
+    frames, status = downloader.download(tickers, downloader.yfinance_provider(dates[0].strftime("%Y-%m-%d"), end))
+    downloader.print_status_report(status)
+    downloaded, aligned = [], []
+    for ticker in tickers:
+        if ticker not in frames:
+            continue
+        df = frames[ticker].rename(columns=str.lower)[["close", "high", "low"]].dropna()
+        df = df[df.index.isin(dates)] # Dates the panel does not have cannot be replayed
+        if len(df):
+            downloaded.append(ticker)
+            aligned.append(backtest.align_frame(df, dates))
+    arrays = {name: np.column_stack([df[name].to_numpy(dtype=float) for df in aligned]) if aligned else np.empty((len(dates), 0))
+              for name in ["close", "high", "low", "traded"]}
+    arrays["traded"] = arrays["traded"].astype(bool)
+    return downloaded, arrays
+
+def market_arrays(vix_data, sp500_data, dates):
+    """Returns the S&P 500 close and SMA(200) and the VIX close aligned with dates (NaN if not available)."""
+    def column(frame, name):
+        if frame is None or name not in frame.columns:
+            return np.full(len(dates), np.nan)
+        return frame[name].reindex(dates).to_numpy(dtype=float)
+    return {"sp500_close": column(sp500_data, "close"), "sp500_sma": column(sp500_data, "sma_200"), "vix": column(vix_data, "vix_close")}
+
+def date_range(dates, start_date=None, end_date=None, days=DAYS):
+    """Returns the (start, end) rows of the replay: [start_date, end_date], or the last `days` dates up to end_date."""
+    end = dates.searchsorted(pd.Timestamp(end_date), side='right') if end_date else len(dates)
+    start = dates.searchsorted(pd.Timestamp(start_date)) if start_date else max(end - days, 0)
+    return start, end
+
+def save_asof_report(summary_df, signals_df, initial_positions, final_positions):
+    """Saves the daily summary (markdown) and the signal table (CSV) and returns the markdown path."""
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    first, last = summary_df.index[0].date(), summary_df.index[-1].date()
+    filename_base = f"ASOF-{analyzer.STRATEGY_TYPE}-{first}-{last}"
+    filename = os.path.join(OUTPUT_DIR, f"{filename_base}.md")
+    i = 1
+    while os.path.exists(filename):
+        filename_base = f"ASOF-{analyzer.STRATEGY_TYPE}-{first}-{last}-{i}"
+        filename = os.path.join(OUTPUT_DIR, f"{filename_base}.md")
+        i += 1
+    signals_path = os.path.join(OUTPUT_DIR, f"{filename_base}.csv")
+    signals_df.to_csv(signals_path, index=False, float_format="%.4f")
+
+    with open(filename, 'w') as f:
+        f.write(f"# As-of Analyzer Replay: {first} to {last}\n\n")
+        f.write(f"**Strategy:** {analyzer.STRATEGY_TYPE}\n")
+        f.write(f"**Prioritization Method:** {analyzer.PRIORITIZATION_METHOD}\n")
+        f.write(f"**VIX Protection:** {analyzer.VIX_PROTECTION}\n")
+        f.write(f"**Initial Positions:** {', '.join(initial_positions) or 'None'}\n")
+        f.write(f"**Final Positions:** {', '.join(final_positions) or 'None'}\n")
+        f.write(f"**Signals:** {os.path.basename(signals_path)} ({len(signals_df)} rows)\n\n")
+        f.write("---\n\n## Daily Summary\n\n")
+        f.write(summary_df.reset_index().assign(date=lambda df: df["date"].dt.date).to_markdown(index=False))
+        f.write("\n")
+
+    print(f"\nAs-of replay saved to {filename} (signals in {signals_path})")
+    return filename
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay analyzer.py on every date of a range in one pass.")
+    parser.add_argument('--prepared', action='store_true', help="Use the data last prepared by backtest.py (see panel_store.py) instead of downloading it.")
+    parser.add_argument('--no-download', action='store_true', help="With --prepared, do not download the tickers missing from the prepared data (e.g. the blacklisted ones); they are not replayed.")
+    parser.add_argument('--days', type=int, default=DAYS, help=f"Trading days to replay when --start is not given (default: {DAYS}).")
+    parser.add_argument('--start', help="First date to replay (YYYY-MM-DD).")
+    parser.add_argument('--end', help="Last date to replay (YYYY-MM-DD, default: last date of the data).")
+    parser.add_argument('--positions', metavar='FILE', help="Positions list at the start of the range (one ticker per line, as positions.txt). Default: empty.")
+    args = parser.parse_args()
+
+    start_time = time.perf_counter()
+    universe, blacklisted = load_markets()
+    initial_positions = []
+    if args.positions:
+        with open(args.positions) as f:
+            initial_positions = [line.strip() for line in f if line.strip()]
+
+    if args.prepared:
+        panel = panel_store.open_panel()
+        if panel is None:
+            parser.error("no prepared data found. Run backtest.py with USE_PANEL_STORE = True first.")
+        print(f"Using the prepared data stored in {panel.path}")
+        tickers, dates = list(panel.tickers), panel.dates
+        # (tickers, dates) memory-mapped arrays, transposed without copying
+        columns = {name: panel.column(name).T for name in panel.columns}
+        traded = np.asarray(columns["traded"], dtype=bool)
+        vix_data, sp500_data, _ = panel.market_frames()
+        # The panel has the backtest universe only: the blacklisted tickers (and any other ticker of the market
+        # files or positions it lacks) are downloaded and their indicators computed when needed
+        panel_tickers = set(tickers)
+        not_in_panel = [ticker for ticker in dict.fromkeys(universe + initial_positions) if ticker not in panel_tickers]
+        extra_tickers, extra = download_missing(not_in_panel, dates) if not_in_panel and not args.no_download else ([], None)
+        if extra_tickers:
+            tickers = tickers + extra_tickers
+            traded = np.hstack([traded, extra["traded"]])
+    else:
+        # Steps 1 and 2 of backtest.prepare_data; the indicators are computed by the screening stages when needed
+        all_historical_data, vix_data, sp500_data, _ = backtest.download_data(sorted(set(universe) | set(initial_positions)))
+        dates, vix_data, sp500_data, _ = backtest.align_data(all_historical_data, vix_data, sp500_data, None)
+        tickers = list(all_historical_data.keys())
+        if not tickers:
+            parser.error("no data could be downloaded.")
+        def stack(name):
+            return np.column_stack([all_historical_data[t].rename(columns=str.lower)[name].to_numpy(dtype=float) for t in tickers])
+        close, high, low, traded = stack("close"), stack("high"), stack("low"), stack("traded").astype(bool)
+
+    missing = [ticker for ticker in universe if ticker not in set(tickers)]
+    if missing:
+        print(f"{analyzer.Colors.YELLOW}Warning: {len(missing)} tickers of the market files are not in the data and are not scanned: {', '.join(missing[:20])}{' ...' if len(missing) > 20 else ''}{analyzer.Colors.RESET}")
+
+    start, end = date_range(dates, args.start, args.end, args.days)
+    if start >= end:
+        parser.error("the date range has no data.")
+    replay_start = time.perf_counter()
+    if not args.prepared:
+        compute = indicator_source(close, high, low, traded, start, end)
+    elif extra_tickers:
+        compute = combined_source(panel_source(columns, start, end),
+                                  indicator_source(extra["close"], extra["high"], extra["low"], extra["traded"], start, end), len(panel.tickers))
+    else:
+        compute = panel_source(columns, start, end)
+    summary_df, signals_df, final_positions = replay(compute, traded, tickers, dates, market_arrays(vix_data, sp500_data, dates),
+                                                     start, end, universe, blacklisted, initial_positions)
+    print(f"\n--- Replayed {len(summary_df)} dates ({summary_df.index[0].date()} to {summary_df.index[-1].date()}) in {time.perf_counter() - replay_start:.2f} seconds ---")
+    print(summary_df.tail(20).to_string())
+    print(f"\nPositions at the end: {', '.join(final_positions) or 'None'}")
+    save_asof_report(summary_df, signals_df, initial_positions, final_positions)
+    elapsed_seconds = time.perf_counter() - start_time
+    minutes, seconds = divmod(elapsed_seconds, 60)
+    print(f"\nTotal execution time: {int(minutes)} minutes {seconds:.1f} seconds")
+
+if __name__ == '__main__':
+    main()
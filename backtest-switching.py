@@ -14,16 +14,17 @@ INVERSE Strategy (activated when VIX > VIX_PROTECTION OR S&P 500 < 200-day SMA):
 
 import pandas as pd
 import numpy as np
-import yfinance as yf
-import pandas_ta as ta
 from datetime import datetime
 import math
 import time
 import os
 import re
-import requests
 from io import StringIO
-from bs4 import BeautifulSoup
+from indicators import compute_indicators, sma
+import membership
+import regime
+import rules
+import downloader
 
 # ==============================================================================
 # --- CONFIGURATION ---
@@ -43,10 +44,31 @@ VIX_PROTECTION = 45 # VIX threshold to shut off system (0 = disabled). System re
 PANIC_BUTTON = False # If True, sell all open positions when VIX protection is triggered
 TIME_STOP = 10 # Maximum number of days to hold a position (0 = disabled)
 SP500_ENTRY_THRESHOLD = 1.02 # S&P 500 must be above SMA(200) * this value to open positions (e.g., 1.01 = 1% above SMA)
+POINT_IN_TIME_UNIVERSE = False # If True, only buy tickers that were in their index on each date (run generate_tickers.py first to create data/membership/<market>.csv)
+SIGNAL_RULES = rules.SWITCHING_RULES # Entry/exit rules (see rules.py)
 # ==============================================================================
 # ==============================================================================
 
-def prepare_data(tickers):
+def align_frame(df, master_index):
+    """
+    Forward-fills a ticker's (sorted) bars onto master_index and adds the 'traded' column: 1.0 on the
+    dates the ticker actually has a bar, 0.0 otherwise. Dates before its first bar are NaN.
+    """
+    traded = np.zeros(len(master_index), dtype=bool)
+    traded[np.searchsorted(master_index.values, df.index.values)] = True
+    # Position of the last bar on or before each date (-1 before the first bar)
+    last_bar = np.cumsum(traded) - 1
+    values = df.to_numpy(dtype=float)[np.maximum(last_bar, 0)]
+    values[last_bar < 0] = np.nan
+    # 'traded' is stored as a float so the frame stays a single block (much faster to build than adding a bool column)
+    return pd.DataFrame(np.column_stack([values, traded]), index=master_index, columns=list(df.columns) + ["traded"])
+
+def prepare_data(tickers, membership_intervals=None):
+    # Network libraries are only imported when data is actually downloaded
+    import yfinance as yf
+    import requests
+    from bs4 import BeautifulSoup
+
     print(f"Step 1: Downloading historical data... (Leverage: 1:{LEVERAGE_FACTOR})")
     all_historical_data = {}
     data_start_date = pd.to_datetime(START_DATE) - pd.DateOffset(months=10)
@@ -60,7 +82,7 @@ def prepare_data(tickers):
         if isinstance(sp500_data.columns, pd.MultiIndex):
             sp500_data.columns = sp500_data.columns.droplevel(1)
         sp500_data.columns = [str(col).lower() for col in sp500_data.columns]
-        sp500_data['sma_200'] = ta.sma(sp500_data['close'], length=200)
+        sp500_data['sma_200'] = sma(sp500_data['close'], 200)
         sp500_data['is_bearish'] = sp500_data['close'] < (sp500_data['sma_200'] * SP500_ENTRY_THRESHOLD)
 
     # Download VIX data
@@ -111,33 +133,29 @@ def prepare_data(tickers):
         print(f"Warning: Could not process Fed Funds Rate data. Error: {e}. Swap calculation will be disabled.")
         fed_funds_data = None
 
-    # Batch download to be friendlier to the API
-    for i in range(0, len(tickers), 100):
-        batch = tickers[i:i+100]
-        try:
-            data_batch = yf.download(batch, start=data_start_date, end=END_DATE, progress=False, group_by='ticker')
-            if data_batch is not None and not data_batch.empty:
-                for ticker in batch:
-                    try:
-                        df = data_batch[ticker]
-                        if not df.empty and len(df) > 200:
-                            all_historical_data[ticker] = df.dropna(subset=['Open', 'High', 'Low', 'Close'])
-                    except KeyError:
-                        pass # Ticker might not be in the downloaded batch
-        except Exception as e: print(f"Could not download data for batch starting with {batch[0]}: {e}")
-        time.sleep(1)
+    # Rate-limited batch download with adaptive batch sizes and a retry queue (see downloader.py)
+    frames, download_status = downloader.download(tickers, downloader.yfinance_provider(data_start_date, END_DATE))
+    for ticker, df in frames.items():
+        if len(df) > 200:
+            all_historical_data[ticker] = df.dropna(subset=['Open', 'High', 'Low', 'Close'])
+    downloader.print_status_report(download_status)
     print(f"Successfully downloaded data for {len(all_historical_data)} tickers.")
 
     print("Step 2: Unifying and forward-filling data...")
-    master_index = pd.DatetimeIndex([])
-    for df in all_historical_data.values(): master_index = master_index.union(df.index)
+    # Union of every calendar in a single pass (instead of one union per ticker)
+    if all_historical_data:
+        master_index = pd.DatetimeIndex(pd.unique(np.concatenate([df.index.values for df in all_historical_data.values()]))).sort_values()
+    else:
+        master_index = pd.DatetimeIndex([])
     if vix_data is not None:
         vix_data = vix_data.reindex(master_index, method='ffill')
     if sp500_data is not None:
         sp500_data = sp500_data.reindex(master_index, method='ffill')
     if fed_funds_data is not None:
         fed_funds_data = fed_funds_data.reindex(master_index, method='ffill')
-    for ticker in all_historical_data: all_historical_data[ticker] = all_historical_data[ticker].reindex(master_index, method='ffill')
+    # 'traded' is False on the dates a ticker was forward-filled (exchange holidays, before its listing)
+    for ticker, df in all_historical_data.items():
+        all_historical_data[ticker] = align_frame(df, master_index)
 
     print("Step 3: Pre-calculating signals...")
     tickers_to_remove = []
@@ -149,35 +167,37 @@ def prepare_data(tickers):
                     df[col] = pd.to_numeric(df[col], errors='coerce')
 
             df.columns = [str(col).lower() for col in df.columns]
-            df["sma_200"] = ta.sma(df["close"], length=200)
-            df["sma_5"] = ta.sma(df["close"], length=5)
-            df["rsi_2"] = ta.rsi(df["close"], length=2)
-            df['log_returns'] = np.log(df['close'] / df['close'].shift(1))
-            df['hv_100'] = df['log_returns'].rolling(window=100).std() * np.sqrt(252)
-            # Ensure high, low, close are available for ADX
-            if all(c in df.columns for c in ['high', 'low', 'close']):
-                adx_df = ta.adx(df["high"], df["low"], df["close"], length=14)
-                if adx_df is not None and not adx_df.empty:
-                    df['adx_14'] = adx_df.iloc[:, 0]
-                else:
-                    df['adx_14'] = np.nan
-            else:
-                df['adx_14'] = np.nan
-            # Normal Strategy Signals
-            df["is_buy_signal_normal"] = (df["close"] > df["sma_200"]) & (df["rsi_2"] < 5) & (df["close"] < df["sma_5"])
-            df["is_exit_signal_normal"] = df["close"] > df["sma_5"]
-            
-            # Inverse Strategy Signals (for shorting)
-            # BUY short when: Price < 200-day SMA AND RSI(2) > 85 AND S&P 500 bearish
-            df["is_buy_signal_inverse"] = (df["close"] < df["sma_200"]) & (df["rsi_2"] > 85)
-            # SELL short when: RSI(2) < 30 OR Price < 5-day SMA
-            df["is_exit_signal_inverse"] = (df["rsi_2"] < 30) | (df["close"] < df["sma_5"])
+            missing_columns = [c for c in ['high', 'low', 'close'] if c not in df.columns]
+            if missing_columns:
+                raise KeyError(f"Missing columns: {missing_columns}")
         except Exception as e:
             print(f"Warning: Could not calculate indicators for {ticker}. It will be removed. Error: {e}")
             tickers_to_remove.append(ticker)
     
     for ticker in tickers_to_remove:
         del all_historical_data[ticker]
+
+    # All tickers share the master index, so the indicators are computed for the whole universe at once
+    if all_historical_data:
+        tickers = list(all_historical_data.keys())
+        close = np.column_stack([all_historical_data[t]["close"].to_numpy(dtype=float) for t in tickers])
+        high = np.column_stack([all_historical_data[t]["high"].to_numpy(dtype=float) for t in tickers])
+        low = np.column_stack([all_historical_data[t]["low"].to_numpy(dtype=float) for t in tickers])
+        traded = np.column_stack([all_historical_data[t]["traded"].to_numpy(dtype=bool) for t in tickers])
+        # Indicators are computed on each ticker's own trading calendar, so forward-filled bars do not count as sessions
+        columns = compute_indicators(close, high, low, traded=traded)
+        # Buy signals are folded with the point-in-time membership mask, so the entry scan needs no extra check
+        tradable = traded & membership.membership_mask(membership_intervals, master_index, tickers)
+
+        # Entry and exit signals of both strategies, evaluated on the whole panel at once (see rules.SWITCHING_RULES)
+        signals = rules.evaluate_rules(SIGNAL_RULES, {"close": close, "high": high, "low": low, **columns})
+        for name, values in signals.items():
+            columns[name] = (tradable if name.startswith("is_buy_signal") else traded) & values
+
+        for j, ticker in enumerate(tickers):
+            df = all_historical_data[ticker]
+            new_columns = pd.DataFrame({name: values[:, j] for name, values in columns.items()}, index=df.index)
+            all_historical_data[ticker] = pd.concat([df, new_columns], axis=1)
     
     if vix_data is not None:
         return all_historical_data, master_index, vix_data, sp500_data, fed_funds_data
@@ -192,6 +212,9 @@ def run_simulation(all_historical_data, master_index, prioritization_method, ini
     
     # Cacheo para optimización
     dates_list = [d for d in master_index if d >= pd.to_datetime(START_DATE)]
+    date_positions = {d: i for i, d in enumerate(master_index)}
+    market_regime = regime.get_regime(master_index, vix_data, sp500_data, VIX_PROTECTION, SP500_ENTRY_THRESHOLD,
+                                      start_date=START_DATE, initially_shut_off=initial_strategy_type == "INVERSE")
     
     for date in dates_list:
         
@@ -260,6 +283,8 @@ def run_simulation(all_historical_data, master_index, prioritization_method, ini
         # --- 4. CIERRE DE POSICIONES (Signals & Time Stop) ---
         for ticker in list(positions.keys()):
             signal_data = all_historical_data[ticker].loc[date]
+            if not signal_data["traded"]:
+                continue # The ticker's market is closed today (stale forward-filled bar)
             pos_info = positions[ticker]
             
             # Determinar qué señal de salida buscar según cómo se abrió la posición
@@ -301,45 +326,17 @@ def run_simulation(all_historical_data, master_index, prioritization_method, ini
                 del positions[ticker]
 
         # --- 5. LÓGICA DE CAMBIO DE ESTRATEGIA (Switching) ---
-        # Obtener valores escalares y seguros (pueden ser NaN)
-        vix_val = vix_data.loc[date, 'vix_close'] if (vix_data is not None and date in vix_data.index) else np.nan
-        sp500_price = sp500_data.loc[date, 'close'] if sp500_data is not None else np.nan
-        sp500_sma = sp500_data.loc[date, 'sma_200'] if sp500_data is not None else np.nan
-
-        # Asegurar que sean escalares y comparables
-        try:
-            vix_val_num = float(vix_val) if pd.notna(vix_val) else np.nan
-        except Exception:
-            vix_val_num = np.nan
-        try:
-            sp500_price_num = float(sp500_price) if pd.notna(sp500_price) else np.nan
-        except Exception:
-            sp500_price_num = np.nan
-        try:
-            sp500_sma_num = float(sp500_sma) if pd.notna(sp500_sma) else np.nan
-        except Exception:
-            sp500_sma_num = np.nan
-
-        has_sp500 = pd.notna(sp500_price_num) and pd.notna(sp500_sma_num)
-        is_sp500_bearish = (sp500_price_num < sp500_sma_num) if has_sp500 else False
-        is_sp500_strong = (sp500_price_num > (sp500_sma_num * SP500_ENTRY_THRESHOLD)) if has_sp500 else False
+        # El régimen (VIX / S&P 500) está precalculado en regime.py: "shut off" = INVERSE
+        i = date_positions[date]
+        is_sp500_strong = bool(market_regime["sp500_strong"][i])
 
         temp_prev_strategy = strategy_type
-
-        if strategy_type == "NORMAL":
-            # Switch to INVERSE?
-            vix_trigger = (VIX_PROTECTION > 0) and pd.notna(vix_val_num) and (vix_val_num > VIX_PROTECTION)
-            if vix_trigger or is_sp500_bearish:
-                strategy_type = "INVERSE"
-                if verbose:
-                    vix_disp = vix_val_num if pd.notna(vix_val_num) else float('nan')
-                    print(f"\033[94m{date.date()}: SWITCH -> INVERSE (VIX: {vix_disp:.2f} or Bearish Market)\033[0m")
-        else:
-            # Switch back to NORMAL?
-            vix_ok = ((VIX_PROTECTION == 0) or (pd.notna(vix_val_num) and (vix_val_num < (VIX_PROTECTION * 0.8))))
-            if vix_ok and is_sp500_strong:
-                strategy_type = "NORMAL"
-                if verbose: print(f"\033[92m{date.date()}: SWITCH -> NORMAL (Market Healthy)\033[0m")
+        strategy_type = "INVERSE" if market_regime["shut_off"][i] else "NORMAL"
+        if strategy_type != temp_prev_strategy and verbose:
+            if strategy_type == "INVERSE":
+                print(f"\033[94m{date.date()}: SWITCH -> INVERSE (VIX: {market_regime['vix'][i]:.2f} or Bearish Market)\033[0m")
+            else:
+                print(f"\033[92m{date.date()}: SWITCH -> NORMAL (Market Healthy)\033[0m")
 
         if strategy_type != temp_prev_strategy:
             strategy_type_history.append({"date": date, "from": temp_prev_strategy, "to": strategy_type})
@@ -659,7 +656,8 @@ def write_report(results, config, logs):
         for log_entry in logs:
             f.write(f"{remove_ansi_codes(log_entry)}\n")
 
-if __name__ == '__main__':
+def main():
+    """Runs the switching backtest configured at the top of this file and writes the report."""
     # Capture logs
     import sys
     from io import StringIO
@@ -687,9 +685,18 @@ if __name__ == '__main__':
             with open(fp, 'r') as f: all_tickers.extend([line.strip() for line in f.readlines() if line.strip()])
         except FileNotFoundError: print(f"Warning: Could not find ticker file: {fp}")
     unique_tickers = sorted(list(set(all_tickers)))
+
+    membership_intervals = None
+    if POINT_IN_TIME_UNIVERSE:
+        membership_intervals = membership.load_for_files(TICKER_FILES)
+        if membership_intervals is None:
+            print("Warning: No membership files found (run generate_tickers.py). Using the current tickers for the whole backtest.")
+        else:
+            # Former members are added so they can be traded while they were in the index
+            unique_tickers = sorted(set(unique_tickers) | set(membership.members_between(membership_intervals, START_DATE, END_DATE)))
     print(f"Loaded {len(unique_tickers)} unique tickers.")
     
-    all_historical_data, master_index, vix_data, sp500_data, fed_funds_data = prepare_data(unique_tickers)
+    all_historical_data, master_index, vix_data, sp500_data, fed_funds_data = prepare_data(unique_tickers, membership_intervals)
     
     if isinstance(PRIORITIZATION_METHOD, list) or PRIORITIZATION_METHOD == 'ALL':
         methods_to_run = PRIORITIZATION_METHOD if isinstance(PRIORITIZATION_METHOD, list) else ALL_METHODS
@@ -774,3 +781,7 @@ if __name__ == '__main__':
     elapsed_seconds = time.perf_counter() - start_time
     minutes, seconds = divmod(elapsed_seconds, 60)
     print(f"\nTotal execution time: {int(minutes)} minutes {seconds:.1f} seconds")
+    sys.stdout = original_stdout
+
+if __name__ == '__main__':
+    main()
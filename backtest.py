@@ -4,6 +4,8 @@ This script do a backtest of the trading strategy based on the RSI(2) mean-rever
 2. Setup: RSI(2) < 5 && Price < 5-day SMA && ADX(14) < 50 
 3. Sell: Price > 5-day SMA OR TIME_STOP
 
+STRATEGY_TYPE = "COMBINED" runs NORMAL longs and INVERSE shorts as sub-books of one portfolio (shared cash and slots).
+
 Shut off conditions: VIX > VIX_PROTECTION (if PANIC_BUTTON is True, sell all positions) OR S&P 500 < 200-day SMA
 
 Shut on conditions: VIX < VIX_PROTECTION * 0.8 AND S&P 500 > (200-day SMA * SP500_ENTRY_THRESHOLD)
@@ -11,17 +13,26 @@ Shut on conditions: VIX < VIX_PROTECTION * 0.8 AND S&P 500 > (200-day SMA * SP50
 
 import pandas as pd
 import numpy as np
-import yfinance as yf
-import pandas_ta as ta
 from datetime import datetime
 import math
+import copy
+import heapq
+import itertools
 import time
 import os
 import re
-import requests
 from io import StringIO
-from bs4 import BeautifulSoup
 from markets import get_tickers_from_csv
+import membership
+from indicators import compute_indicators, sma
+import profiling
+import result_cache
+import checkpoint
+import panel_store
+import regime
+import correlation
+import rules
+import downloader
 
 # ==============================================================================
 # --- CONFIGURATION ---
@@ -35,17 +46,61 @@ TICKER_FILES = ['data/ibex35.csv', 'data/sp500.csv', 'data/nasdaq100.csv']
 # ==============================================================================
 PRIORITIZATION_METHOD = 'RSI' # Options: 'RSI', 'RSI_DESC', 'A-Z', 'Z-A', 'HV_DESC', 'ADX_DESC', or 'ALL' or a list of methods
 ALL_METHODS = ['RSI', 'RSI_DESC', 'A-Z', 'Z-A', 'HV_DESC', 'ADX_DESC']
-STRATEGY_TYPE = "NORMAL" # Options: "NORMAL", "INVERSE", "BOTH"
+STRATEGY_TYPE = "NORMAL" # Options: "NORMAL", "INVERSE", "BOTH" (two separate runs), "COMBINED" (longs and shorts in one portfolio sharing capital and slots)
 # ==============================================================================
 VIX_PROTECTION = 45 # VIX threshold to shut off system (0 = disabled). System reactivates when VIX < threshold * 0.8
 PANIC_BUTTON = False # If True, sell all open positions when VIX protection is triggered
 TIME_STOP = 15 # Maximum number of days to hold a position (0 = disabled)
 SP500_ENTRY_THRESHOLD = 1.02 # S&P 500 must be above SMA(200) * this value to open positions (e.g., 1.01 = 1% above SMA)
 CLOSE_ON_SMA200_CROSS = False # If True, close open positions when price crosses SMA(200) against the strategy direction
+POINT_IN_TIME_UNIVERSE = False # If True, only buy tickers that were in their index on each date (run generate_tickers.py first to create data/membership/<market>.csv)
+CORRELATION_FILTER = 0 # Skip entries whose return correlation with a held position is above this value, e.g. 0.8 (0 = disabled)
+CORRELATION_WINDOW = 60 # Number of daily returns used for the correlation filter
+SIGNAL_RULES = rules.RULES # Entry/exit rules (see rules.py), e.g. dict(rules.RULES, is_exit_signal_normal="close > sma_5 or rsi_2 > 70") to try a variant
+# ==============================================================================
+PROFILE = False # If True, record wall time, call counts and peak memory (tracemalloc) per phase and save them as JSON next to the report
+PROFILE_PER_DAY = False # If True (and PROFILE is True), also record the time spent in each phase per simulated day
+PROFILE_CPROFILE = False # If True, wrap the run in cProfile and dump the stats (.prof) next to the report
+USE_RESULT_CACHE = True # If True, reuse the results of previous runs with the same configuration and data (stored in .cache/results)
+CHECKPOINT = False # If True, save the simulation state at END_DATE (in .cache/checkpoints) and resume from it when END_DATE is moved forward
+USE_PANEL_STORE = True # If True, store the prepared data (aligned prices, indicators and signals) in .cache/panels so other runs and processes can open it without recomputing it
 # ==============================================================================
 # ==============================================================================
 
-def prepare_data(tickers):
+def prepare_data(tickers, membership_intervals=None):
+    all_historical_data, vix_data, sp500_data, fed_funds_data = download_data(tickers)
+    panel_key = None
+    if USE_PANEL_STORE:
+        # Steps 2 and 3 are skipped if this data was already prepared (by this or another process)
+        import sys
+        panel_key = panel_store.make_key(sys.modules[__name__], all_historical_data, (vix_data, sp500_data, fed_funds_data), membership_intervals)
+        panel = panel_store.open_panel(panel_key)
+        if panel is not None:
+            print(f"Using the prepared data stored in {panel.path}")
+            all_historical_data = panel.to_frames()
+            master_index = panel.dates
+            vix_data, sp500_data, fed_funds_data = panel.market_frames()
+            if vix_data is not None:
+                return all_historical_data, master_index, vix_data, sp500_data, fed_funds_data
+            return all_historical_data, master_index, None, None, None
+
+    master_index, vix_data, sp500_data, fed_funds_data = align_data(all_historical_data, vix_data, sp500_data, fed_funds_data)
+    calculate_signals(all_historical_data, membership_intervals)
+    if panel_key is not None:
+        panel_store.save(panel_key, all_historical_data, master_index, (vix_data, sp500_data, fed_funds_data))
+
+    if vix_data is not None:
+        return all_historical_data, master_index, vix_data, sp500_data, fed_funds_data
+    return all_historical_data, master_index, None, None, None
+
+@profiling.profiled("download")
+def download_data(tickers):
+    """Step 1: downloads ticker, S&P 500, VIX and Fed Funds Rate data."""
+    # Network libraries are only imported when data is actually downloaded
+    import yfinance as yf
+    import requests
+    from bs4 import BeautifulSoup
+
     print(f"Step 1: Downloading historical data... (Leverage: 1:{LEVERAGE_FACTOR})")
     all_historical_data = {}
     data_start_date = pd.to_datetime(START_DATE) - pd.DateOffset(months=10)
@@ -59,7 +114,7 @@ def prepare_data(tickers):
         if isinstance(sp500_data.columns, pd.MultiIndex):
             sp500_data.columns = sp500_data.columns.droplevel(1)
         sp500_data.columns = [str(col).lower() for col in sp500_data.columns]
-        sp500_data['sma_200'] = ta.sma(sp500_data['close'], length=200)
+        sp500_data['sma_200'] = sma(sp500_data['close'], 200)
 
     # Download VIX data
     vix_data = yf.download('^VIX', start=data_start_date, end=END_DATE, progress=False)
@@ -108,34 +163,58 @@ def prepare_data(tickers):
         print(f"Warning: Could not process Fed Funds Rate data. Error: {e}. Swap calculation will be disabled.")
         fed_funds_data = None
 
-    # Batch download to be friendlier to the API
-    for i in range(0, len(tickers), 100):
-        batch = tickers[i:i+100]
-        try:
-            data_batch = yf.download(batch, start=data_start_date, end=END_DATE, progress=False, group_by='ticker')
-            if data_batch is not None and not data_batch.empty:
-                for ticker in batch:
-                    try:
-                        df = data_batch[ticker]
-                        if not df.empty and len(df) > 200:
-                            all_historical_data[ticker] = df.dropna(subset=['Open', 'High', 'Low', 'Close'])
-                    except KeyError:
-                        pass # Ticker might not be in the downloaded batch
-        except Exception as e: print(f"Could not download data for batch starting with {batch[0]}: {e}")
-        time.sleep(1)
+    # Rate-limited batch download with adaptive batch sizes and a retry queue (see downloader.py)
+    frames, download_status = downloader.download(tickers, downloader.yfinance_provider(data_start_date, END_DATE))
+    for ticker, df in frames.items():
+        if len(df) > 200:
+            all_historical_data[ticker] = df.dropna(subset=['Open', 'High', 'Low', 'Close'])
+    downloader.print_status_report(download_status)
     print(f"Successfully downloaded data for {len(all_historical_data)} tickers.")
+    return all_historical_data, vix_data, sp500_data, fed_funds_data
 
+def align_frame(df, master_index):
+    """
+    Forward-fills a ticker's (sorted) bars onto master_index and adds the 'traded' column: 1.0 on the
+    dates the ticker actually has a bar, 0.0 otherwise. Dates before its first bar are NaN.
+    """
+    traded = np.zeros(len(master_index), dtype=bool)
+    traded[np.searchsorted(master_index.values, df.index.values)] = True
+    # Position of the last bar on or before each date (-1 before the first bar)
+    last_bar = np.cumsum(traded) - 1
+    values = df.to_numpy(dtype=float)[np.maximum(last_bar, 0)]
+    values[last_bar < 0] = np.nan
+    # 'traded' is stored as a float so the frame stays a single block (much faster to build than adding a bool column)
+    return pd.DataFrame(np.column_stack([values, traded]), index=master_index, columns=list(df.columns) + ["traded"])
+
+@profiling.profiled("reindex")
+def align_data(all_historical_data, vix_data, sp500_data, fed_funds_data):
+    """
+    Step 2: reindexes every series onto the union of all trading dates (in place for tickers).
+    Each ticker gets a 'traded' column that is 0 on the dates it was forward-filled
+    (exchange holidays, dates before its listing), so no signal or exit happens on a stale bar.
+    """
     print("Step 2: Unifying and forward-filling data...")
-    master_index = pd.DatetimeIndex([])
-    for df in all_historical_data.values(): master_index = master_index.union(df.index)
+    # Union of every calendar in a single pass (instead of one union per ticker)
+    if all_historical_data:
+        master_index = pd.DatetimeIndex(pd.unique(np.concatenate([df.index.values for df in all_historical_data.values()]))).sort_values()
+    else:
+        master_index = pd.DatetimeIndex([])
     if vix_data is not None:
         vix_data = vix_data.reindex(master_index, method='ffill')
     if sp500_data is not None:
         sp500_data = sp500_data.reindex(master_index, method='ffill')
     if fed_funds_data is not None:
         fed_funds_data = fed_funds_data.reindex(master_index, method='ffill')
-    for ticker in all_historical_data: all_historical_data[ticker] = all_historical_data[ticker].reindex(master_index, method='ffill')
+    for ticker, df in all_historical_data.items():
+        all_historical_data[ticker] = align_frame(df, master_index)
+    return master_index, vix_data, sp500_data, fed_funds_data
 
+@profiling.profiled("signals")
+def calculate_signals(all_historical_data, membership_intervals=None):
+    """
+    Step 3: adds indicator and signal columns to every ticker (in place). Expects the frames aligned by align_data.
+    If membership intervals are given (see membership.py), buy signals only fire while the ticker is in its index.
+    """
     print("Step 3: Pre-calculating signals...")
     tickers_to_remove = []
     for ticker, df in all_historical_data.items():
@@ -146,71 +225,183 @@ def prepare_data(tickers):
                     df[col] = pd.to_numeric(df[col], errors='coerce')
             
             df.columns = [str(col).lower() for col in df.columns]
-
-            # Replace 0 or negative close prices to avoid log errors
-            df_close = df["close"].copy()
-            df_close[df_close <= 0] = 1e-10
-
-            df["sma_200"] = ta.sma(df_close, length=200)
-            df["sma_5"] = ta.sma(df_close, length=5)
-            df["rsi_2"] = ta.rsi(df_close, length=2)
-            df['log_returns'] = np.log(df_close / df_close.shift(1))
-            df['hv_100'] = df['log_returns'].rolling(window=100).std() * np.sqrt(252)
-            # Ensure high, low, close are available for ADX
-            if all(c in df.columns for c in ['high', 'low', 'close']):
-                adx_df = ta.adx(df["high"], df["low"], df["close"], length=14)
-                if adx_df is not None and not adx_df.empty:
-                    df['adx_14'] = adx_df.iloc[:, 0]
-                else:
-                    df['adx_14'] = np.nan
-            else:
-                df['adx_14'] = np.nan
-            # Normal Strategy Signals
-            adx_strong_trend = (df["adx_14"] >= 50)
-            df["is_buy_signal_normal"] = (df["close"] > df["sma_200"]) & (df["rsi_2"] < 5) & (df["close"] < df["sma_5"]) & ~adx_strong_trend
-            df["is_exit_signal_normal"] = df["close"] > df["sma_5"]
-            
-            # Inverse Strategy Signals
-            df["is_buy_signal_inverse"] = (df["close"] < df["sma_200"]) & (df["rsi_2"] > 95) & (df["close"] > df["sma_5"]) & ~adx_strong_trend
-            df["is_exit_signal_inverse"] = df["close"] < df["sma_5"]
+            missing_columns = [c for c in ['high', 'low', 'close'] if c not in df.columns]
+            if missing_columns:
+                raise KeyError(f"Missing columns: {missing_columns}")
         except Exception as e:
             print(f"Warning: Could not calculate indicators for {ticker}. It will be removed. Error: {e}")
             tickers_to_remove.append(ticker)
     
     for ticker in tickers_to_remove:
         del all_historical_data[ticker]
-    
-    if vix_data is not None:
-        return all_historical_data, master_index, vix_data, sp500_data, fed_funds_data
-    return all_historical_data, master_index, None, None, None
+    if not all_historical_data:
+        return
+
+    # All tickers share the master index, so the indicators are computed for the whole universe at once
+    tickers = list(all_historical_data.keys())
+    close = np.column_stack([all_historical_data[t]["close"].to_numpy(dtype=float) for t in tickers])
+    high = np.column_stack([all_historical_data[t]["high"].to_numpy(dtype=float) for t in tickers])
+    low = np.column_stack([all_historical_data[t]["low"].to_numpy(dtype=float) for t in tickers])
+    traded = np.column_stack([
+        all_historical_data[t]["traded"].to_numpy(dtype=bool) if "traded" in all_historical_data[t].columns else ~np.isnan(close[:, j])
+        for j, t in enumerate(tickers)])
+
+    # Replace 0 or negative close prices to avoid log errors
+    safe_close = np.where(close <= 0, 1e-10, close)
 
-def run_simulation(all_historical_data, master_index, prioritization_method, strategy_type, vix_data, sp500_data, fed_funds_data, verbose=True):
-    cash = INITIAL_CAPITAL
-    portfolio_value_history, positions, completed_trades = [], {}, []
-    system_shut_off = False
-    previous_system_state = False  # Track previous state to detect changes
+    # Indicators are computed on each ticker's own trading calendar, so forward-filled bars do not count as sessions
+    with profiling.phase("indicators"):
+        columns = compute_indicators(safe_close, high, low, traded=traded)
+
+    # Buy signals are folded with the point-in-time membership mask, so the entry scan needs no extra check
+    tradable = traded & membership.membership_mask(membership_intervals, all_historical_data[tickers[0]].index, tickers)
+
+    # Entry and exit signals of both strategies, evaluated on the whole panel at once (see rules.py)
+    signals = rules.evaluate_rules(SIGNAL_RULES, {"close": close, "high": high, "low": low, **columns})
+    for name, values in signals.items():
+        columns[name] = (tradable if name.startswith("is_buy_signal") else traded) & values
+
+    for j, ticker in enumerate(tickers):
+        df = all_historical_data[ticker]
+        new_columns = pd.DataFrame({name: values[:, j] for name, values in columns.items()}, index=df.index)
+        all_historical_data[ticker] = pd.concat([df, new_columns], axis=1)
+
+def compute_exit_bars(all_historical_data, master_index, side):
+    """
+    For every buy signal of `side`, finds the bar where the position would be closed if it is not liquidated
+    before (margin call, PANIC_BUTTON): the first later bar where the ticker trades and its exit signal fires,
+    TIME_STOP business days have passed or (if CLOSE_ON_SMA200_CROSS) the price crosses its SMA(200).
+
+    Returns:
+        dict: ticker -> {buy bar: (exit bar, exit price)}, with bars as positions in master_index.
+              Positions that never exit before the end of the data are not included.
+    """
+    num_bars = len(master_index)
+    # Business days since the first bar, so business days held = business_day[j] - business_day[i]
+    business_day = np.busday_count(master_index[0].date(), master_index.values.astype('datetime64[D]')) if num_bars else np.array([], dtype=int)
+    exit_bars = {}
+    for ticker, df in all_historical_data.items():
+        buy_bars = np.flatnonzero(df[f"is_buy_signal_{side.lower()}"].to_numpy(dtype=bool))
+        if len(buy_bars) == 0:
+            continue
+        close = df["close"].to_numpy(dtype=float)
+        traded = df["traded"].to_numpy(dtype=bool) if "traded" in df.columns else np.ones(num_bars, dtype=bool)
+        exits = df[f"is_exit_signal_{side.lower()}"].to_numpy(dtype=bool)
+        if CLOSE_ON_SMA200_CROSS:
+            sma_200 = df["sma_200"].to_numpy(dtype=float)
+            with np.errstate(invalid='ignore'):
+                exits = exits | ((close > sma_200) if side == "INVERSE" else (close < sma_200))
+        exit_signal_bars = np.flatnonzero(traded & exits)
+        traded_bars = np.flatnonzero(traded)
+
+        # First exit signal after the buy bar
+        positions = np.searchsorted(exit_signal_bars, buy_bars, side='right')
+        exit_bar = np.where(positions < len(exit_signal_bars), exit_signal_bars[np.minimum(positions, len(exit_signal_bars) - 1)], num_bars)
+        # First traded bar once TIME_STOP business days have passed
+        if TIME_STOP > 0:
+            earliest = np.maximum(np.searchsorted(business_day, business_day[buy_bars] + TIME_STOP, side='left'), buy_bars + 1)
+            positions = np.searchsorted(traded_bars, earliest, side='left')
+            time_stop_bar = np.where(positions < len(traded_bars), traded_bars[np.minimum(positions, len(traded_bars) - 1)], num_bars)
+            exit_bar = np.minimum(exit_bar, time_stop_bar)
+
+        found = exit_bar < num_bars
+        exit_bars[ticker] = dict(zip(buy_bars[found].tolist(), zip(exit_bar[found].tolist(), close[exit_bar[found]].tolist())))
+    return exit_bars
+
+def trade_record(ticker, pos_info, sell_date, duration, pnl):
+    """Returns the completed trade of a closed position. With the open positions, the trades are the position ledger used by reconstruct_equity."""
+    return {"ticker": ticker, "duration": duration, "pnl": pnl, "investment_cost": pos_info["investment_cost"],
+            "rsi": pos_info.get("rsi"), "hv": pos_info.get("hv"), "adx": pos_info.get("adx"), "sell_date": sell_date,
+            "strategy": pos_info["side"], "buy_date": pos_info["buy_date"], "quantity": pos_info["quantity"],
+            "notional_value": pos_info["notional_value"], "accumulated_swap": pos_info["accumulated_swap"]}
+
+def position_pnl(pos_info, price):
+    """Returns the P&L of a position at `price` before swap (INVERSE positions are shorts)."""
+    if pos_info["side"] == "INVERSE":
+        return pos_info["notional_value"] - (price * pos_info["quantity"])
+    return (price * pos_info["quantity"]) - pos_info["notional_value"]
+
+@profiling.profiled("simulation")
+def run_simulation(all_historical_data, master_index, prioritization_method, strategy_type, vix_data, sp500_data, fed_funds_data, verbose=True, initial_state=None, end_date=None, stop_condition=None):
+    """
+    Simulates the strategy day by day. If `initial_state` (the "state" of a previous result, see checkpoint.py)
+    is given, the simulation resumes after its last bar instead of starting from START_DATE.
+    If `end_date` is given, the simulation stops after that date (and can be resumed from its state later).
+    `stop_condition(date, portfolio_value)` is called every day with the start-of-day value; if it returns a
+    reason, the simulation stops there with its positions open and the reason is stored in state["stopped"].
+    With strategy_type "COMBINED", NORMAL longs and INVERSE shorts are sub-books of the same portfolio:
+    they share the cash and MAX_CONCURRENT_POSITIONS, and a ticker is held on one side at a time.
+    """
+    combined = strategy_type == "COMBINED"
+    sides = ["NORMAL", "INVERSE"] if combined else [strategy_type]
+    if initial_state is None:
+        cash = INITIAL_CAPITAL
+        portfolio_value_history, positions, completed_trades = [], {}, []
+        system_shut_off = False
+        previous_system_state = False  # Track previous state to detect changes
+        last_date = None
+        halted = False
+        stop_reason = None
+    else:
+        state = copy.deepcopy(initial_state)
+        cash = state["cash"]
+        portfolio_value_history, positions, completed_trades = state["portfolio_value_history"], state["positions"], state["completed_trades"]
+        system_shut_off = state["system_shut_off"]
+        previous_system_state = state["previous_system_state"]
+        last_date = state["last_date"]
+        halted = state["halted"]
+        stop_reason = state.get("stopped")
+    start_date = pd.to_datetime(START_DATE)
+    end_date = pd.Timestamp(end_date) if end_date is not None else None
     
-    for date in master_index:
-        if date < pd.to_datetime(START_DATE): continue
+    # The system state only depends on the market data, so it is computed once for the whole period
+    market_regime = regime.get_regime(master_index, vix_data, sp500_data, VIX_PROTECTION, SP500_ENTRY_THRESHOLD, start_date=START_DATE)
+
+    # Close prices as one array (dates, tickers) for the daily mark-to-market
+    ticker_columns = {ticker: j for j, ticker in enumerate(all_historical_data)}
+    close_panel = np.column_stack([df["close"].to_numpy(dtype=float) for df in all_historical_data.values()]) if all_historical_data else np.empty((len(master_index), 0))
+    # Rolling return correlations with the held positions, updated incrementally (see correlation.py)
+    correlation_tracker = correlation.RollingCorrelation(close_panel, ticker_columns, CORRELATION_WINDOW) if CORRELATION_FILTER > 0 else None
+
+    # Exit schedule: (exit bar, opening order, ticker, position), so positions due the same day close in opening order
+    exit_bars = {side: compute_exit_bars(all_historical_data, master_index, side) for side in sides}
+    bar_positions = {date: i for i, date in enumerate(master_index)}
+    exit_queue, opening_order = [], itertools.count()
+    def schedule_exit(ticker, pos_info):
+        scheduled = exit_bars[pos_info["side"]].get(ticker, {}).get(bar_positions[pos_info["buy_date"]])
+        if scheduled is not None:
+            heapq.heappush(exit_queue, (scheduled[0], next(opening_order), ticker, pos_info))
+    for ticker, pos_info in positions.items():
+        schedule_exit(ticker, pos_info)
+
+    for i, date in enumerate(master_index):
+        if halted: break
+        if date < start_date: continue
+        if last_date is not None and date <= last_date: continue
+        if end_date is not None and date > end_date: break
+        last_date = date
+        profiling.start_day(date)
 
         # --- SWAP CALCULATION for leveraged positions ---
-        if LEVERAGE_FACTOR > 1 and fed_funds_data is not None:
-            if date in fed_funds_data.index:
-                current_fed_rate = fed_funds_data.loc[date, 'fed_rate']
-                if pd.notna(current_fed_rate):
-                    # Broker's spread is 2.5%
-                    swap_rate_annual = (current_fed_rate / 100) + 0.025
-                    for ticker, pos_data in positions.items():
-                        daily_swap = (pos_data["notional_value"] * swap_rate_annual) / 360
-                        pos_data["accumulated_swap"] += daily_swap
+        with profiling.phase("swap_accrual"):
+            if LEVERAGE_FACTOR > 1 and fed_funds_data is not None:
+                if date in fed_funds_data.index:
+                    current_fed_rate = fed_funds_data.loc[date, 'fed_rate']
+                    if pd.notna(current_fed_rate):
+                        # Broker's spread is 2.5%
+                        swap_rate_annual = (current_fed_rate / 100) + 0.025
+                        for ticker, pos_data in positions.items():
+                            daily_swap = (pos_data["notional_value"] * swap_rate_annual) / 360
+                            pos_data["accumulated_swap"] += daily_swap
 
         # Calculate portfolio value at the start of the day to check for bankruptcy
-        equity_in_positions = 0
-        for ticker, pos_data in positions.items():
-            current_price = all_historical_data[ticker].loc[date]['close']
-            unrealized_pnl = (current_price * pos_data["quantity"]) - pos_data["notional_value"]
-            equity_in_positions += pos_data["investment_cost"] + unrealized_pnl - pos_data["accumulated_swap"]
-        total_portfolio_value = cash + equity_in_positions
+        with profiling.phase("equity"):
+            equity_in_positions = 0
+            for ticker, pos_data in positions.items():
+                current_price = close_panel[i, ticker_columns[ticker]]
+                unrealized_pnl = position_pnl(pos_data, current_price)
+                equity_in_positions += pos_data["investment_cost"] + unrealized_pnl - pos_data["accumulated_swap"]
+            total_portfolio_value = cash + equity_in_positions
 
         # Halt simulation if bankrupt
         if total_portfolio_value <= 0:
@@ -218,202 +409,281 @@ def run_simulation(all_historical_data, master_index, prioritization_method, str
             for ticker in list(positions.keys()):
                 pos_info = positions[ticker]
                 signal_data = all_historical_data[ticker].loc[date]
-                pnl = (pos_info["notional_value"] - (signal_data["close"] * pos_info["quantity"])) if strategy_type == "INVERSE" else ((signal_data["close"] * pos_info["quantity"]) - pos_info["notional_value"])
+                pnl = position_pnl(pos_info, signal_data["close"])
                 pnl -= pos_info["accumulated_swap"]
                 cash += pos_info["investment_cost"] + pnl
                 duration = np.busday_count(pos_info["buy_date"].date(), date.date())  # Business days
-                completed_trades.append({"ticker": ticker, "duration": duration, "pnl": pnl, "investment_cost": pos_info["investment_cost"], "rsi": pos_info.get("rsi"), "hv": pos_info.get("hv"), "adx": pos_info.get("adx"), "sell_date": date})
+                completed_trades.append(trade_record(ticker, pos_info, date, duration, pnl))
                 print(f"{date.date()}: LIQUIDATION of {'{:.2f}'.format(pos_info['quantity'])} {ticker} at {signal_data['close']:.2f} | P&L: ${pnl:,.2f} (Swap: ${pos_info['accumulated_swap']:,.2f})")
                 del positions[ticker]
             
             # Record final value after liquidation and halt
             portfolio_value_history.append({"date": date, "value": cash}) # Final value is remaining cash
+            halted = True
             break
 
+        # Early termination (e.g. search.py stops runs that can no longer compete) before the day's trades
+        if stop_condition is not None:
+            stop_reason = stop_condition(date, total_portfolio_value)
+            if stop_reason:
+                portfolio_value_history.append({"date": date, "value": total_portfolio_value})
+                break
+
         # Close positions (including TIME_STOP check) - this ALWAYS runs regardless of system_shut_off
-        for ticker in list(positions.keys()):
-            signal_data = all_historical_data[ticker].loc[date]
-            exit_signal = f"is_exit_signal_{strategy_type.lower()}"
-            pos_info = positions[ticker]
-            
-            # Check for TIME_STOP condition (business days only, excluding weekends)
-            time_stop_triggered = False
-            if TIME_STOP > 0:
-                days_held = np.busday_count(pos_info["buy_date"].date(), date.date())
-                if days_held >= TIME_STOP:
-                    time_stop_triggered = True
-
-            sma200_cross_triggered = False
-            if CLOSE_ON_SMA200_CROSS and pd.notna(signal_data["close"]) and pd.notna(signal_data["sma_200"]):
-                if strategy_type == "INVERSE":
-                    sma200_cross_triggered = signal_data["close"] > signal_data["sma_200"]
-                else:
-                    sma200_cross_triggered = signal_data["close"] < signal_data["sma_200"]
-            
-            if signal_data[exit_signal] or time_stop_triggered or sma200_cross_triggered:
-                pnl = (pos_info["notional_value"] - (signal_data["close"] * pos_info["quantity"])) if strategy_type == "INVERSE" else ((signal_data["close"] * pos_info["quantity"]) - pos_info["notional_value"])
+        # The exit bar of every position is known when it is opened, so only the positions scheduled for today are checked
+        with profiling.phase("exit_scan"):
+            while exit_queue and exit_queue[0][0] <= i:
+                _, _, ticker, pos_info = heapq.heappop(exit_queue)
+                if positions.get(ticker) is not pos_info:
+                    continue # Already liquidated (margin call or PANIC_BUTTON)
+                signal_data = all_historical_data[ticker].loc[date]
+                duration = np.busday_count(pos_info["buy_date"].date(), date.date())  # Use business days
+                time_stop_triggered = TIME_STOP > 0 and duration >= TIME_STOP
+                sma200_cross_triggered = False
+                if CLOSE_ON_SMA200_CROSS and pd.notna(signal_data["close"]) and pd.notna(signal_data["sma_200"]):
+                    if pos_info["side"] == "INVERSE":
+                        sma200_cross_triggered = signal_data["close"] > signal_data["sma_200"]
+                    else:
+                        sma200_cross_triggered = signal_data["close"] < signal_data["sma_200"]
+
+                pnl = position_pnl(pos_info, signal_data["close"])
                 pnl -= pos_info["accumulated_swap"]
                 cash += pos_info["investment_cost"] + pnl
-                duration = np.busday_count(pos_info["buy_date"].date(), date.date())  # Use business days
-                completed_trades.append({"ticker": ticker, "duration": duration, "pnl": pnl, "investment_cost": pos_info["investment_cost"], "rsi": pos_info.get("rsi"), "hv": pos_info.get("hv"), "adx": pos_info.get("adx"), "sell_date": date})
+                completed_trades.append(trade_record(ticker, pos_info, date, duration, pnl))
                 if time_stop_triggered:
                     exit_reason = "TIME_STOP"
                 elif sma200_cross_triggered:
                     exit_reason = "SMA200 Cross"
+                elif SIGNAL_RULES == rules.RULES:
+                    exit_reason = "Price < SMA(5)" if pos_info["side"] == "INVERSE" else "Price > SMA(5)"
                 else:
-                    exit_reason = "Price < SMA(5)" if strategy_type == "INVERSE" else "Price > SMA(5)"
+                    exit_reason = "Exit: " + SIGNAL_RULES[f"is_exit_signal_{pos_info['side'].lower()}"]
                 if verbose:
                     percent_pnl = (pnl / pos_info['investment_cost']) * 100 if pos_info['investment_cost'] > 0 else 0
-                    print(f"{date.date()}: SELL {'{:.2f}'.format(pos_info['quantity'])} of {ticker} at {signal_data['close']:.2f} | P&L: ${pnl:,.2f} (Swap: ${pos_info['accumulated_swap']:,.2f}) | %PL: {percent_pnl:.2f}% ({exit_reason}) [Days: {duration}]")
+                    side_label = f" [{pos_info['side']}]" if combined else ""
+                    print(f"{date.date()}: SELL {'{:.2f}'.format(pos_info['quantity'])} of {ticker} at {signal_data['close']:.2f} | P&L: ${pnl:,.2f} (Swap: ${pos_info['accumulated_swap']:,.2f}) | %PL: {percent_pnl:.2f}% ({exit_reason}) [Days: {duration}]{side_label}")
                 del positions[ticker]
 
-        # VIX Protection and System State Logic - this affects NEW ENTRIES only
-        # Always evaluate system state based on VIX (if enabled) and S&P 500 trend
-        vix_value = None
-        vix_reactivation_threshold = None
-        
-        if VIX_PROTECTION > 0 and vix_data is not None and date in vix_data.index:
-            vix_value = vix_data.loc[date, 'vix_close']
-            if isinstance(vix_value, pd.Series):
-                vix_value = vix_value.iloc[0]
-            vix_reactivation_threshold = VIX_PROTECTION * 0.8
-        
-        # Get S&P 500 data for trend analysis (always needed for system state)
-        sp500_price = sp500_data.loc[date, 'close'] if sp500_data is not None else None
-        sp500_sma200 = sp500_data.loc[date, 'sma_200'] if sp500_data is not None else None
-        if isinstance(sp500_price, pd.Series):
-            sp500_price = sp500_price.iloc[0]
-        if isinstance(sp500_sma200, pd.Series):
-            sp500_sma200 = sp500_sma200.iloc[0]
-        
-        # Shutdown condition: Price < SMA200
-        is_sp500_bearish = pd.notna(sp500_price) and pd.notna(sp500_sma200) and sp500_price < sp500_sma200
-        
-        # Reactivation condition: Price > SMA200 * SP500_ENTRY_THRESHOLD
-        is_sp500_strong = pd.notna(sp500_price) and pd.notna(sp500_sma200) and sp500_price > (sp500_sma200 * SP500_ENTRY_THRESHOLD)
-        
-        # State change logic
-        if not system_shut_off:
-            # Check if system should shut off
-            if vix_value is not None and vix_value > VIX_PROTECTION:
-                system_shut_off = True
+        # System state (VIX protection and S&P 500 trend) - precomputed by regime.py, it affects NEW ENTRIES only
+        with profiling.phase("regime"):
+            event = market_regime["event"][i]
+            system_shut_off = bool(market_regime["shut_off"][i])
+            is_sp500_strong = bool(market_regime["sp500_strong"][i])
+            vix_value = market_regime["vix"][i]
+            sp500_price, sp500_sma200 = market_regime["sp500_close"][i], market_regime["sp500_sma"][i]
+            sp500_price_str = f"{sp500_price:.2f}" if pd.notna(sp500_price) else "N/A"
+            sp500_sma200_str = f"{sp500_sma200:.2f}" if pd.notna(sp500_sma200) else "N/A"
+
+            if event == regime.SHUT_OFF_VIX:
                 print(f"\033[93m{date.date()}: System shut off because VIX > {VIX_PROTECTION} (VIX: {vix_value:.2f})\033[0m")
                 if PANIC_BUTTON and positions:
                     print(f"\033[91m{date.date()}: PANIC BUTTON ACTIVATED. Liquidating all open positions.\033[0m")
                     for ticker in list(positions.keys()):
                         pos_info = positions[ticker]
                         signal_data = all_historical_data[ticker].loc[date]
-                        pnl = (pos_info["notional_value"] - (signal_data["close"] * pos_info["quantity"])) if strategy_type == "INVERSE" else ((signal_data["close"] * pos_info["quantity"]) - pos_info["notional_value"])
+                        pnl = position_pnl(pos_info, signal_data["close"])
                         pnl -= pos_info["accumulated_swap"]
                         cash += pos_info["investment_cost"] + pnl
                         duration = np.busday_count(pos_info["buy_date"].date(), date.date())  # Business days
-                        completed_trades.append({"ticker": ticker, "duration": duration, "pnl": pnl, "investment_cost": pos_info["investment_cost"], "rsi": pos_info.get("rsi"), "hv": pos_info.get("hv"), "adx": pos_info.get("adx"), "sell_date": date})
+                        completed_trades.append(trade_record(ticker, pos_info, date, duration, pnl))
                         print(f"\033[91m{date.date()}: VIX LIQUIDATION of {'{:.2f}'.format(pos_info['quantity'])} {ticker} at {signal_data['close']:.2f} | P&L: ${pnl:,.2f} (Swap: ${pos_info['accumulated_swap']:,.2f})\033[0m")
                         del positions[ticker]
-            elif is_sp500_bearish:
-                system_shut_off = True
-                sp500_price_str = f"{sp500_price:.2f}" if pd.notna(sp500_price) else "N/A"
-                sp500_sma200_str = f"{sp500_sma200:.2f}" if pd.notna(sp500_sma200) else "N/A"
+            elif event == regime.SHUT_OFF_SP500:
                 print(f"\033[93m{date.date()}: System shut off because S&P500 downtrend (Price: {sp500_price_str} < SMA200: {sp500_sma200_str})\033[0m")
-        else: 
-            # System is shut off - check if it should turn back on
-            vix_condition_ok = vix_value is None or vix_value < vix_reactivation_threshold
-            sp500_condition_ok = is_sp500_strong
-            
-            if vix_condition_ok and sp500_condition_ok:
-                system_shut_off = False
-                sp500_price_str = f"{sp500_price:.2f}" if pd.notna(sp500_price) else "N/A"
-                sp500_sma200_str = f"{sp500_sma200:.2f}" if pd.notna(sp500_sma200) else "N/A"
+            elif event == regime.SHUT_ON:
                 sp500_threshold_str = f"{sp500_sma200 * SP500_ENTRY_THRESHOLD:.2f}" if pd.notna(sp500_sma200) else "N/A"
-                if vix_value is not None:
-                    print(f"\033[92m{date.date()}: System shut on | VIX: {vix_value:.2f} < {vix_reactivation_threshold:.2f} | S&P500: {sp500_price_str} > SMA200: {sp500_sma200_str} (threshold: {sp500_threshold_str})\033[0m")
+                if market_regime["vix_known"][i]:
+                    print(f"\033[92m{date.date()}: System shut on | VIX: {vix_value:.2f} < {VIX_PROTECTION * 0.8:.2f} | S&P500: {sp500_price_str} > SMA200: {sp500_sma200_str} (threshold: {sp500_threshold_str})\033[0m")
                 else:
                     print(f"\033[92m{date.date()}: System shut on | S&P500: {sp500_price_str} > SMA200: {sp500_sma200_str} (threshold: {sp500_threshold_str})\033[0m")
         
-        previous_system_state = system_shut_off
+            previous_system_state = system_shut_off
         
         # Skip opening new positions if system is shut off
         if system_shut_off:
             portfolio_value_history.append({"date": date, "value": total_portfolio_value})
             continue
 
-        open_slots = MAX_CONCURRENT_POSITIONS - len(positions)
-        if open_slots > 0:
-            # S&P 500 Market Trend Filter - use the is_sp500_strong variable calculated earlier
-            if not is_sp500_strong:
-                portfolio_value_history.append({"date": date, "value": total_portfolio_value})
-                continue
+        with profiling.phase("entry_scan"):
+            open_slots = MAX_CONCURRENT_POSITIONS - len(positions)
+            if open_slots > 0:
+                # S&P 500 Market Trend Filter - use the is_sp500_strong variable calculated earlier
+                if not is_sp500_strong:
+                    portfolio_value_history.append({"date": date, "value": total_portfolio_value})
+                    continue
             
-            potential_buys = []
-            for ticker in all_historical_data.keys():
-                if ticker not in positions:
-                    signal_data = all_historical_data[ticker].loc[date]
-                    buy_signal = f"is_buy_signal_{strategy_type.lower()}"
-                    if signal_data[buy_signal] and not pd.isna(signal_data["close"]):
-                        potential_buys.append({
-                            "ticker": ticker,
-                            "rsi": signal_data["rsi_2"],
-                            "price": signal_data["close"],
-                            "hv": signal_data["hv_100"],
-                            "adx": signal_data["adx_14"]
-                        })
+                potential_buys = []
+                for ticker in all_historical_data.keys():
+                    if ticker not in positions:
+                        signal_data = all_historical_data[ticker].loc[date]
+                        for side in sides:
+                            if signal_data[f"is_buy_signal_{side.lower()}"] and not pd.isna(signal_data["close"]):
+                                potential_buys.append({
+                                    "ticker": ticker,
+                                    "side": side,
+                                    "rsi": signal_data["rsi_2"],
+                                    # In COMBINED mode shorts are ranked by their distance to RSI 100, so both sides compete on how extreme the setup is
+                                    "rank_rsi": 100 - signal_data["rsi_2"] if combined and side == "INVERSE" else signal_data["rsi_2"],
+                                    "price": signal_data["close"],
+                                    "hv": signal_data["hv_100"],
+                                    "adx": signal_data["adx_14"]
+                                })
+                                break
             
-            # Sort potential buys based on the configured method
-            if prioritization_method == 'RSI':
-                sorted_buys = sorted(potential_buys, key=lambda x: x['rsi'])
-            elif prioritization_method == 'RSI_DESC':
-                sorted_buys = sorted(potential_buys, key=lambda x: x['rsi'], reverse=True)
-            elif prioritization_method == 'A-Z':
-                sorted_buys = sorted(potential_buys, key=lambda x: x['ticker'])
-            elif prioritization_method == 'Z-A':
-                sorted_buys = sorted(potential_buys, key=lambda x: x['ticker'], reverse=True)
-            elif prioritization_method == 'HV_DESC':
-                sorted_buys = sorted(potential_buys, key=lambda x: x['hv'] if not pd.isna(x['hv']) else 0, reverse=True)
-            elif prioritization_method == 'ADX_DESC':
-                sorted_buys = sorted(potential_buys, key=lambda x: x['adx'] if not pd.isna(x['adx']) else 0, reverse=True)
-            else: # Default to RSI ASC if method is unknown
-                sorted_buys = sorted(potential_buys, key=lambda x: x['rsi'])
-
-            for buy in sorted_buys:
-                if len(positions) >= MAX_CONCURRENT_POSITIONS: break
+                # Sort potential buys based on the configured method
+                if prioritization_method == 'RSI':
+                    sorted_buys = sorted(potential_buys, key=lambda x: x['rank_rsi'])
+                elif prioritization_method == 'RSI_DESC':
+                    sorted_buys = sorted(potential_buys, key=lambda x: x['rank_rsi'], reverse=True)
+                elif prioritization_method == 'A-Z':
+                    sorted_buys = sorted(potential_buys, key=lambda x: x['ticker'])
+                elif prioritization_method == 'Z-A':
+                    sorted_buys = sorted(potential_buys, key=lambda x: x['ticker'], reverse=True)
+                elif prioritization_method == 'HV_DESC':
+                    sorted_buys = sorted(potential_buys, key=lambda x: x['hv'] if not pd.isna(x['hv']) else 0, reverse=True)
+                elif prioritization_method == 'ADX_DESC':
+                    sorted_buys = sorted(potential_buys, key=lambda x: x['adx'] if not pd.isna(x['adx']) else 0, reverse=True)
+                else: # Default to RSI ASC if method is unknown
+                    sorted_buys = sorted(potential_buys, key=lambda x: x['rank_rsi'])
+
+                if correlation_tracker is not None and sorted_buys:
+                    correlation_tracker.advance(i, positions)
+
+                for buy in sorted_buys:
+                    if len(positions) >= MAX_CONCURRENT_POSITIONS: break
                 
-                # Recalculate open slots and cash per slot for each new trade
-                open_slots = MAX_CONCURRENT_POSITIONS - len(positions)
-                if open_slots <= 0: continue
-                cash_per_slot = cash / open_slots
-
-                ticker = buy["ticker"]
-                price = buy["price"]
-
-                target_notional = cash_per_slot * LEVERAGE_FACTOR
-                quantity = math.floor(target_notional / price) if LEVERAGE_FACTOR > 1 else target_notional / price
-                if quantity == 0: continue
-
-                actual_notional_value = quantity * price
-                actual_investment_cost = actual_notional_value / LEVERAGE_FACTOR
-                if actual_investment_cost < 5.0: continue # Minimum trade size
-
-                if cash >= actual_investment_cost:
-                    cash -= actual_investment_cost
-                    positions[ticker] = {
-                        "quantity": quantity,
-                        "buy_date": date,
-                        "investment_cost": actual_investment_cost,
-                        "notional_value": actual_notional_value,
-                        "accumulated_swap": 0,
-                        "rsi": buy['rsi'],
-                        "hv": buy.get('hv', 0),
-                        "adx": buy.get('adx', 0)
-                    }
-                    if verbose:
-                        print(f"{date.date()}: BUY {'{:.2f}'.format(quantity)} of {ticker} at {price:.2f} | Cost: ${actual_investment_cost:,.2f} (Notional: ${actual_notional_value:,.2f}, RSI: {buy['rsi']:.2f}, HV: {buy.get('hv', 0):.2f}, ADX: {buy.get('adx', 0):.2f})")
+                    # Recalculate open slots and cash per slot for each new trade
+                    open_slots = MAX_CONCURRENT_POSITIONS - len(positions)
+                    if open_slots <= 0: continue
+                    cash_per_slot = cash / open_slots
+
+                    ticker = buy["ticker"]
+                    price = buy["price"]
+
+                    if correlation_tracker is not None:
+                        max_correlation, correlated_ticker = correlation_tracker.max_correlation(ticker, buy["side"], positions)
+                        if max_correlation > CORRELATION_FILTER:
+                            if verbose:
+                                print(f"{date.date()}: SKIP {ticker} | Correlation {max_correlation:.2f} with {correlated_ticker} > {CORRELATION_FILTER}")
+                            continue
+
+                    target_notional = cash_per_slot * LEVERAGE_FACTOR
+                    quantity = math.floor(target_notional / price) if LEVERAGE_FACTOR > 1 else target_notional / price
+                    if quantity == 0: continue
+
+                    actual_notional_value = quantity * price
+                    actual_investment_cost = actual_notional_value / LEVERAGE_FACTOR
+                    if actual_investment_cost < 5.0: continue # Minimum trade size
+
+                    if cash >= actual_investment_cost:
+                        cash -= actual_investment_cost
+                        positions[ticker] = {
+                            "quantity": quantity,
+                            "buy_date": date,
+                            "investment_cost": actual_investment_cost,
+                            "notional_value": actual_notional_value,
+                            "accumulated_swap": 0,
+                            "side": buy["side"],
+                            "rsi": buy['rsi'],
+                            "hv": buy.get('hv', 0),
+                            "adx": buy.get('adx', 0)
+                        }
+                        schedule_exit(ticker, positions[ticker])
+                        if verbose:
+                            print(f"{date.date()}: BUY {'{:.2f}'.format(quantity)} of {ticker} at {price:.2f} | Cost: ${actual_investment_cost:,.2f} (Notional: ${actual_notional_value:,.2f}, RSI: {buy['rsi']:.2f}, HV: {buy.get('hv', 0):.2f}, ADX: {buy.get('adx', 0):.2f}){' [' + buy['side'] + ']' if combined else ''}")
         
         portfolio_value_history.append({"date": date, "value": total_portfolio_value})
 
     portfolio_df = pd.DataFrame(portfolio_value_history).set_index("date")
     calendar_range = pd.date_range(start=START_DATE, end=END_DATE)
     portfolio_df = portfolio_df.reindex(calendar_range, method='ffill')
-    return {"portfolio_df": portfolio_df, "completed_trades": completed_trades, "open_positions": positions}
+    state = {
+        "cash": cash, "positions": positions, "completed_trades": completed_trades,
+        "portfolio_value_history": portfolio_value_history, "system_shut_off": system_shut_off,
+        "previous_system_state": previous_system_state, "last_date": last_date, "halted": halted,
+        "stopped": stop_reason
+    }
+    results = {"portfolio_df": portfolio_df, "completed_trades": completed_trades, "open_positions": positions, "state": state}
+    results["equity"] = reconstruct_equity(results, all_historical_data, master_index, fed_funds_data)
+    return results
+
+def reconstruct_equity(results, all_historical_data, master_index, fed_funds_data):
+    """
+    Rebuilds the daily mark-to-market of a run from its position ledger (completed trades and open positions)
+    with cumulative sums over the close prices, without looping over the days.
+
+    Returns:
+        pd.DataFrame: Indexed by the simulated dates, with 'value' (portfolio value at the start of the day, as
+        recorded by run_simulation), 'cash', 'exposure' (market value of the open positions / value) and
+        'drawdown' (value / running maximum - 1).
+    """
+    history = results["state"]["portfolio_value_history"]
+    if not history:
+        return pd.DataFrame(columns=["value", "cash", "exposure", "drawdown"], dtype=float)
+    first = master_index.get_loc(history[0]["date"])
+    dates = master_index[first:master_index.get_loc(history[-1]["date"]) + 1]
+    num_days = len(dates)
+
+    # Ledger: one row per position, open on the days (entry, exit] (the value is taken before the day's exits)
+    ledger = [(t["ticker"], t["strategy"], t["buy_date"], t["sell_date"], t["quantity"], t["notional_value"], t["investment_cost"], t["investment_cost"] + t["pnl"])
+              for t in results["completed_trades"]]
+    ledger += [(ticker, pos["side"], pos["buy_date"], None, pos["quantity"], pos["notional_value"], pos["investment_cost"], 0.0)
+               for ticker, pos in results["open_positions"].items()]
+    tickers = sorted(set(row[0] for row in ledger))
+    columns = {ticker: k for k, ticker in enumerate(tickers)}
+    entry = dates.get_indexer([row[2] for row in ledger])
+    exit = np.array([num_days - 1 if row[3] is None else dates.get_loc(row[3]) for row in ledger], dtype=int)
+    column = np.array([columns[row[0]] for row in ledger], dtype=int)
+    sign = np.array([-1.0 if row[1] == "INVERSE" else 1.0 for row in ledger])
+    quantity, notional, cost, proceeds = (np.array([row[k] for row in ledger], dtype=float) for k in (4, 5, 6, 7))
+    closed = np.array([row[3] is not None for row in ledger], dtype=bool)
+
+    # Daily swap rate per unit of notional, accrued at the start of every day a position is held
+    swap_rate = np.zeros(num_days)
+    if LEVERAGE_FACTOR > 1 and fed_funds_data is not None:
+        fed_rate = fed_funds_data['fed_rate'].reindex(dates).to_numpy(dtype=float)
+        swap_rate = np.where(np.isnan(fed_rate), 0.0, ((fed_rate / 100) + 0.025) / 360)
+    cumulative_swap_rate = np.cumsum(swap_rate)
+
+    def open_sum(values):
+        """Sum of `values` over the positions open at the start of each day (difference array + cumsum)."""
+        delta = np.zeros(num_days + 1)
+        np.add.at(delta, entry + 1, values)
+        np.add.at(delta, exit + 1, -values)
+        return np.cumsum(delta)[:num_days]
+
+    cash_delta = np.zeros(num_days + 1)
+    np.add.at(cash_delta, entry + 1, -cost)
+    np.add.at(cash_delta, exit[closed] + 1, proceeds[closed])
+    cash = INITIAL_CAPITAL + np.cumsum(cash_delta)[:num_days]
+
+    holdings = np.zeros((num_days + 1, len(tickers)))
+    np.add.at(holdings, (entry + 1, column), sign * quantity)
+    np.add.at(holdings, (exit + 1, column), -sign * quantity)
+    holdings = np.cumsum(holdings, axis=0)[:num_days]
+    close = np.column_stack([all_historical_data[ticker]["close"].to_numpy(dtype=float)[first:first + num_days] for ticker in tickers]) if tickers else np.zeros((num_days, 0))
+    held = holdings != 0
+    market_value = np.where(held, holdings * close, 0.0).sum(axis=1)
+    gross_exposure = np.where(held, np.abs(holdings) * close, 0.0).sum(axis=1)
+    swap = cumulative_swap_rate * open_sum(notional) - open_sum(notional * cumulative_swap_rate[entry])
+
+    value = cash + open_sum(cost - sign * notional) + market_value - swap
+    if results["state"]["halted"]:
+        value[-1] = results["state"]["cash"] # Margin call: the value of the last day is the cash left after the liquidation
+    with np.errstate(divide='ignore', invalid='ignore'):
+        exposure = np.where(value > 0, gross_exposure / value, np.nan)
+    return pd.DataFrame({"value": value, "cash": cash, "exposure": exposure,
+                         "drawdown": value / np.maximum.accumulate(value) - 1}, index=dates)
+
+def calculate_risk_statistics(equity_df):
+    """Returns the max drawdown and the average / max exposure of the equity curve built by reconstruct_equity."""
+    if equity_df is None or equity_df.empty:
+        return None
+    return {
+        "Max Drawdown": f"{equity_df['drawdown'].min() * 100:.2f}%",
+        "Avg Exposure": f"{equity_df['exposure'].mean() * 100:.2f}%",
+        "Max Exposure": f"{equity_df['exposure'].max() * 100:.2f}%"
+    }
 
 def calculate_summary_performance(portfolio_df, completed_trades):
     if portfolio_df.empty or portfolio_df['value'].isna().all():
@@ -454,6 +724,23 @@ def calculate_summary_performance(portfolio_df, completed_trades):
         "Avg Profit per Trade": f"{avg_percent_return:.2f}%"
     }
 
+def calculate_sub_book_performance(completed_trades):
+    """Returns the trade statistics of each side (NORMAL / INVERSE) of a COMBINED run, or {} if only one side traded."""
+    sides = sorted(set(t.get("strategy") for t in completed_trades if t.get("strategy")))
+    if len(sides) < 2:
+        return {}
+    sub_books = {}
+    for side in sides:
+        trades = [t for t in completed_trades if t.get("strategy") == side]
+        winning_trades = sum(1 for t in trades if t['pnl'] > 0)
+        sub_books[side] = {
+            "Total Trades": len(trades),
+            "Realized P&L": f"${sum(t['pnl'] for t in trades):,.2f}",
+            "Winrate": f"{(winning_trades / len(trades)) * 100:.2f}%",
+            "Avg Duration (d)": f"{sum(t['duration'] for t in trades) / len(trades):.2f}"
+        }
+    return sub_books
+
 def print_single_run_details(results):
     portfolio_df = results["portfolio_df"]
     completed_trades = results["completed_trades"]
@@ -472,6 +759,10 @@ def print_single_run_details(results):
     print(f"Final Portfolio Value:   {summary['Final Value']}")
     print(f"Total Return:            {summary['Total Return']}")
     print(f"Annualized Return:       {summary['Annualized Return']}")
+    risk = calculate_risk_statistics(results.get("equity"))
+    if risk:
+        print(f"Max Drawdown:            {risk['Max Drawdown']}")
+        print(f"Avg / Max Exposure:      {risk['Avg Exposure']} / {risk['Max Exposure']}")
 
     if completed_trades:
         for trade in completed_trades:
@@ -494,6 +785,12 @@ def print_single_run_details(results):
         print(f"Best Trade (%):          {best_trade_pct['percent_return']:.2f}% ({best_trade_pct['ticker']})")
         print(f"Worst Trade (%):         {worst_trade_pct['percent_return']:.2f}% ({worst_trade_pct['ticker']})")
 
+        sub_books = calculate_sub_book_performance(completed_trades)
+        if sub_books:
+            print("\n--- Sub-books ---")
+            for side, stats in sub_books.items():
+                print(f"{side}: " + " | ".join(f"{key}: {value}" for key, value in stats.items()))
+
     open_positions = results["open_positions"]
     print("\n--- Open Positions at End of Backtest ---")
     if open_positions:
@@ -682,8 +979,9 @@ def generate_detailed_statistics(completed_trades):
             
     return output
 
+@profiling.profiled("report")
 def write_report(results, config, logs):
-    """Writes the backtest report to a markdown file."""
+    """Writes the backtest report to a markdown file and returns its path."""
     # Ensure the target directory exists
     output_dir = "docs/backtests"
     os.makedirs(output_dir, exist_ok=True)
@@ -708,6 +1006,18 @@ def write_report(results, config, logs):
         if summary:
             for key, value in summary.items():
                 f.write(f"- **{key}:** {value}\n")
+        risk = calculate_risk_statistics(results.get("equity"))
+        if risk:
+            for key, value in risk.items():
+                f.write(f"- **{key}:** {value}\n")
+
+        sub_books = calculate_sub_book_performance(results["completed_trades"])
+        if sub_books:
+            f.write("\n## Sub-books\n")
+            for side, stats in sub_books.items():
+                f.write(f"### {side}\n")
+                for key, value in stats.items():
+                    f.write(f"- **{key}:** {value}\n")
 
         f.write("\n## Periodic Returns\n")
         periodic_returns = calculate_periodic_returns(results["portfolio_df"], results["completed_trades"])
@@ -742,8 +1052,10 @@ def write_report(results, config, logs):
         for log_entry in logs:
             f.write(f"{remove_ansi_codes(log_entry)}\n")
 
+    return filename
+
 def save_comparison_report(summary_df, methods_run, strategy, prioritization_method_config):
-    """Saves the comparison summary to a markdown file."""
+    """Saves the comparison summary to a markdown file and returns its path."""
     output_dir = "docs/comparatives/backtests-comps"
     os.makedirs(output_dir, exist_ok=True)
 
@@ -770,35 +1082,33 @@ def save_comparison_report(summary_df, methods_run, strategy, prioritization_met
         f.write(f"**VIX Protection:** {VIX_PROTECTION}\n")
         f.write(f"**Panic Button:** {PANIC_BUTTON}\n")
         f.write(f"**Time Stop (days):** {TIME_STOP}\n")
-        f.write(f"**S&P500 Entry Threshold:** {SP500_ENTRY_THRESHOLD}\n\n")
+        f.write(f"**S&P500 Entry Threshold:** {SP500_ENTRY_THRESHOLD}\n")
+        f.write(f"**Correlation Filter:** {CORRELATION_FILTER} ({CORRELATION_WINDOW} days)\n\n")
         f.write("---\n\n")
         f.write(f"## Overall Performance Summary for {strategy} Strategy\n\n")
         f.write(summary_df.to_markdown())
     
     print(f"\nComparison report saved to {filename}")
+    return filename
+
+class Tee(object):
+    def __init__(self, *files):
+        self.files = files
+    def write(self, obj):
+        for f in self.files:
+            f.write(obj)
+    def flush(self):
+        for f in self.files:
+            f.flush()
+
+def load_universe():
+    """
+    Reads the tickers of TICKER_FILES (plus the former index members if POINT_IN_TIME_UNIVERSE is enabled)
+    and excludes the blacklisted ones.
 
-if __name__ == '__main__':
-    # Capture logs
-    import sys
-    from io import StringIO
-    
-    original_stdout = sys.stdout
-    log_stream = StringIO()
-
-    class Tee(object):
-        def __init__(self, *files):
-            self.files = files
-        def write(self, obj):
-            for f in self.files:
-                f.write(obj)
-        def flush(self):
-            for f in self.files:
-                f.flush()
-
-    sys.stdout = Tee(sys.stdout, log_stream)
-
-
-    start_time = time.perf_counter()
+    Returns:
+        tuple: (tickers to run, membership intervals or None).
+    """
     all_tickers = []
     all_blacklisted_tickers = []
     for file_path in TICKER_FILES:
@@ -809,11 +1119,91 @@ if __name__ == '__main__':
     unique_tickers = sorted(list(set(all_tickers)))
     blacklisted_tickers = set(all_blacklisted_tickers)
 
+    membership_intervals = None
+    if POINT_IN_TIME_UNIVERSE:
+        membership_intervals = membership.load_for_files(TICKER_FILES)
+        if membership_intervals is None:
+            print("Warning: No membership files found (run generate_tickers.py). Using the current tickers for the whole backtest.")
+        else:
+            # Former members are added so they can be traded while they were in the index
+            former_members = membership.members_between(membership_intervals, START_DATE, END_DATE)
+            unique_tickers = sorted(set(unique_tickers) | set(former_members))
+
     # Exclude blacklisted tickers from the simulation
     tickers_to_run = [t for t in unique_tickers if t not in blacklisted_tickers]
     print(f"Loaded {len(tickers_to_run)} unique tickers after excluding {len(blacklisted_tickers)} blacklisted tickers.")
+    return tickers_to_run, membership_intervals
+
+def run_simulation_cached(all_historical_data, master_index, prioritization_method, strategy_type, vix_data, sp500_data, fed_funds_data, data_hash, verbose=True):
+    """
+    Runs run_simulation, or returns the stored results of an identical previous run (same configuration,
+    ticker files, code, data and run parameters). If CHECKPOINT is enabled, a run whose END_DATE moved
+    forward resumes from the checkpoint of the previous run. The simulation log is printed in every case.
+
+    Returns:
+        tuple: (results, cache key or None, metadata of the cached entry or None on a cache miss).
+    """
+    import sys
+    module = sys.modules[__name__]
+    key = None
+    if USE_RESULT_CACHE:
+        config = result_cache.config_fingerprint(module)
+        key = result_cache.make_key(config, data_hash, prioritization_method=prioritization_method, strategy_type=strategy_type, verbose=verbose)
+        entry = result_cache.load(key)
+        if entry is not None:
+            print(f"Using cached results ({key[:12]}).")
+            print(entry["log"], end="")
+            return entry["results"], key, entry["metadata"]
+
+    market_frames = (vix_data, sp500_data, fed_funds_data)
+    checkpoint_key, initial_state, previous_log = None, None, ""
+    if CHECKPOINT:
+        checkpoint_key = checkpoint.make_key(module, prioritization_method=prioritization_method, strategy_type=strategy_type, verbose=verbose)
+        initial_state, previous_log = checkpoint.load(checkpoint_key, all_historical_data, market_frames, END_DATE)
+        if initial_state is not None:
+            print(f"Resuming from checkpoint at {initial_state['last_date'].date()}.")
+            print(previous_log, end="")
+
+    if not USE_RESULT_CACHE and not CHECKPOINT:
+        return run_simulation(all_historical_data, master_index, prioritization_method, strategy_type, vix_data, sp500_data, fed_funds_data, verbose=verbose), None, None
+
+    simulation_log = StringIO()
+    original_stdout = sys.stdout
+    sys.stdout = Tee(original_stdout, simulation_log)
+    try:
+        results = run_simulation(all_historical_data, master_index, prioritization_method, strategy_type, vix_data, sp500_data, fed_funds_data, verbose=verbose, initial_state=initial_state)
+    finally:
+        sys.stdout = original_stdout
+    log = previous_log + simulation_log.getvalue()
+
+    if CHECKPOINT:
+        checkpoint.save(checkpoint_key, results["state"], log, all_historical_data, market_frames)
+    if USE_RESULT_CACHE:
+        summary = calculate_summary_performance(results["portfolio_df"], results["completed_trades"])
+        result_cache.store(key, results, summary, log,
+                           {"prioritization_method": prioritization_method, "strategy_type": strategy_type, "start_date": START_DATE, "end_date": END_DATE})
+    return results, key, None
+
+def main():
+    """Runs the backtest configured at the top of this file and writes the report(s)."""
+    # Capture logs
+    import sys
+    from io import StringIO
     
-    all_historical_data, master_index, vix_data, sp500_data, fed_funds_data = prepare_data(tickers_to_run)
+    original_stdout = sys.stdout
+    log_stream = StringIO()
+    sys.stdout = Tee(sys.stdout, log_stream)
+
+
+    start_time = time.perf_counter()
+    report_path = None
+    if PROFILE:
+        profiling.start(per_day=PROFILE_PER_DAY)
+    cprofiler = profiling.start_cprofile() if PROFILE_CPROFILE else None
+
+    tickers_to_run, membership_intervals = load_universe()
+    all_historical_data, master_index, vix_data, sp500_data, fed_funds_data = prepare_data(tickers_to_run, membership_intervals)
+    data_hash = result_cache.data_fingerprint(all_historical_data, vix_data, sp500_data, fed_funds_data) if USE_RESULT_CACHE else None
     
     if isinstance(PRIORITIZATION_METHOD, list) or PRIORITIZATION_METHOD == 'ALL':
         methods_to_run = PRIORITIZATION_METHOD if isinstance(PRIORITIZATION_METHOD, list) else ALL_METHODS
@@ -828,7 +1218,7 @@ if __name__ == '__main__':
             all_results = []
             for method in methods_to_run:
                 print(f"--- Prioritization Method: {method} ---")
-                results = run_simulation(all_historical_data, master_index, method, strategy, vix_data, sp500_data, fed_funds_data, verbose=False)
+                results, _, _ = run_simulation_cached(all_historical_data, master_index, method, strategy, vix_data, sp500_data, fed_funds_data, data_hash, verbose=False)
                 performance = calculate_summary_performance(results["portfolio_df"], results["completed_trades"])
                 if performance:
                     performance["Method"] = method
@@ -840,7 +1230,7 @@ if __name__ == '__main__':
                 summary_df['Total Return (sort)'] = summary_df['Total Return'].str.replace('%', '').astype(float)
                 summary_df = summary_df.sort_values(by='Total Return (sort)', ascending=False).drop(columns=['Total Return (sort)'])
                 print(summary_df)
-                save_comparison_report(summary_df, methods_to_run, strategy, PRIORITIZATION_METHOD)
+                report_path = save_comparison_report(summary_df, methods_to_run, strategy, PRIORITIZATION_METHOD)
                 print("\nNote: Avg Duration omits Saturdays and Sundays because the markets are closed.")
             else:
                 print("No results to display.")
@@ -849,14 +1239,14 @@ if __name__ == '__main__':
         if STRATEGY_TYPE == "BOTH":
             all_results = []
             print(f"\n--- Running Simulation for Strategy: NORMAL ---")
-            results_normal = run_simulation(all_historical_data, master_index, PRIORITIZATION_METHOD, "NORMAL", vix_data, sp500_data, fed_funds_data, verbose=False)
+            results_normal, _, _ = run_simulation_cached(all_historical_data, master_index, PRIORITIZATION_METHOD, "NORMAL", vix_data, sp500_data, fed_funds_data, data_hash, verbose=False)
             performance_normal = calculate_summary_performance(results_normal["portfolio_df"], results_normal["completed_trades"])
             if performance_normal:
                 performance_normal["Strategy"] = "NORMAL"
                 all_results.append(performance_normal)
 
             print(f"\n--- Running Simulation for Strategy: INVERSE ---")
-            results_inverse = run_simulation(all_historical_data, master_index, PRIORITIZATION_METHOD, "INVERSE", vix_data, sp500_data, fed_funds_data, verbose=False)
+            results_inverse, _, _ = run_simulation_cached(all_historical_data, master_index, PRIORITIZATION_METHOD, "INVERSE", vix_data, sp500_data, fed_funds_data, data_hash, verbose=False)
             performance_inverse = calculate_summary_performance(results_inverse["portfolio_df"], results_inverse["completed_trades"])
             if performance_inverse:
                 performance_inverse["Strategy"] = "INVERSE"
@@ -873,7 +1263,7 @@ if __name__ == '__main__':
                 print("No results to display.")
         else:
             print(f"\n--- Running Simulation for Prioritization Method: {PRIORITIZATION_METHOD} ---")
-            results = run_simulation(all_historical_data, master_index, PRIORITIZATION_METHOD, STRATEGY_TYPE, vix_data, sp500_data, fed_funds_data, verbose=True)
+            results, cache_key, cached_metadata = run_simulation_cached(all_historical_data, master_index, PRIORITIZATION_METHOD, STRATEGY_TYPE, vix_data, sp500_data, fed_funds_data, data_hash, verbose=True)
             print_single_run_details(results)
 
             # After the run, write the report
@@ -892,10 +1282,35 @@ if __name__ == '__main__':
                 "VIX_PROTECTION": VIX_PROTECTION,
                 "PANIC_BUTTON": PANIC_BUTTON,
                 "TIME_STOP": TIME_STOP,
-                "SP500_ENTRY_THRESHOLD": SP500_ENTRY_THRESHOLD
+                "SP500_ENTRY_THRESHOLD": SP500_ENTRY_THRESHOLD,
+                "CORRELATION_FILTER": CORRELATION_FILTER,
+                "CORRELATION_WINDOW": CORRELATION_WINDOW
             }
-            write_report(results, config, logs)
+            previous_report = cached_metadata.get("report_path") if cached_metadata else None
+            if previous_report and os.path.exists(previous_report):
+                # Identical run: the report written last time is still valid
+                report_path = previous_report
+                print(f"\nResults unchanged since the last run. Report: {report_path}")
+            else:
+                report_path = write_report(results, config, logs)
+                if cache_key:
+                    result_cache.update_metadata(cache_key, report_path=report_path)
+
+    # Profiling output is written next to the report (or with a date-based name if no report was written)
+    if PROFILE or PROFILE_CPROFILE:
+        os.makedirs("docs/backtests", exist_ok=True)
+        profile_base = os.path.splitext(report_path)[0] if report_path else os.path.join("docs/backtests", f"{START_DATE}-{END_DATE}")
+        if cprofiler is not None:
+            profiling.stop_cprofile(cprofiler, f"{profile_base}.prof")
+        if PROFILE:
+            profiling.stop()
+            profiling.print_summary()
+            profiling.write_summary(f"{profile_base}.profile.json")
 
     elapsed_seconds = time.perf_counter() - start_time
     minutes, seconds = divmod(elapsed_seconds, 60)
     print(f"\nTotal execution time: {int(minutes)} minutes {seconds:.1f} seconds")
+    sys.stdout = original_stdout
+
+if __name__ == '__main__':
+    main()
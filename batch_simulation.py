@@ -0,0 +1,403 @@
+"""
+This script runs many configurations of the backtest at once (e.g. a sensitivity grid over TIME_STOP,
+VIX_PROTECTION, SP500_ENTRY_THRESHOLD or MAX_CONCURRENT_POSITIONS).
+
+Instead of one run_simulation call per configuration, all configurations advance in lockstep over a
+single date loop: cash, system state and positions (quantity, cost, swap...) are arrays with one row per
+configuration, and the market data of each date is read once for all of them. The VIX/S&P 500 system
+state comes from regime.py (computed once per pair of thresholds), and swap accrual, equity and exit
+conditions are computed for every configuration with array operations; only the trades themselves are applied one by one, in the same order as run_simulation,
+so every configuration gives the same trades as a separate run.
+
+Usage:
+    python batch_simulation.py --grid TIME_STOP=5,10,15 VIX_PROTECTION=0,35,45
+    python batch_simulation.py --grid TIME_STOP=5,10,15 --prepared
+    python batch_simulation.py --validate
+"""
+
+import argparse
+import contextlib
+import io
+import itertools
+import math
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+import backtest
+import panel_store
+import regime
+
+# ==============================================================================
+# --- CONFIGURATION ---
+# ==============================================================================
+# Parameters that can differ between the configurations of a batch (the others are read from backtest.py)
+BATCH_PARAMETERS = ['LEVERAGE_FACTOR', 'INITIAL_CAPITAL', 'MAX_CONCURRENT_POSITIONS', 'VIX_PROTECTION',
+                    'PANIC_BUTTON', 'TIME_STOP', 'SP500_ENTRY_THRESHOLD', 'CLOSE_ON_SMA200_CROSS']
+OUTPUT_DIR = "docs/comparatives/backtests-comps"
+VALIDATION_TICKERS = 30 # Size of the synthetic universe used by --validate
+VALIDATION_YEARS = 3
+# ==============================================================================
+
+def build_grid(**values):
+    """Returns the list of configurations (dicts) of the cartesian product of the given parameter values."""
+    names = list(values.keys())
+    return [dict(zip(names, combination)) for combination in itertools.product(*values.values())]
+
+def _config_array(configs, name, dtype=float):
+    return np.array([config.get(name, getattr(backtest, name)) for config in configs], dtype=dtype)
+
+def _panel(all_historical_data, tickers, column, dtype=float, default=np.nan):
+    """Stacks one column of every ticker into a (dates, tickers) array."""
+    columns = []
+    for ticker in tickers:
+        df = all_historical_data[ticker]
+        columns.append(df[column].to_numpy(dtype=dtype) if column in df.columns else np.full(len(df), default, dtype=dtype))
+    return np.column_stack(columns)
+
+def _priority_order(method, candidates, tickers, rsi, hv, adx):
+    """Returns the candidates sorted like run_simulation sorts its potential buys (stable sorts)."""
+    if method == 'RSI_DESC':
+        return candidates[np.argsort(-rsi[candidates], kind='stable')]
+    if method == 'A-Z':
+        return candidates[np.argsort(tickers[candidates], kind='stable')]
+    if method == 'Z-A':
+        return candidates[np.argsort(tickers[candidates], kind='stable')[::-1]]
+    if method == 'HV_DESC':
+        return candidates[np.argsort(-np.nan_to_num(hv[candidates], nan=0.0), kind='stable')]
+    if method == 'ADX_DESC':
+        return candidates[np.argsort(-np.nan_to_num(adx[candidates], nan=0.0), kind='stable')]
+    return candidates[np.argsort(rsi[candidates], kind='stable')]
+
+def run_batch(all_historical_data, master_index, configs, prioritization_method, strategy_type, vix_data, sp500_data, fed_funds_data):
+    """
+    Simulates every configuration of `configs` (dicts of BATCH_PARAMETERS overrides) over the same data.
+
+    Returns:
+        list: One result per configuration, with the same keys as run_simulation ("portfolio_df",
+              "completed_trades", "open_positions") plus "config".
+    """
+    for config in configs:
+        unknown = set(config) - set(BATCH_PARAMETERS)
+        if unknown:
+            raise ValueError(f"Parameters {sorted(unknown)} cannot be batched. Options: {BATCH_PARAMETERS}")
+
+    if strategy_type not in ("NORMAL", "INVERSE"):
+        raise ValueError(f"The batch kernel runs NORMAL or INVERSE, not '{strategy_type}'.")
+    if backtest.CORRELATION_FILTER > 0:
+        raise ValueError("The batch kernel does not apply CORRELATION_FILTER. Use backtest.py or search.py.")
+    num_configs = len(configs)
+    tickers = list(all_historical_data.keys())
+    ticker_names = np.array(tickers)
+    num_tickers = len(tickers)
+    is_inverse = strategy_type == "INVERSE"
+    strategy = strategy_type.lower()
+
+    # --- Per-configuration parameters ---
+    leverage = _config_array(configs, 'LEVERAGE_FACTOR')
+    max_positions = _config_array(configs, 'MAX_CONCURRENT_POSITIONS', int)
+    vix_protection = _config_array(configs, 'VIX_PROTECTION')
+    panic_button = _config_array(configs, 'PANIC_BUTTON', bool)
+    time_stop = _config_array(configs, 'TIME_STOP', int)
+    sp500_threshold = _config_array(configs, 'SP500_ENTRY_THRESHOLD')
+    close_on_cross = _config_array(configs, 'CLOSE_ON_SMA200_CROSS', bool)
+
+    # --- Market data, read once for every configuration ---
+    start = np.searchsorted(master_index.values, np.datetime64(pd.to_datetime(backtest.START_DATE)))
+    dates = master_index[start:]
+    close = _panel(all_historical_data, tickers, "close")[start:]
+    traded = _panel(all_historical_data, tickers, "traded", bool, True)[start:]
+    buy_signal = _panel(all_historical_data, tickers, f"is_buy_signal_{strategy}", bool, False)[start:]
+    exit_signal = _panel(all_historical_data, tickers, f"is_exit_signal_{strategy}", bool, False)[start:]
+    sma_200 = _panel(all_historical_data, tickers, "sma_200")[start:]
+    rsi = _panel(all_historical_data, tickers, "rsi_2")[start:]
+    hv = _panel(all_historical_data, tickers, "hv_100")[start:]
+    adx = _panel(all_historical_data, tickers, "adx_14")[start:]
+    # Business days since the first date, so days held = business_day[today] - business_day[buy day]
+    business_day = np.busday_count(dates[0].date(), dates.values.astype('datetime64[D]')) if len(dates) else np.array([], dtype=int)
+
+    # System state per configuration (configurations with the same thresholds share the same arrays)
+    regimes = [regime.get_regime(dates, vix_data, sp500_data, vix_protection[n], sp500_threshold[n]) for n in range(num_configs)]
+    regime_shut_off = np.array([r["shut_off"] for r in regimes]).reshape(num_configs, len(dates))
+    regime_panic = np.array([r["event"] == regime.SHUT_OFF_VIX for r in regimes]).reshape(num_configs, len(dates)) & panic_button[:, None]
+    regime_sp500_strong = np.array([r["sp500_strong"] for r in regimes]).reshape(num_configs, len(dates))
+    fed_rate = fed_funds_data['fed_rate'].reindex(dates).to_numpy(dtype=float) if fed_funds_data is not None else None
+
+    # --- State (one row per configuration) ---
+    cash = _config_array(configs, 'INITIAL_CAPITAL')
+    halted = np.zeros(num_configs, dtype=bool)
+    held = np.zeros((num_configs, num_tickers), dtype=bool)
+    quantity = np.zeros((num_configs, num_tickers))
+    notional = np.zeros((num_configs, num_tickers))
+    cost = np.zeros((num_configs, num_tickers))
+    swap = np.zeros((num_configs, num_tickers))
+    entry_rsi = np.zeros((num_configs, num_tickers))
+    entry_hv = np.zeros((num_configs, num_tickers))
+    entry_adx = np.zeros((num_configs, num_tickers))
+    buy_day = np.zeros((num_configs, num_tickers), dtype=int)
+    # Order in which the positions were opened, so they are closed in run_simulation's (dict) order
+    buy_sequence = np.zeros((num_configs, num_tickers), dtype=np.int64)
+    next_sequence = 0
+    values = np.full((num_configs, len(dates)), np.nan)
+    completed_trades = [[] for _ in range(num_configs)]
+
+    def close_positions(n, columns, day, price):
+        """Closes the positions of configuration n in `columns` (in opening order) and records the trades."""
+        for t in columns[np.argsort(buy_sequence[n, columns], kind='stable')]:
+            if is_inverse:
+                pnl = notional[n, t] - (price[t] * quantity[n, t])
+            else:
+                pnl = (price[t] * quantity[n, t]) - notional[n, t]
+            pnl -= swap[n, t]
+            cash[n] += cost[n, t] + pnl
+            completed_trades[n].append({"ticker": tickers[t], "duration": business_day[day] - buy_day[n, t], "pnl": pnl,
+                                        "investment_cost": cost[n, t], "rsi": entry_rsi[n, t], "hv": entry_hv[n, t],
+                                        "adx": entry_adx[n, t], "sell_date": dates[day], "strategy": strategy_type})
+            held[n, t] = False
+
+    for day in range(len(dates)):
+        price = close[day]
+        active = ~halted
+
+        # --- Swap accrual ---
+        if fed_rate is not None and not np.isnan(fed_rate[day]):
+            swap_rate_annual = (fed_rate[day] / 100) + 0.025
+            accrues = held & (leverage > 1)[:, None]
+            swap[accrues] += (notional[accrues] * swap_rate_annual) / 360
+
+        # --- Equity at the start of the day ---
+        with np.errstate(invalid='ignore'):
+            unrealized_pnl = (notional - (price * quantity)) if is_inverse else ((price * quantity) - notional)
+            position_equity = np.where(held, cost + unrealized_pnl - swap, 0.0)
+        total_value = cash + position_equity.sum(axis=1)
+
+        # --- Margin call ---
+        bankrupt = active & (total_value <= 0)
+        for n in np.flatnonzero(bankrupt):
+            close_positions(n, np.flatnonzero(held[n]), day, price)
+            values[n, day] = cash[n]
+        halted |= bankrupt
+        active &= ~bankrupt
+        values[active, day] = total_value[active]
+
+        # --- Exits (signal, TIME_STOP, SMA200 cross), only on the ticker's trading days ---
+        exits = exit_signal[day][None, :] | ((time_stop > 0)[:, None] & (business_day[day] - buy_day >= time_stop[:, None]))
+        if close_on_cross.any():
+            with np.errstate(invalid='ignore'):
+                cross = (price > sma_200[day]) if is_inverse else (price < sma_200[day])
+            exits |= close_on_cross[:, None] & (cross & ~np.isnan(price) & ~np.isnan(sma_200[day]))[None, :]
+        exits &= held & traded[day][None, :] & active[:, None]
+        for n in np.flatnonzero(exits.any(axis=1)):
+            close_positions(n, np.flatnonzero(exits[n]), day, price)
+
+        # --- System state (PANIC_BUTTON liquidates when VIX protection shuts the system off) ---
+        for n in np.flatnonzero(active & regime_panic[:, day]):
+            close_positions(n, np.flatnonzero(held[n]), day, price)
+
+        # --- Entries ---
+        open_slots = max_positions - held.sum(axis=1)
+        can_buy = active & ~regime_shut_off[:, day] & (open_slots > 0) & regime_sp500_strong[:, day]
+        if not can_buy.any():
+            continue
+        candidates = np.flatnonzero(buy_signal[day] & ~np.isnan(price))
+        if len(candidates) == 0:
+            continue
+        candidates = _priority_order(prioritization_method, candidates, ticker_names, rsi[day], hv[day], adx[day])
+        for n in np.flatnonzero(can_buy):
+            num_held = int(held[n].sum())
+            for t in candidates:
+                if held[n, t]:
+                    continue
+                if num_held >= max_positions[n]:
+                    break
+                cash_per_slot = cash[n] / (max_positions[n] - num_held)
+                target_notional = cash_per_slot * leverage[n]
+                buy_quantity = math.floor(target_notional / price[t]) if leverage[n] > 1 else target_notional / price[t]
+                if buy_quantity == 0:
+                    continue
+                actual_notional_value = buy_quantity * price[t]
+                actual_investment_cost = actual_notional_value / leverage[n]
+                if actual_investment_cost < 5.0:
+                    continue # Minimum trade size
+                if cash[n] >= actual_investment_cost:
+                    cash[n] -= actual_investment_cost
+                    held[n, t] = True
+                    quantity[n, t] = buy_quantity
+                    notional[n, t] = actual_notional_value
+                    cost[n, t] = actual_investment_cost
+                    swap[n, t] = 0.0
+                    entry_rsi[n, t], entry_hv[n, t], entry_adx[n, t] = rsi[day, t], hv[day, t], adx[day, t]
+                    buy_day[n, t] = day
+                    buy_sequence[n, t] = next_sequence
+                    next_sequence += 1
+                    num_held += 1
+
+    calendar_range = pd.date_range(start=backtest.START_DATE, end=backtest.END_DATE)
+    results = []
+    for n, config in enumerate(configs):
+        recorded = ~np.isnan(values[n])
+        portfolio_df = pd.DataFrame({"value": values[n, recorded]}, index=dates[recorded]).reindex(calendar_range, method='ffill')
+        open_positions = {}
+        for t in np.argsort(buy_sequence[n], kind='stable'):
+            if held[n, t]:
+                open_positions[tickers[t]] = {
+                    "quantity": quantity[n, t], "buy_date": dates[buy_day[n, t]], "investment_cost": cost[n, t],
+                    "notional_value": notional[n, t], "accumulated_swap": swap[n, t],
+                    "side": strategy_type, "rsi": entry_rsi[n, t], "hv": entry_hv[n, t], "adx": entry_adx[n, t]
+                }
+        results.append({"config": config, "portfolio_df": portfolio_df, "completed_trades": completed_trades[n], "open_positions": open_positions})
+    return results
+
+def summarize(results):
+    """Returns a DataFrame with the summary performance of every configuration, sorted by total return."""
+    rows = []
+    for result in results:
+        performance = backtest.calculate_summary_performance(result["portfolio_df"], result["completed_trades"])
+        if performance:
+            rows.append({**{name: value for name, value in result["config"].items()}, **performance})
+    if not rows:
+        return pd.DataFrame()
+    summary_df = pd.DataFrame(rows)
+    summary_df['Total Return (sort)'] = summary_df['Total Return'].str.replace('%', '').astype(float)
+    return summary_df.sort_values(by='Total Return (sort)', ascending=False).drop(columns=['Total Return (sort)']).reset_index(drop=True)
+
+def save_batch_report(summary_df, grid, strategy, prioritization_method):
+    """Saves the summary of a batch to a markdown file and returns its path."""
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    filename_base = "BATCH-" + "-".join(grid.keys())
+    filename = os.path.join(OUTPUT_DIR, f"{filename_base}.md")
+    i = 1
+    while os.path.exists(filename):
+        filename = os.path.join(OUTPUT_DIR, f"{filename_base}-{i}.md")
+        i += 1
+
+    with open(filename, 'w') as f:
+        f.write(f"# Batch Backtest Report: {', '.join(grid.keys())}\n\n")
+        f.write(f"**Strategy:** {strategy}\n")
+        f.write(f"**Prioritization Method:** {prioritization_method}\n")
+        f.write(f"**Date Range:** {backtest.START_DATE} to {backtest.END_DATE}\n")
+        for name in BATCH_PARAMETERS:
+            values = grid.get(name, [getattr(backtest, name)])
+            f.write(f"**{name}:** {', '.join(str(value) for value in values)}\n")
+        f.write("\n---\n\n")
+        f.write(f"## Performance Summary ({len(summary_df)} configurations)\n\n")
+        f.write(summary_df.to_markdown(index=False))
+
+    print(f"\nBatch report saved to {filename}")
+    return filename
+
+def parse_grid(assignments):
+    """Parses ["TIME_STOP=5,10", ...] into {"TIME_STOP": [5, 10], ...} using the type of the backtest.py default."""
+    grid = {}
+    for assignment in assignments:
+        name, _, values = assignment.partition('=')
+        name = name.strip().upper()
+        if name not in BATCH_PARAMETERS or not values:
+            raise ValueError(f"Invalid grid parameter '{assignment}'. Use NAME=v1,v2 with NAME in {BATCH_PARAMETERS}")
+        default = getattr(backtest, name)
+        if isinstance(default, bool):
+            convert = lambda value: value.strip().lower() in ('1', 'true', 'yes')
+        elif isinstance(default, int):
+            convert = lambda value: int(value)
+        else:
+            convert = lambda value: float(value)
+        grid[name] = [convert(value) for value in values.split(',')]
+    return grid
+
+def run_separately(all_historical_data, master_index, configs, prioritization_method, strategy_type, vix_data, sp500_data, fed_funds_data):
+    """Runs backtest.run_simulation once per configuration (the reference for --validate)."""
+    defaults = {name: getattr(backtest, name) for name in BATCH_PARAMETERS}
+    results = []
+    try:
+        for config in configs:
+            for name, value in {**defaults, **config}.items():
+                setattr(backtest, name, value)
+            with contextlib.redirect_stdout(io.StringIO()):
+                results.append(backtest.run_simulation(all_historical_data, master_index, prioritization_method, strategy_type,
+                                                       vix_data, sp500_data, fed_funds_data, verbose=False))
+    finally:
+        for name, value in defaults.items():
+            setattr(backtest, name, value)
+    return results
+
+def validate(num_tickers=VALIDATION_TICKERS, num_years=VALIDATION_YEARS):
+    """
+    Checks on a synthetic universe that every configuration of a batch gives the same trades and equity
+    curve as a separate run_simulation call. Returns True if all of them match.
+    """
+    import benchmark
+
+    all_historical_data, vix_data, sp500_data, fed_funds_data = benchmark.generate_synthetic_universe(num_tickers, num_years)
+    backtest.START_DATE = str((pd.Timestamp(benchmark.END_DATE) - pd.DateOffset(years=num_years)).date())
+    backtest.END_DATE = benchmark.END_DATE
+    with contextlib.redirect_stdout(io.StringIO()):
+        master_index, vix_data, sp500_data, fed_funds_data = backtest.align_data(all_historical_data, vix_data, sp500_data, fed_funds_data)
+        backtest.calculate_signals(all_historical_data)
+
+    configs = build_grid(TIME_STOP=[0, 5], VIX_PROTECTION=[0, 25], MAX_CONCURRENT_POSITIONS=[3, 10], SP500_ENTRY_THRESHOLD=[1.0, 1.02])
+    configs += build_grid(LEVERAGE_FACTOR=[2], CLOSE_ON_SMA200_CROSS=[True, False], PANIC_BUTTON=[True, False], VIX_PROTECTION=[25])
+    all_valid = True
+    for strategy_type in ["NORMAL", "INVERSE"]:
+        start = time.perf_counter()
+        batch = run_batch(all_historical_data, master_index, configs, 'RSI', strategy_type, vix_data, sp500_data, fed_funds_data)
+        batch_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        reference = run_separately(all_historical_data, master_index, configs, 'RSI', strategy_type, vix_data, sp500_data, fed_funds_data)
+        separate_seconds = time.perf_counter() - start
+
+        mismatches = 0
+        for config, result, expected in zip(configs, batch, reference):
+            trades = [(t["ticker"], t["sell_date"], t["duration"], round(t["pnl"], 6)) for t in result["completed_trades"]]
+            expected_trades = [(t["ticker"], t["sell_date"], t["duration"], round(t["pnl"], 6)) for t in expected["completed_trades"]]
+            same_curve = np.allclose(result["portfolio_df"]["value"], expected["portfolio_df"]["value"], rtol=1e-9, equal_nan=True)
+            if trades != expected_trades or not same_curve or list(result["open_positions"]) != list(expected["open_positions"]):
+                mismatches += 1
+                print(f"MISMATCH ({strategy_type}) {config}: {len(trades)} trades vs {len(expected_trades)} expected")
+        all_valid &= mismatches == 0
+        print(f"{strategy_type}: {len(configs) - mismatches}/{len(configs)} configurations match run_simulation "
+              f"(batch: {batch_seconds:.2f}s, separate runs: {separate_seconds:.2f}s)")
+    return all_valid
+
+def main():
+    parser = argparse.ArgumentParser(description="Run several backtest configurations in a single pass over the data.")
+    parser.add_argument('--grid', nargs='+', metavar='NAME=V1,V2', help=f"Values to combine, for any of {', '.join(BATCH_PARAMETERS)}.")
+    parser.add_argument('--validate', action='store_true', help="Check the batch kernel against run_simulation on synthetic data.")
+    parser.add_argument('--prepared', action='store_true', help="Use the data last prepared by backtest.py (see panel_store.py) instead of downloading it.")
+    args = parser.parse_args()
+
+    if args.validate:
+        raise SystemExit(0 if validate() else 1)
+    if not args.grid:
+        parser.error("--grid or --validate is required")
+
+    grid = parse_grid(args.grid)
+    configs = build_grid(**grid)
+    strategy = backtest.STRATEGY_TYPE if backtest.STRATEGY_TYPE in ("NORMAL", "INVERSE") else "NORMAL"
+    method = backtest.PRIORITIZATION_METHOD if isinstance(backtest.PRIORITIZATION_METHOD, str) and backtest.PRIORITIZATION_METHOD != 'ALL' else 'RSI'
+
+    start_time = time.perf_counter()
+    if args.prepared:
+        panel = panel_store.open_panel()
+        if panel is None:
+            parser.error("no prepared data found. Run backtest.py with USE_PANEL_STORE = True first.")
+        print(f"Using the prepared data stored in {panel.path}")
+        all_historical_data, master_index = panel.to_frames(), panel.dates
+        vix_data, sp500_data, fed_funds_data = panel.market_frames()
+    else:
+        tickers_to_run, membership_intervals = backtest.load_universe()
+        all_historical_data, master_index, vix_data, sp500_data, fed_funds_data = backtest.prepare_data(tickers_to_run, membership_intervals)
+    print(f"\n--- Running {len(configs)} configurations ({strategy}, {method}) ---")
+    results = run_batch(all_historical_data, master_index, configs, method, strategy, vix_data, sp500_data, fed_funds_data)
+
+    summary_df = summarize(results)
+    print(summary_df.to_string(index=False))
+    if not summary_df.empty:
+        save_batch_report(summary_df, grid, strategy, method)
+    elapsed_seconds = time.perf_counter() - start_time
+    minutes, seconds = divmod(elapsed_seconds, 60)
+    print(f"\nTotal execution time: {int(minutes)} minutes {seconds:.1f} seconds")
+
+if __name__ == '__main__':
+    main()
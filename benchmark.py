@@ -0,0 +1,251 @@
+"""
+This script benchmarks the compute stages of the backtest and the analyzer on deterministic
+synthetic data, so timings are not polluted by network downloads.
+
+Timed stages:
+- backtest.align_data (prepare_data Step 2)
+- backtest.calculate_signals (prepare_data Step 3)
+- backtest.run_simulation
+- backtest.calculate_periodic_returns
+- backtest.generate_detailed_statistics
+- analyzer.screen_tickers over the whole universe (the path used by the scan)
+- (if TIME_ANALYZE_TICKER) analyzer.analyze_ticker called for every ticker, for comparison
+- (with --startup) the startup time of every cli.py subcommand
+
+Results are saved as JSON in docs/benchmarks so that revisions can be compared with --compare.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+# ==============================================================================
+# --- CONFIGURATION ---
+# ==============================================================================
+TICKER_COUNTS = [100, 1000, 5000]
+YEAR_COUNTS = [5, 20]
+SEED = 42
+END_DATE = "2025-12-31"
+OUTPUT_DIR = "docs/benchmarks"
+CLI_SUBCOMMANDS = ['scan', 'backtest', 'sweep', 'report']
+STARTUP_REPEATS = 5
+TIME_ANALYZE_TICKER = False # If True, also time the per-ticker analyzer.analyze_ticker loop as a secondary stage
+# ==============================================================================
+
+def generate_synthetic_universe(num_tickers, num_years, seed=SEED, end_date=END_DATE):
+    """
+    Generates a deterministic universe of OHLCV data shaped like yf.download output.
+
+    Every 15th ticker is a '.MC' ticker that misses ~2% of the trading days (local holidays),
+    and every 10th ticker starts trading later, so the calendars are not all identical.
+
+    Returns:
+        tuple: (all_historical_data, vix_data, sp500_data, fed_funds_data) as returned by backtest.download_data.
+    """
+    rng = np.random.default_rng(seed)
+    # 10 months of warm-up like backtest.download_data
+    start = pd.Timestamp(end_date) - pd.DateOffset(years=num_years, months=10)
+    dates = pd.bdate_range(start=start, end=end_date)
+    num_bars = len(dates)
+
+    drift = rng.uniform(-0.0002, 0.0008, size=num_tickers)
+    volatility = rng.uniform(0.01, 0.03, size=num_tickers)
+    returns = rng.standard_normal((num_bars, num_tickers)) * volatility + drift
+    close = rng.uniform(10, 300, size=num_tickers) * np.exp(np.cumsum(returns, axis=0))
+    open_ = close * np.exp(rng.standard_normal((num_bars, num_tickers)) * volatility * 0.3)
+    spread = np.abs(rng.standard_normal((num_bars, num_tickers))) * volatility * close * 0.5
+    high = np.maximum(open_, close) + spread
+    low = np.minimum(open_, close) - spread
+    volume = rng.integers(100_000, 10_000_000, size=(num_bars, num_tickers))
+    holidays = rng.random((num_bars, num_tickers)) < 0.02
+    late_start = rng.integers(0, num_bars // 2, size=num_tickers)
+
+    all_historical_data = {}
+    for j in range(num_tickers):
+        ticker = f"SYN{j:04d}.MC" if j % 15 == 0 else f"SYN{j:04d}"
+        mask = np.ones(num_bars, dtype=bool)
+        if j % 15 == 0:
+            mask &= ~holidays[:, j]
+        if j % 10 == 0:
+            mask[:late_start[j]] = False
+        all_historical_data[ticker] = pd.DataFrame({
+            'Open': open_[mask, j], 'High': high[mask, j], 'Low': low[mask, j],
+            'Close': close[mask, j], 'Volume': volume[mask, j]
+        }, index=dates[mask])
+
+    sp500_close = 1000 * np.exp(np.cumsum(rng.standard_normal(num_bars) * 0.01 + 0.0003))
+    sp500_data = pd.DataFrame({'open': sp500_close, 'high': sp500_close * 1.005, 'low': sp500_close * 0.995,
+                               'close': sp500_close, 'volume': 0}, index=dates)
+    sp500_data['sma_200'] = sp500_data['close'].rolling(window=200).mean()
+
+    # Mean-reverting VIX with occasional spikes above the protection level
+    vix = np.empty(num_bars)
+    vix[0] = 18.0
+    shocks = rng.standard_normal(num_bars)
+    for i in range(1, num_bars):
+        vix[i] = max(9.0, vix[i - 1] + 0.05 * (18.0 - vix[i - 1]) + shocks[i] * 1.5)
+    vix_data = pd.DataFrame({'vix_close': vix}, index=dates)
+
+    fed_dates = pd.date_range(start=dates[0], end=end_date, freq='D')
+    fed_funds_data = pd.DataFrame({'fed_rate': np.round(2 + 2 * np.sin(np.arange(len(fed_dates)) / 700), 2)}, index=fed_dates)
+
+    return all_historical_data, vix_data, sp500_data, fed_funds_data
+
+def _timed(timings, name, func, *args, **kwargs):
+    """Runs func with stdout silenced and stores its wall time in timings[name]."""
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = func(*args, **kwargs)
+    timings[name] = time.perf_counter() - start
+    return result
+
+def benchmark_scale(num_tickers, num_years):
+    """Runs every timed stage for one universe size and returns the timings in seconds."""
+    import backtest
+    import analyzer
+
+    all_historical_data, vix_data, sp500_data, fed_funds_data = generate_synthetic_universe(num_tickers, num_years)
+    backtest.START_DATE = str((pd.Timestamp(END_DATE) - pd.DateOffset(years=num_years)).date())
+    backtest.END_DATE = END_DATE
+    analyzer_frames = {ticker: df.iloc[-504:].copy() for ticker, df in all_historical_data.items()}
+
+    timings = {}
+    master_index, vix_data, sp500_data, fed_funds_data = _timed(
+        timings, "prepare_data.step2", backtest.align_data, all_historical_data, vix_data, sp500_data, fed_funds_data)
+    _timed(timings, "prepare_data.step3", backtest.calculate_signals, all_historical_data)
+    results = _timed(timings, "run_simulation", backtest.run_simulation, all_historical_data, master_index,
+                     'RSI', "NORMAL", vix_data, sp500_data, fed_funds_data, verbose=False)
+    _timed(timings, "calculate_periodic_returns", backtest.calculate_periodic_returns, results["portfolio_df"], results["completed_trades"])
+    _timed(timings, "generate_detailed_statistics", backtest.generate_detailed_statistics, results["completed_trades"])
+
+    _timed(timings, "analyzer.screen_tickers", analyzer.screen_tickers, analyzer_frames, "NORMAL", verbose=False)
+    if TIME_ANALYZE_TICKER:
+        def scan():
+            return [analyzer.analyze_ticker(ticker, "NORMAL", df=df) for ticker, df in analyzer_frames.items()]
+        _timed(timings, "analyzer.analyze_ticker", scan)
+
+    return {
+        "tickers": num_tickers,
+        "years": num_years,
+        "bars": len(master_index),
+        "trades": len(results["completed_trades"]),
+        "timings": timings
+    }
+
+def get_revision():
+    """Returns the short git revision of the working tree, or 'unknown'."""
+    try:
+        revision = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], capture_output=True, text=True).stdout.strip()
+        return f"{revision}-dirty" if dirty else revision
+    except Exception:
+        return "unknown"
+
+def measure_startup(repeats=STARTUP_REPEATS):
+    """
+    Measures the wall time of `python cli.py --startup-only <subcommand>` (interpreter start plus every
+    import the subcommand needs) and returns the best of `repeats` runs per subcommand, in seconds.
+    """
+    cli_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cli.py")
+    commands = {"python": [sys.executable, "-c", "pass"]}
+    for subcommand in CLI_SUBCOMMANDS:
+        commands[subcommand] = [sys.executable, cli_path, "--startup-only", subcommand]
+
+    startup = {}
+    for name, command in commands.items():
+        best = float('inf')
+        for _ in range(repeats):
+            start = time.perf_counter()
+            subprocess.run(command, check=True, capture_output=True, cwd=os.path.dirname(cli_path))
+            best = min(best, time.perf_counter() - start)
+        startup[name] = best
+        print(f"    startup {name:<24} {best:>10.3f}s")
+    return startup
+
+def run_benchmarks(ticker_counts, year_counts, startup=False):
+    """Benchmarks every (tickers x years) combination and returns the full result document."""
+    document = {
+        "revision": get_revision(),
+        "timestamp": datetime.now().isoformat(timespec='seconds'),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "numpy": np.__version__,
+        "seed": SEED,
+        "results": []
+    }
+    if startup:
+        print("--> Measuring cli.py startup time...")
+        document["startup"] = measure_startup()
+    for num_years in year_counts:
+        for num_tickers in ticker_counts:
+            print(f"--> Benchmarking {num_tickers} tickers x {num_years} years...")
+            result = benchmark_scale(num_tickers, num_years)
+            for stage, seconds in result["timings"].items():
+                print(f"    {stage:<32} {seconds:>10.3f}s")
+            document["results"].append(result)
+    return document
+
+def save_results(document):
+    """Saves the benchmark document as JSON and returns the file path."""
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    filename = os.path.join(OUTPUT_DIR, f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{document['revision']}.json")
+    with open(filename, 'w') as f:
+        json.dump(document, f, indent=2)
+    print(f"\nBenchmark results saved to {filename}")
+    return filename
+
+def compare_results(baseline_path, candidate_path):
+    """Prints a stage-by-stage comparison of two benchmark JSON files."""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    with open(candidate_path) as f:
+        candidate = json.load(f)
+
+    baseline_results = {(r["tickers"], r["years"]): r for r in baseline["results"]}
+    print(f"Baseline: {baseline['revision']} ({baseline['timestamp']})")
+    print(f"Candidate: {candidate['revision']} ({candidate['timestamp']})")
+    if "startup" in baseline and "startup" in candidate:
+        print("\n--- Startup ---")
+        for name, seconds in candidate["startup"].items():
+            old_seconds = baseline["startup"].get(name)
+            if old_seconds is not None:
+                print(f"{name:<32} {old_seconds:>10.3f}s {seconds:>10.3f}s  x{old_seconds / seconds:.2f}")
+    for result in candidate["results"]:
+        key = (result["tickers"], result["years"])
+        if key not in baseline_results:
+            continue
+        print(f"\n--- {key[0]} tickers x {key[1]} years ---")
+        for stage, seconds in result["timings"].items():
+            old_seconds = baseline_results[key]["timings"].get(stage)
+            if old_seconds is None:
+                print(f"{stage:<32} {'-':>10} {seconds:>10.3f}s")
+                continue
+            speedup = old_seconds / seconds if seconds > 0 else float('inf')
+            print(f"{stage:<32} {old_seconds:>10.3f}s {seconds:>10.3f}s  x{speedup:.2f}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the backtest and analyzer on synthetic data.")
+    parser.add_argument('--tickers', type=int, nargs='+', default=TICKER_COUNTS, help="Universe sizes to benchmark.")
+    parser.add_argument('--years', type=int, nargs='+', default=YEAR_COUNTS, help="History lengths (years) to benchmark.")
+    parser.add_argument('--startup', action='store_true', help="Also measure the startup time of every cli.py subcommand.")
+    parser.add_argument('--startup-only', action='store_true', help="Only measure the startup time (no synthetic universes).")
+    parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'CANDIDATE'), help="Compare two saved benchmark files.")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare_results(*args.compare)
+    else:
+        if args.startup_only:
+            save_results(run_benchmarks([], [], startup=True))
+        else:
+            save_results(run_benchmarks(args.tickers, args.years, startup=args.startup))
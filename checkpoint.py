@@ -0,0 +1,84 @@
+"""
+This script saves and restores the state of a backtest simulation, so moving END_DATE forward only
+simulates the new bars instead of replaying the whole history.
+
+A checkpoint stores the full state of run_simulation after its last bar (cash, open positions with
+their accumulated swap, system state, completed trades and equity history) and the log printed so far.
+It is identified by the configuration without END_DATE (result_cache.config_fingerprint, which includes the
+source of the backtest and of every project module it uses) and the run parameters, so a change to e.g.
+indicators.py or regime.py starts a new simulation instead of continuing one built by the old code. It is only used if
+the data up to its last bar is unchanged (a fingerprint of the prices up to that date is stored with it),
+so revised prices (e.g. dividend adjustments) or a different universe trigger a full replay.
+"""
+
+import hashlib
+import json
+import os
+import pickle
+
+import pandas as pd
+
+import result_cache
+
+# ==============================================================================
+# --- CONFIGURATION ---
+# ==============================================================================
+CHECKPOINT_DIR = ".cache/checkpoints"
+# ==============================================================================
+
+def make_key(module, **run_parameters):
+    """
+    Returns the checkpoint key of a run: its configuration (except END_DATE), which holds the code hash of the
+    project modules it uses, and its run parameters.
+    """
+    config = result_cache.config_fingerprint(module)
+    config["constants"].pop("END_DATE", None)
+    payload = json.dumps({"config": config, "run": run_parameters}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+def history_fingerprint(all_historical_data, market_frames, until):
+    """Returns a hash of the data of every ticker and market frame up to (and including) `until`."""
+    until = pd.Timestamp(until)
+    truncated = {ticker: df.loc[:until] for ticker, df in all_historical_data.items()}
+    return result_cache.data_fingerprint(truncated, *[None if frame is None else frame.loc[:until] for frame in market_frames])
+
+def _path(key):
+    return os.path.join(CHECKPOINT_DIR, f"{key}.pkl")
+
+def save(key, state, log, all_historical_data, market_frames):
+    """Saves the state returned by run_simulation and the log printed so far."""
+    if state.get("last_date") is None:
+        return
+    os.makedirs(CHECKPOINT_DIR, exist_ok=True)
+    checkpoint = {
+        "state": state,
+        "log": log,
+        "data": history_fingerprint(all_historical_data, market_frames, state["last_date"])
+    }
+    temp_path = _path(key) + ".tmp"
+    with open(temp_path, 'wb') as f:
+        pickle.dump(checkpoint, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temp_path, _path(key))
+
+def load(key, all_historical_data, market_frames, end_date):
+    """
+    Returns (state, log) of the checkpoint for `key`, or (None, "") if there is none, if it is past
+    `end_date` or if the data up to its last bar has changed.
+    """
+    path = _path(key)
+    if not os.path.exists(path):
+        return None, ""
+    try:
+        with open(path, 'rb') as f:
+            checkpoint = pickle.load(f)
+    except Exception as e:
+        print(f"Warning: Could not read checkpoint {key[:12]}. The simulation will start from the beginning. Error: {e}")
+        return None, ""
+
+    last_date = checkpoint["state"]["last_date"]
+    if last_date > pd.Timestamp(end_date):
+        return None, ""
+    if history_fingerprint(all_historical_data, market_frames, last_date) != checkpoint["data"]:
+        print(f"Checkpoint at {last_date.date()} ignored: the data up to that date has changed.")
+        return None, ""
+    return checkpoint["state"], checkpoint["log"]
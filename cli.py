@@ -0,0 +1,158 @@
+"""
+Command-line entry point for the screener and the backtests.
+
+Subcommands:
+- scan:     runs the analyzer (exit signals for held positions and new buy signals), or with --preclose
+            the pre-close scan on provisional intraday bars (preclose.py).
+- backtest: runs a single backtest with one prioritization method.
+- sweep:    runs a backtest for several prioritization methods and saves the comparison report.
+- report:   prints a saved backtest report.
+
+Heavy libraries (yfinance, requests, BeautifulSoup) are only imported by the code paths that
+download data, and `report` does not even import pandas, so commands start quickly.
+Use --startup-only to load everything a subcommand needs and exit (used by `benchmark.py --startup`).
+"""
+
+import argparse
+import importlib
+import os
+import sys
+
+REPORT_DIRS = {False: "docs/backtests", True: "docs/backtests-switching"}
+
+def load_backtest_module(switching=False):
+    """Imports backtest.py (or backtest-switching.py) on demand."""
+    return importlib.import_module("backtest-switching" if switching else "backtest")
+
+def apply_backtest_options(module, args):
+    """Overrides the configuration constants of a backtest module with the given command-line options."""
+    overrides = {
+        "START_DATE": args.start,
+        "END_DATE": args.end,
+        "STRATEGY_TYPE": args.strategy,
+        "INITIAL_CAPITAL": args.capital,
+        "LEVERAGE_FACTOR": args.leverage,
+        "MAX_CONCURRENT_POSITIONS": args.max_positions,
+        "TIME_STOP": args.time_stop,
+        "VIX_PROTECTION": args.vix_protection,
+        "SP500_ENTRY_THRESHOLD": args.sp500_threshold,
+        "CORRELATION_FILTER": args.correlation_filter,
+    }
+    if args.switching and args.strategy == 'COMBINED':
+        raise SystemExit("Error: STRATEGY_TYPE COMBINED is only available in backtest.py (not with --switching).")
+    if args.switching and args.correlation_filter:
+        raise SystemExit("Error: CORRELATION_FILTER is only available in backtest.py (not with --switching).")
+    if args.tickers:
+        overrides["TICKER_FILES"] = args.tickers
+    for name, value in overrides.items():
+        if value is not None:
+            setattr(module, name, value)
+
+def run_scan(args):
+    import analyzer
+    if args.strategy:
+        analyzer.STRATEGY_TYPE = args.strategy
+    if args.method:
+        analyzer.PRIORITIZATION_METHOD = args.method
+    if args.preclose:
+        import preclose
+        if args.startup_only:
+            return
+        preclose.run(args.budget if args.budget is not None else preclose.TIME_BUDGET, args.repeat)
+        return
+    if args.startup_only:
+        return
+    analyzer.main()
+
+def run_backtest(args):
+    module = load_backtest_module(args.switching)
+    apply_backtest_options(module, args)
+    if args.method:
+        module.PRIORITIZATION_METHOD = args.method
+    elif isinstance(module.PRIORITIZATION_METHOD, list) or module.PRIORITIZATION_METHOD == 'ALL':
+        module.PRIORITIZATION_METHOD = 'RSI'
+    if args.startup_only:
+        return
+    module.main()
+
+def run_sweep(args):
+    module = load_backtest_module(args.switching)
+    apply_backtest_options(module, args)
+    module.PRIORITIZATION_METHOD = args.methods if args.methods else 'ALL'
+    if args.startup_only:
+        return
+    module.main()
+
+def run_report(args):
+    if args.path:
+        path = args.path
+    else:
+        report_dir = REPORT_DIRS[args.switching]
+        reports = [os.path.join(report_dir, f) for f in os.listdir(report_dir) if f.endswith(".md")] if os.path.isdir(report_dir) else []
+        if not reports:
+            print(f"No reports found in '{report_dir}'. Run a backtest first.")
+            return
+        reports.sort(key=os.path.getmtime)
+        if args.list:
+            for report in reports:
+                print(report)
+            return
+        path = reports[-1]
+    if args.startup_only:
+        return
+    if not os.path.exists(path):
+        print(f"Error: Report not found at '{path}'.")
+        return
+    with open(path, encoding='utf-8') as f:
+        print(f.read())
+
+def add_backtest_arguments(parser):
+    parser.add_argument('--switching', action='store_true', help="Use backtest-switching.py instead of backtest.py.")
+    parser.add_argument('--start', help="START_DATE (YYYY-MM-DD).")
+    parser.add_argument('--end', help="END_DATE (YYYY-MM-DD).")
+    parser.add_argument('--strategy', choices=['NORMAL', 'INVERSE', 'BOTH', 'COMBINED'], help="STRATEGY_TYPE.")
+    parser.add_argument('--tickers', nargs='+', help="TICKER_FILES (CSV files).")
+    parser.add_argument('--capital', type=float, help="INITIAL_CAPITAL.")
+    parser.add_argument('--leverage', type=float, help="LEVERAGE_FACTOR.")
+    parser.add_argument('--max-positions', type=int, help="MAX_CONCURRENT_POSITIONS.")
+    parser.add_argument('--time-stop', type=int, help="TIME_STOP (0 = disabled).")
+    parser.add_argument('--vix-protection', type=float, help="VIX_PROTECTION (0 = disabled).")
+    parser.add_argument('--sp500-threshold', type=float, help="SP500_ENTRY_THRESHOLD.")
+    parser.add_argument('--correlation-filter', type=float, help="CORRELATION_FILTER (0 = disabled).")
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="RSI(2) mean-reversion screener and backtests.")
+    parser.add_argument('--startup-only', action='store_true', help="Load everything the subcommand needs and exit without running it.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    scan = subparsers.add_parser('scan', help="Scan the markets for exit and buy signals (analyzer.py).")
+    scan.add_argument('--strategy', choices=['NORMAL', 'INVERSE', 'BOTH'], help="STRATEGY_TYPE.")
+    scan.add_argument('--method', help="PRIORITIZATION_METHOD used to sort the buy signals.")
+    scan.add_argument('--preclose', action='store_true', help="Scan before the close on provisional bars built from today's intraday bars (preclose.py).")
+    scan.add_argument('--budget', type=float, help="With --preclose: time budget of a poll in seconds.")
+    scan.add_argument('--repeat', type=float, metavar='SECONDS', help="With --preclose: poll again every SECONDS until interrupted.")
+    scan.set_defaults(func=run_scan)
+
+    backtest = subparsers.add_parser('backtest', help="Run a single backtest.")
+    add_backtest_arguments(backtest)
+    backtest.add_argument('--method', help="PRIORITIZATION_METHOD (e.g. RSI, RSI_DESC, A-Z, Z-A, HV_DESC, ADX_DESC).")
+    backtest.set_defaults(func=run_backtest)
+
+    sweep = subparsers.add_parser('sweep', help="Run and compare backtests for several prioritization methods.")
+    add_backtest_arguments(sweep)
+    sweep.add_argument('--methods', nargs='+', help="Methods to compare (default: all of them).")
+    sweep.set_defaults(func=run_sweep)
+
+    report = subparsers.add_parser('report', help="Print a saved backtest report (the latest one by default).")
+    report.add_argument('path', nargs='?', help="Path of the report to print.")
+    report.add_argument('--switching', action='store_true', help="Look in the backtest-switching reports.")
+    report.add_argument('--list', action='store_true', help="List the saved reports instead of printing one.")
+    report.set_defaults(func=run_report)
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    args.func(args)
+
+if __name__ == '__main__':
+    sys.exit(main())
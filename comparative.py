@@ -0,0 +1,265 @@
+"""
+This script generates the comparative studies of docs/comparatives (e.g. RSI vs RSI_DESC in the 2008
+crisis, 2020, 2022 and 2025) in one command, instead of editing START_DATE / END_DATE and rerunning
+backtest.py for every window and method.
+
+1. The data is downloaded and prepared once (backtest.prepare_data) for the union of the windows.
+2. Every (window x method x strategy) cell is simulated with backtest.run_simulation, with START_DATE and
+   END_DATE set to the window, in a process pool. The workers open the prepared panel from the store
+   (memory-mapped, see panel_store.py) instead of receiving a copy of the data.
+3. A markdown report with the summary table of every window (one table per strategy, sorted by total
+   return, as in backtest.save_comparison_report) is saved for each window, plus one report with all the
+   windows.
+
+The other parameters (capital, leverage, VIX protection, TIME_STOP...) are read from backtest.py.
+
+Usage:
+    python comparative.py
+    python comparative.py --window 2008CRISIS=2007-10-01:2009-03-31 --window 2020=2020-01-01:2020-12-31 --methods RSI RSI_DESC
+    python comparative.py --prepared --strategies NORMAL INVERSE --workers 4
+    python comparative.py --validate
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+import backtest
+import panel_store
+
+# ==============================================================================
+# --- CONFIGURATION ---
+# ==============================================================================
+WINDOWS = { # Name: (START_DATE, END_DATE)
+    "2008CRISIS": ("2007-10-01", "2009-03-31"),
+    "2020": ("2020-01-01", "2020-12-31"),
+    "2022": ("2022-01-01", "2022-12-31"),
+    "2025": ("2025-01-01", "2025-12-31"),
+}
+METHODS = ['RSI', 'RSI_DESC']
+STRATEGIES = ['NORMAL'] # 'NORMAL', 'INVERSE' and/or 'COMBINED'
+WORKERS = os.cpu_count() or 1
+OUTPUT_DIR = "docs/comparatives/windows" # Reports are overwritten when a study is regenerated
+VALIDATION_TICKERS = 20 # Size of the synthetic universe used by --validate
+VALIDATION_YEARS = 3
+# ==============================================================================
+
+_worker_data = None
+
+def constants():
+    """Returns the configuration constants of backtest.py, sent to the workers so they simulate the same configuration."""
+    return {name: getattr(backtest, name) for name in dir(backtest)
+            if name.isupper() and isinstance(getattr(backtest, name), (bool, int, float, str, list, tuple, dict, type(None)))}
+
+def _init_worker(panel_path, data, constants):
+    """Opens the prepared panel (or takes the data sent by the parent process) once per worker."""
+    global _worker_data
+    for name, value in constants.items():
+        setattr(backtest, name, value)
+    if panel_path is not None:
+        panel = panel_store.PreparedPanel(panel_path)
+        data = (panel.to_frames(), panel.dates) + panel.market_frames()
+    _worker_data = data
+
+def run_cell(window, start_date, end_date, method, strategy):
+    """Simulates one (window, method, strategy) cell on the worker data and returns its summary row (dict)."""
+    all_historical_data, master_index, vix_data, sp500_data, fed_funds_data = _worker_data
+    backtest.START_DATE, backtest.END_DATE = start_date, end_date
+    start_time = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        # The simulation stops at the window end, as a backtest with the data downloaded up to END_DATE
+        results = backtest.run_simulation(all_historical_data, master_index, method, strategy, vix_data, sp500_data, fed_funds_data,
+                                          verbose=False, end_date=end_date)
+    performance = backtest.calculate_summary_performance(results["portfolio_df"], results["completed_trades"]) or {}
+    performance.update(backtest.calculate_risk_statistics(results["equity"]) if results.get("equity") is not None else {})
+    return {"Window": window, "Strategy": strategy, "Method": method, **performance,
+            "Margin Call": results["state"]["halted"], "Seconds": round(time.perf_counter() - start_time, 1)}
+
+def run_cells(cells, data, panel_path=None, workers=WORKERS):
+    """
+    Runs every (window, start, end, method, strategy) cell, in a process pool if workers > 1.
+    The workers open the panel at `panel_path` if given; otherwise `data` is sent to each of them.
+    """
+    backtest_constants = constants()
+    if workers <= 1 or len(cells) <= 1:
+        _init_worker(None, data, backtest_constants)
+        try:
+            return [run_cell(*cell) for cell in cells]
+        finally:
+            _init_worker(None, None, backtest_constants) # Restores START_DATE / END_DATE
+    with ProcessPoolExecutor(max_workers=min(workers, len(cells)), initializer=_init_worker,
+                             initargs=(panel_path, None if panel_path else data, backtest_constants)) as executor:
+        futures = [executor.submit(run_cell, *cell) for cell in cells]
+        return [future.result() for future in futures]
+
+def sp500_return(sp500_data, start_date, end_date):
+    """Returns the S&P 500 price return over a window (%), or None if not available."""
+    if sp500_data is None:
+        return None
+    close = sp500_data["close"].loc[pd.Timestamp(start_date):pd.Timestamp(end_date)].dropna()
+    return (close.iloc[-1] / close.iloc[0] - 1) * 100 if len(close) > 1 else None
+
+def summary_table(rows):
+    """Returns the summary table of one window and strategy, indexed by method and sorted by total return."""
+    summary_df = pd.DataFrame(rows).set_index("Method").drop(columns=["Window", "Strategy", "Seconds"])
+    summary_df['Total Return (sort)'] = summary_df['Total Return'].str.replace('%', '').astype(float)
+    return summary_df.sort_values(by='Total Return (sort)', ascending=False).drop(columns=['Total Return (sort)'])
+
+def _write_window(f, window, start_date, end_date, rows, sp500_data, level="##"):
+    f.write(f"{level} {window}: {start_date} to {end_date}\n\n")
+    benchmark = sp500_return(sp500_data, start_date, end_date)
+    if benchmark is not None:
+        f.write(f"**S&P 500:** {benchmark:.2f}%\n\n")
+    for strategy in dict.fromkeys(row["Strategy"] for row in rows):
+        strategy_rows = [row for row in rows if row["Strategy"] == strategy and "Total Return" in row]
+        f.write(f"#{level} Overall Performance Summary for {strategy} Strategy\n\n")
+        f.write(summary_table(strategy_rows).to_markdown() if strategy_rows else "No results (no trading days in the window).")
+        f.write("\n\n")
+
+def _write_parameters(f):
+    f.write(f"**Initial Capital:** ${backtest.INITIAL_CAPITAL:,.2f}\n")
+    f.write(f"**Leverage:** 1:{backtest.LEVERAGE_FACTOR}\n")
+    f.write(f"**Max Concurrent Positions:** {backtest.MAX_CONCURRENT_POSITIONS}\n")
+    f.write(f"**VIX Protection:** {backtest.VIX_PROTECTION}\n")
+    f.write(f"**Panic Button:** {backtest.PANIC_BUTTON}\n")
+    f.write(f"**Time Stop (days):** {backtest.TIME_STOP}\n")
+    f.write(f"**S&P500 Entry Threshold:** {backtest.SP500_ENTRY_THRESHOLD}\n")
+    f.write(f"**Correlation Filter:** {backtest.CORRELATION_FILTER} ({backtest.CORRELATION_WINDOW} days)\n\n")
+
+def save_comparative_reports(windows, methods, results, sp500_data):
+    """Saves one report per window and one with all the windows; returns the paths."""
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    methods_name = "-vs-".join(methods)
+    paths = []
+    for window, (start_date, end_date) in windows.items():
+        path = os.path.join(OUTPUT_DIR, f"{window}-COMP_{methods_name}.md")
+        with open(path, 'w') as f:
+            f.write(f"# Comparative Backtest Report: {window} ({methods_name})\n\n")
+            _write_parameters(f)
+            f.write("---\n\n")
+            _write_window(f, window, start_date, end_date, [row for row in results if row["Window"] == window], sp500_data)
+        paths.append(path)
+
+    path = os.path.join(OUTPUT_DIR, f"COMPARATIVE_{methods_name}.md")
+    with open(path, 'w') as f:
+        f.write(f"# Comparative Backtest Report: {methods_name} by Window\n\n")
+        _write_parameters(f)
+        for window, (start_date, end_date) in windows.items():
+            f.write("---\n\n")
+            _write_window(f, window, start_date, end_date, [row for row in results if row["Window"] == window], sp500_data)
+    paths.append(path)
+    print(f"\nComparative reports saved to {OUTPUT_DIR}: {', '.join(os.path.basename(p) for p in paths)}")
+    return paths
+
+def parse_windows(assignments):
+    """Parses NAME=START:END assignments into {name: (start, end)}."""
+    windows = {}
+    for assignment in assignments:
+        name, _, dates = assignment.partition("=")
+        start_date, _, end_date = dates.partition(":")
+        try:
+            pd.Timestamp(start_date), pd.Timestamp(end_date)
+        except ValueError:
+            raise ValueError(f"Invalid window '{assignment}'. Use NAME=YYYY-MM-DD:YYYY-MM-DD")
+        if not name or not start_date or not end_date or start_date > end_date:
+            raise ValueError(f"Invalid window '{assignment}'. Use NAME=YYYY-MM-DD:YYYY-MM-DD")
+        windows[name] = (start_date, end_date)
+    return windows
+
+def truncate_data(data, end_date):
+    """Returns the prepared data cut at `end_date`, as if it had only been downloaded up to that date."""
+    all_historical_data, master_index, vix_data, sp500_data, fed_funds_data = data
+    end = pd.Timestamp(end_date)
+    return (({ticker: df.loc[:end] for ticker, df in all_historical_data.items()}, master_index[master_index <= end])
+            + tuple(None if frame is None else frame.loc[:end] for frame in (vix_data, sp500_data, fed_funds_data)))
+
+def validate(num_tickers=VALIDATION_TICKERS, num_years=VALIDATION_YEARS):
+    """
+    Checks on a synthetic universe that the cells of windows that end before the data (and at its end) give
+    the same summary as a separate backtest on the data cut at the window end. Returns True if they all match.
+    """
+    import benchmark
+
+    all_historical_data, vix_data, sp500_data, fed_funds_data = benchmark.generate_synthetic_universe(num_tickers, num_years)
+    with contextlib.redirect_stdout(io.StringIO()):
+        master_index, vix_data, sp500_data, fed_funds_data = backtest.align_data(all_historical_data, vix_data, sp500_data, fed_funds_data)
+        backtest.calculate_signals(all_historical_data)
+    data = (all_historical_data, master_index, vix_data, sp500_data, fed_funds_data)
+    end_date = pd.Timestamp(benchmark.END_DATE)
+    windows = {"MIDDLE": (str((end_date - pd.DateOffset(years=2)).date()), str((end_date - pd.DateOffset(years=1)).date())),
+               "LAST": (str((end_date - pd.DateOffset(years=1)).date()), str(end_date.date()))}
+    cells = [(window, start_date, end_date, method, strategy)
+             for window, (start_date, end_date) in windows.items() for strategy in ['NORMAL', 'INVERSE'] for method in ['RSI', 'RSI_DESC']]
+    results = run_cells(cells, data, workers=1)
+    mismatches = 0
+    for cell, row in zip(cells, results):
+        reference = run_cells([cell], truncate_data(data, cell[2]), workers=1)[0]
+        same = {k: v for k, v in row.items() if k != "Seconds"} == {k: v for k, v in reference.items() if k != "Seconds"}
+        if not same:
+            mismatches += 1
+            print(f"{cell[0]} {cell[4]} {cell[3]}: {row.get('Total Trades')} trades vs {reference.get('Total Trades')} in a backtest cut at {cell[2]}")
+    print(f"{len(cells) - mismatches}/{len(cells)} cells equal a separate backtest on the data cut at the window end.")
+    print("Comparative validation passed." if mismatches == 0 else "Comparative validation FAILED.")
+    return mismatches == 0
+
+def main():
+    parser = argparse.ArgumentParser(description="Run every (window x method x strategy) backtest in parallel on data prepared once and save the comparison tables.")
+    parser.add_argument('--window', action='append', metavar='NAME=START:END', help="Date window (repeat for several). Default: WINDOWS.")
+    parser.add_argument('--methods', nargs='+', default=METHODS, help=f"Prioritization methods (default: {' '.join(METHODS)}).")
+    parser.add_argument('--strategies', nargs='+', choices=['NORMAL', 'INVERSE', 'COMBINED'], default=STRATEGIES, help="Strategies (default: %(default)s).")
+    parser.add_argument('--workers', type=int, default=WORKERS, help=f"Worker processes (default: {WORKERS}).")
+    parser.add_argument('--prepared', action='store_true', help="Use the data last prepared by backtest.py (see panel_store.py) instead of downloading it.")
+    parser.add_argument('--validate', action='store_true', help="Check on synthetic data that every window gives the same results as a separate backtest.")
+    args = parser.parse_args()
+    if args.validate:
+        raise SystemExit(0 if validate() else 1)
+    try:
+        windows = parse_windows(args.window) if args.window else dict(WINDOWS)
+    except ValueError as e:
+        parser.error(str(e))
+
+    start_time = time.perf_counter()
+    first_date, last_date = min(start for start, _ in windows.values()), max(end for _, end in windows.values())
+    panel_path = None
+    if args.prepared:
+        panel = panel_store.open_panel()
+        if panel is None:
+            parser.error("no prepared data found. Run backtest.py with USE_PANEL_STORE = True first.")
+        print(f"Using the prepared data stored in {panel.path}")
+        if panel.dates[0] > pd.Timestamp(first_date) or panel.dates[-1] < pd.Timestamp(last_date):
+            print(f"Warning: The prepared data ({panel.dates[0].date()} to {panel.dates[-1].date()}) does not cover every window ({first_date} to {last_date}).")
+        panel_path = panel.path
+        data = (panel.to_frames(), panel.dates) + panel.market_frames()
+    else:
+        # One download and preparation for the union of the windows
+        backtest.START_DATE, backtest.END_DATE = first_date, last_date
+        tickers_to_run, membership_intervals = backtest.load_universe()
+        data = backtest.prepare_data(tickers_to_run, membership_intervals)
+        if backtest.USE_PANEL_STORE:
+            panel = panel_store.open_panel()
+            panel_path = panel.path if panel is not None and panel.dates.equals(data[1]) else None
+
+    cells = [(window, start_date, end_date, method, strategy)
+             for window, (start_date, end_date) in windows.items() for strategy in args.strategies for method in args.methods]
+    print(f"\n--- Running {len(cells)} simulations ({len(windows)} windows x {len(args.methods)} methods x {len(args.strategies)} strategies) with {min(args.workers, len(cells))} workers ---")
+    run_start = time.perf_counter()
+    results = run_cells(cells, data, panel_path, args.workers)
+    print(f"Simulations finished in {time.perf_counter() - run_start:.1f} seconds (sum of the simulation times: {sum(row['Seconds'] for row in results):.1f} seconds).")
+
+    for window in windows:
+        for strategy in args.strategies:
+            rows = [row for row in results if row["Window"] == window and row["Strategy"] == strategy and "Total Return" in row]
+            print(f"\n--- {window}: Overall Performance Summary for {strategy} Strategy ---")
+            print(summary_table(rows) if rows else "No results to display.")
+    save_comparative_reports(windows, args.methods, results, data[3])
+    elapsed_seconds = time.perf_counter() - start_time
+    minutes, seconds = divmod(elapsed_seconds, 60)
+    print(f"\nTotal execution time: {int(minutes)} minutes {seconds:.1f} seconds")
+
+if __name__ == '__main__':
+    main()
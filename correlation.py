@@ -0,0 +1,127 @@
+"""
+This module keeps the rolling correlation of daily returns between the held positions and the rest of the
+universe, for the entry filter of backtest.py (CORRELATION_FILTER).
+
+Recomputing an N x N correlation matrix every day is O(N^2) per bar (and O(N^2 * window) from scratch),
+which is too slow for a 600+ ticker universe inside the daily loop. The filter only needs the correlation
+of each candidate with the few held positions, so the tracker maintains incrementally, over the last
+`window` returns:
+
+- the sum and the sum of squares of the returns of every ticker (O(N) per bar),
+- for every held position, the sum of the products of its returns with the returns of every ticker
+  (O(N) per bar and held position, computed from the window when the position is opened).
+
+Advancing one bar adds the new returns and subtracts the ones leaving the window (a ring buffer), so the
+cost per bar is O(N * held positions) instead of O(N^2).
+
+A correlation is only defined when both tickers have a return on every bar of the window; otherwise
+(e.g. recently listed tickers) it is NaN and the filter lets the candidate through.
+"""
+
+import numpy as np
+
+class RollingCorrelation:
+    """Rolling correlation of daily returns between held tickers and the universe (see the module docstring)."""
+
+    def __init__(self, close_panel, ticker_columns, window):
+        """
+        Args:
+            close_panel (np.ndarray): Close prices (dates, tickers).
+            ticker_columns (dict): Column of every ticker in close_panel.
+            window (int): Number of daily returns in the rolling window.
+        """
+        self.close_panel = close_panel
+        self.ticker_columns = ticker_columns
+        self.window = window
+        self.bar = None # Last bar included in the window
+        num_tickers = close_panel.shape[1]
+        self.returns = np.zeros((window, num_tickers)) # Ring buffer: the return of bar j is in row j % window (0 if missing)
+        self.valid = np.zeros((window, num_tickers), dtype=bool)
+        self.sums = np.zeros(num_tickers)
+        self.squares = np.zeros(num_tickers)
+        self.counts = np.zeros(num_tickers, dtype=np.int64)
+        self.cross = {} # Held column -> sum of its returns times the returns of every ticker
+
+    def _bar_returns(self, j):
+        """Returns the returns of bar j (0 where missing) and their validity."""
+        if j < 1:
+            num_tickers = self.close_panel.shape[1]
+            return np.zeros(num_tickers), np.zeros(num_tickers, dtype=bool)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            r = self.close_panel[j] / self.close_panel[j - 1] - 1
+        valid = np.isfinite(r)
+        return np.where(valid, r, 0.0), valid
+
+    def _rebuild(self, i):
+        """Fills the window with bars i - window + 1 .. i from scratch."""
+        for j in range(i - self.window + 1, i + 1):
+            self.returns[j % self.window], self.valid[j % self.window] = self._bar_returns(j)
+        self.sums = self.returns.sum(axis=0)
+        self.squares = np.square(self.returns).sum(axis=0)
+        self.counts = self.valid.sum(axis=0)
+        self.cross = {}
+        self.bar = i
+
+    def _push(self, j):
+        """Adds bar j to the window and removes bar j - window."""
+        slot = j % self.window
+        r, valid = self._bar_returns(j)
+        old = self.returns[slot]
+        self.sums += r - old
+        self.squares += np.square(r) - np.square(old)
+        self.counts += valid.astype(np.int64) - self.valid[slot]
+        for column, cross in self.cross.items():
+            cross += r[column] * r - old[column] * old
+        self.returns[slot], self.valid[slot] = r, valid
+        self.bar = j
+
+    def advance(self, i, held_tickers=()):
+        """
+        Moves the window to end on bar i and only keeps the cross sums of `held_tickers`
+        (positions closed since the last call are dropped).
+        """
+        held_columns = {self.ticker_columns[ticker] for ticker in held_tickers}
+        for column in list(self.cross):
+            if column not in held_columns:
+                del self.cross[column]
+        if self.bar is None or i - self.bar >= self.window or i < self.bar:
+            self._rebuild(i)
+        else:
+            for j in range(self.bar + 1, i + 1):
+                self._push(j)
+
+    def _cross(self, column):
+        """Returns the cross sums of a held column, computing them from the window the first time."""
+        if column not in self.cross:
+            self.cross[column] = self.returns[:, column] @ self.returns
+        return self.cross[column]
+
+    def correlation(self, ticker, other):
+        """Returns the correlation of the returns of two tickers over the window (NaN if not defined)."""
+        a, b = self.ticker_columns[ticker], self.ticker_columns[other]
+        if self.counts[a] < self.window or self.counts[b] < self.window:
+            return np.nan
+        n = self.window
+        covariance = self._cross(b)[a] - self.sums[a] * self.sums[b] / n
+        variance_a = self.squares[a] - self.sums[a] ** 2 / n
+        variance_b = self.squares[b] - self.sums[b] ** 2 / n
+        if variance_a <= 0 or variance_b <= 0:
+            return np.nan
+        return covariance / np.sqrt(variance_a * variance_b)
+
+    def max_correlation(self, ticker, side, positions):
+        """
+        Returns (correlation, held ticker) of the held position most correlated with opening `ticker` on `side`,
+        or (NaN, None). A long and a short on correlated tickers offset each other, so the correlation is signed
+        by the sides (a short of a ticker correlated with a long counts as negatively correlated).
+        """
+        best, best_ticker = np.nan, None
+        for held, pos_info in positions.items():
+            value = self.correlation(ticker, held)
+            if np.isnan(value):
+                continue
+            if (side == "INVERSE") != (pos_info["side"] == "INVERSE"):
+                value = -value
+            if np.isnan(best) or value > best:
+                best, best_ticker = value, held
+        return best, best_ticker
@@ -0,0 +1,293 @@
+"""
+This module downloads the daily bars of a ticker universe in batches for backtest.py and backtest-switching.py.
+It runs as fast as the data provider allows and keeps going until every symbol has been downloaded or has
+used up its attempts.
+
+- A token bucket limits the number of symbols requested per second (RATE_LIMIT, with bursts of up to
+  RATE_BURST symbols). yfinance fetches every symbol of a batch separately, so a batch costs one token per symbol.
+- The batch size adapts. It grows by BATCH_SIZE_STEP after every batch that downloads without error. It is
+  halved (down to MIN_BATCH_SIZE) after a batch that raises or returns no symbol at all, which is what
+  throttling looks like. After such a batch, the next request waits an exponential backoff.
+- Symbols missing from a result, or in a failed batch, go to a retry queue. They are requested again, batched
+  with the other retries, after a backoff that doubles with each attempt, up to MAX_ATTEMPTS attempts.
+- Every symbol ends with a status: 'ok', 'missing' (never returned) or 'failed' (its last request raised). The
+  status also holds the number of attempts and the last error, so gaps in the universe are reported instead
+  of silently skipped.
+
+A provider is any function that takes a list of symbols and returns {symbol: DataFrame} with the symbols it
+could download. yfinance_provider wraps yf.download. FakeProvider serves a synthetic universe on a simulated
+clock and injects failures, missing symbols, latency and a rate limit of its own. It is used by --validate.
+
+Usage:
+    python downloader.py --validate
+"""
+
+import argparse
+import heapq
+import random
+import time
+from collections import deque
+
+# ==============================================================================
+# --- CONFIGURATION ---
+# ==============================================================================
+RATE_LIMIT = 50 # Symbols requested per second (on average)
+RATE_BURST = 200 # Symbols that can be requested at once after an idle period
+INITIAL_BATCH_SIZE = 100
+MIN_BATCH_SIZE = 5
+MAX_BATCH_SIZE = 200
+BATCH_SIZE_STEP = 20 # The batch size grows by this after every successful batch and is halved after a failed one
+MAX_ATTEMPTS = 4 # Requests per symbol before it is reported as missing or failed
+BACKOFF_BASE = 2.0 # Seconds to wait after a first failure, doubled after each consecutive one
+BACKOFF_MAX = 60.0
+# ==============================================================================
+VALIDATION_TICKERS = 600
+VALIDATION_YEARS = 5
+VALIDATION_UNKNOWN = 10 # Symbols the fake provider does not have (e.g. delisted tickers)
+# ==============================================================================
+
+class TokenBucket:
+    """Allows `rate` tokens per second on average, with bursts of up to `capacity` tokens."""
+
+    def __init__(self, rate, capacity, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.sleep = sleep
+        self.tokens = capacity
+        self.updated = clock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, tokens=1):
+        """
+        Waits until `tokens` tokens are available and takes them. A request for more than the capacity waits
+        for a full bucket and leaves it in debt, so the average rate is still respected.
+        """
+        self._refill()
+        needed = min(tokens, self.capacity)
+        if self.tokens < needed:
+            self.sleep((needed - self.tokens) / self.rate)
+            self._refill()
+        self.tokens -= tokens
+
+    def try_acquire(self, tokens=1):
+        """Takes `tokens` tokens if they are available and returns True, or returns False without waiting."""
+        self._refill()
+        if self.tokens < tokens:
+            return False
+        self.tokens -= tokens
+        return True
+
+def backoff(failures):
+    """Returns the seconds to wait after `failures` consecutive failures."""
+    return min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (failures - 1))
+
+def download(symbols, provider, clock=time.monotonic, sleep=time.sleep, verbose=True):
+    """
+    Downloads the symbols with the provider (see the module docstring).
+
+    Returns:
+        tuple: ({symbol: DataFrame} of the downloaded symbols, in the order of `symbols`,
+                {symbol: {"status": 'ok' | 'missing' | 'failed', "attempts": int, "error": str or None}}).
+    """
+    bucket = TokenBucket(RATE_LIMIT, RATE_BURST, clock, sleep)
+    status = {symbol: {"status": "pending", "attempts": 0, "error": None} for symbol in symbols}
+    pending = deque(status) # Symbols not requested yet, in order
+    retries = [] # Heap of (time the retry is due, sequence, symbol)
+    sequence = 0
+    frames = {}
+    batch_size = INITIAL_BATCH_SIZE
+    failures = 0 # Consecutive failed batches
+    not_before = clock()
+
+    while pending or retries:
+        now = clock()
+        if not_before > now:
+            sleep(not_before - now)
+            now = clock()
+        batch = []
+        while retries and retries[0][0] <= now and len(batch) < batch_size:
+            batch.append(heapq.heappop(retries)[2])
+        while pending and len(batch) < batch_size:
+            batch.append(pending.popleft())
+        if not batch: # Only retries that are not due yet
+            sleep(retries[0][0] - now)
+            continue
+
+        bucket.acquire(len(batch))
+        for symbol in batch:
+            status[symbol]["attempts"] += 1
+        try:
+            result, error = provider(batch), None
+        except Exception as e:
+            result, error = {}, f"{type(e).__name__}: {e}"
+        returned = [symbol for symbol in batch if symbol in result]
+        for symbol in returned:
+            frames[symbol] = result[symbol]
+            status[symbol].update(status="ok", error=None)
+
+        if error is not None or (not returned and len(batch) > 1):
+            failures += 1
+            new_size = max(MIN_BATCH_SIZE, batch_size // 2)
+            not_before = clock() + backoff(failures)
+            if verbose:
+                print(f"Batch of {len(batch)} symbols starting with {batch[0]} failed ({error or 'no symbol returned'}). "
+                      f"Batch size {batch_size} -> {new_size}, waiting {backoff(failures):.0f}s.")
+            batch_size = new_size
+        else:
+            failures = 0
+            batch_size = min(MAX_BATCH_SIZE, batch_size + BATCH_SIZE_STEP)
+
+        for symbol in batch:
+            symbol_status = status[symbol]
+            if symbol_status["status"] == "ok":
+                continue
+            symbol_status["error"] = error or "not returned"
+            if symbol_status["attempts"] >= MAX_ATTEMPTS:
+                symbol_status["status"] = "failed" if error is not None else "missing"
+            else:
+                heapq.heappush(retries, (clock() + backoff(symbol_status["attempts"]), sequence, symbol))
+                sequence += 1
+
+    return {symbol: frames[symbol] for symbol in status if symbol in frames}, status
+
+def print_status_report(status):
+    """Prints how many symbols were downloaded and the ones that were not, with their last error."""
+    counts = {}
+    for symbol_status in status.values():
+        counts[symbol_status["status"]] = counts.get(symbol_status["status"], 0) + 1
+    retried = sum(1 for symbol_status in status.values() if symbol_status["status"] == "ok" and symbol_status["attempts"] > 1)
+    print(f"Download status: {counts.get('ok', 0)} ok ({retried} after a retry), "
+          f"{counts.get('missing', 0)} missing, {counts.get('failed', 0)} failed.")
+    for symbol, symbol_status in status.items():
+        if symbol_status["status"] != "ok":
+            print(f"  {symbol}: {symbol_status['status']} after {symbol_status['attempts']} attempts ({symbol_status['error']})")
+
+def yfinance_provider(start, end):
+    """Returns a provider that downloads the daily bars from `start` to `end` with yf.download."""
+    import yfinance as yf
+
+    def provider(symbols):
+        data = yf.download(symbols, start=start, end=end, progress=False, group_by='ticker')
+        frames = {}
+        if data is None or data.empty:
+            return frames
+        for symbol in symbols:
+            try:
+                df = data[symbol]
+            except KeyError:
+                continue # Ticker might not be in the downloaded batch
+            # yf.download leaves the columns of a failed symbol empty instead of raising
+            if not df.dropna(subset=['Open', 'High', 'Low', 'Close']).empty:
+                frames[symbol] = df
+        return frames
+    return provider
+
+class SimulatedClock:
+    """A clock whose sleep() advances the time instantly, for FakeProvider and --validate."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += max(seconds, 0.0)
+
+class FakeProvider:
+    """
+    A local provider over a dict of DataFrames that behaves like a throttled API:
+    - every request takes `latency` + `latency_per_symbol` * symbols (simulated) seconds,
+    - requests above its own rate limit (`rate` symbols per second, bursts of `burst`) are rejected,
+    - batches larger than `max_batch_size` time out,
+    - a request fails with probability `failure_rate`, and each symbol is left out of a result with
+      probability `missing_rate`,
+    - symbols it does not have are never returned.
+    """
+
+    def __init__(self, data, clock, rate=60, burst=300, max_batch_size=150, failure_rate=0.1, missing_rate=0.02,
+                 latency=0.5, latency_per_symbol=0.02, seed=0):
+        self.data = data
+        self.clock = clock
+        self.limit = TokenBucket(rate, burst, clock.time, clock.sleep)
+        self.max_batch_size = max_batch_size
+        self.failure_rate = failure_rate
+        self.missing_rate = missing_rate
+        self.latency = latency
+        self.latency_per_symbol = latency_per_symbol
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.rejected = 0
+
+    def __call__(self, symbols):
+        self.requests += 1
+        if not self.limit.try_acquire(len(symbols)):
+            self.rejected += 1
+            self.clock.sleep(self.latency)
+            raise ConnectionError("429 Too Many Requests")
+        self.clock.sleep(self.latency + self.latency_per_symbol * len(symbols))
+        if len(symbols) > self.max_batch_size:
+            raise TimeoutError(f"request for {len(symbols)} symbols timed out")
+        if self.random.random() < self.failure_rate:
+            raise ConnectionError("connection reset by peer")
+        return {symbol: self.data[symbol] for symbol in symbols
+                if symbol in self.data and self.random.random() >= self.missing_rate}
+
+def download_fixed_batches(symbols, provider, sleep):
+    """The previous download loop: batches of 100 symbols and a 1s pause; a failed batch is dropped."""
+    frames = {}
+    for i in range(0, len(symbols), 100):
+        try:
+            frames.update(provider(symbols[i:i + 100]))
+        except Exception:
+            pass
+        sleep(1)
+    return frames
+
+def validate(num_tickers=VALIDATION_TICKERS, num_years=VALIDATION_YEARS):
+    """
+    Downloads a synthetic universe (plus VALIDATION_UNKNOWN symbols the provider does not have) from a
+    FakeProvider with failures, missing symbols and latency. Checks that every available symbol is downloaded
+    with its data unchanged and that the unknown symbols are reported as missing after MAX_ATTEMPTS attempts.
+    The previous fixed-batch loop is run on the same provider for comparison. Returns True if the checks pass.
+    """
+    import benchmark
+
+    universe = benchmark.generate_synthetic_universe(num_tickers, num_years)[0]
+    unknown = [f"UNKNOWN{j}" for j in range(VALIDATION_UNKNOWN)]
+    symbols = list(universe) + unknown
+
+    clock = SimulatedClock()
+    provider = FakeProvider(universe, clock)
+    frames, status = download(symbols, provider, clock=clock.time, sleep=clock.sleep, verbose=False)
+    seconds = clock.time()
+    print_status_report(status)
+
+    all_valid = list(frames) == list(universe) and all(frames[symbol] is universe[symbol] for symbol in universe)
+    all_valid &= all(status[symbol]["status"] == "missing" and status[symbol]["attempts"] == MAX_ATTEMPTS for symbol in unknown)
+    print(f"Scheduler: {len(frames)}/{len(universe)} symbols in {seconds:.0f} simulated seconds "
+          f"({len(frames) / seconds:.1f} symbols/s), {provider.requests} requests, {provider.rejected} rejected by the rate limit.")
+
+    clock = SimulatedClock()
+    provider = FakeProvider(universe, clock)
+    fixed_frames = download_fixed_batches(symbols, provider, clock.sleep)
+    print(f"Fixed batches: {len(fixed_frames)}/{len(universe)} symbols in {clock.time():.0f} simulated seconds, "
+          f"{provider.requests} requests, {provider.rejected} rejected by the rate limit.")
+    print("All symbols downloaded and reported." if all_valid else "MISMATCH: some symbols were lost or misreported.")
+    return all_valid
+
+def main():
+    parser = argparse.ArgumentParser(description="Rate-limited batch downloader with retries (used by backtest.py).")
+    parser.add_argument('--validate', action='store_true', help="Download a synthetic universe from a fake provider that injects failures and latency.")
+    args = parser.parse_args()
+    if not args.validate:
+        parser.error("--validate is required")
+    raise SystemExit(0 if validate() else 1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,189 @@
+"""
+This script measures the edge of the buy signals themselves, independently of the portfolio.
+
+The backtest only trades the signals that win a slot, so its statistics depend on MAX_CONCURRENT_POSITIONS,
+the cash available and the prioritization method. This study takes every is_buy_signal_normal /
+is_buy_signal_inverse occurrence of the (dates, tickers) panel between START_DATE and END_DATE and computes:
+
+- the return to the natural exit (exit signal, TIME_STOP or SMA(200) cross, as in backtest.compute_exit_bars),
+- the return after a fixed number of trading bars (HORIZONS and TIME_STOP),
+
+as the return of the position side (INVERSE signals are shorts). The signals are then aggregated by RSI(2),
+HV(100) and ADX(14) bucket at entry, by year and by ticker.
+
+Usage:
+    python edge_study.py
+    python edge_study.py --prepared --strategy INVERSE
+"""
+
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+import backtest
+import panel_store
+
+# ==============================================================================
+# --- CONFIGURATION ---
+# ==============================================================================
+HORIZONS = [1, 3, 5, 10] # Forward returns after this many trading bars (TIME_STOP is added if > 0)
+RSI_BUCKET = 0.5 # Bucket widths at entry (same ranges as the backtest detailed statistics)
+HV_BUCKET = 0.1
+ADX_BUCKET = 10
+MIN_SIGNALS = 5 # Buckets, years and tickers with fewer signals are left out of the report
+OUTPUT_DIR = "docs/comparatives/edge-studies"
+# ==============================================================================
+
+def horizons():
+    """Returns the forward horizons in bars: HORIZONS plus backtest.TIME_STOP if it is enabled."""
+    return sorted(set(HORIZONS + ([backtest.TIME_STOP] if backtest.TIME_STOP > 0 else [])))
+
+def study_signals(all_historical_data, master_index, side):
+    """
+    Returns a DataFrame with one row per buy signal of `side` between START_DATE and END_DATE: ticker, date,
+    year, rsi, hv, adx, exit_return, exit_bars (bars to the natural exit, NaN if it did not exit before the end
+    of the data) and return_<h> for every horizon (NaN if the data ends before).
+    Returns are fractions, signed for the side (an INVERSE signal gains when the price falls).
+    """
+    sign = -1.0 if side == "INVERSE" else 1.0
+    start, end = master_index.searchsorted(pd.Timestamp(backtest.START_DATE)), master_index.searchsorted(pd.Timestamp(backtest.END_DATE), side='right')
+    exit_bars = backtest.compute_exit_bars(all_historical_data, master_index, side)
+    forward = horizons()
+
+    columns = {name: [] for name in ["ticker", "bar", "rsi", "hv", "adx", "exit_return", "exit_bars"] + [f"return_{h}" for h in forward]}
+    for ticker, df in all_historical_data.items():
+        buy_bars = np.flatnonzero(df[f"is_buy_signal_{side.lower()}"].to_numpy(dtype=bool))
+        buy_bars = buy_bars[(buy_bars >= start) & (buy_bars < end)]
+        if len(buy_bars) == 0:
+            continue
+        close = df["close"].to_numpy(dtype=float)
+        entry_price = close[buy_bars]
+        traded = df["traded"].to_numpy(dtype=bool) if "traded" in df.columns else np.ones(len(close), dtype=bool)
+        traded_bars = np.flatnonzero(traded)
+
+        # Natural exit (precomputed for every buy bar, as scheduled by the simulation)
+        ticker_exits = exit_bars.get(ticker, {})
+        exit = np.array([ticker_exits.get(bar, (np.nan, np.nan)) for bar in buy_bars.tolist()], dtype=float).reshape(-1, 2)
+        columns["exit_return"].append(sign * (exit[:, 1] / entry_price - 1))
+        columns["exit_bars"].append(exit[:, 0] - buy_bars)
+
+        # h-th traded bar after the signal
+        next_traded = np.searchsorted(traded_bars, buy_bars, side='right')
+        for h in forward:
+            k = next_traded + h - 1
+            target = traded_bars[np.minimum(k, len(traded_bars) - 1)]
+            columns[f"return_{h}"].append(np.where(k < len(traded_bars), sign * (close[target] / entry_price - 1), np.nan))
+
+        columns["ticker"].append(np.full(len(buy_bars), ticker, dtype=object))
+        columns["bar"].append(buy_bars)
+        for name, column in [("rsi", "rsi_2"), ("hv", "hv_100"), ("adx", "adx_14")]:
+            columns[name].append(df[column].to_numpy(dtype=float)[buy_bars] if column in df.columns else np.full(len(buy_bars), np.nan))
+
+    if not columns["ticker"]:
+        return pd.DataFrame(columns=["ticker", "date", "year"] + [name for name in columns if name not in ("ticker", "bar")])
+    signals = pd.DataFrame({name: np.concatenate(values) for name, values in columns.items()})
+    signals.insert(1, "date", master_index[signals.pop("bar").to_numpy()])
+    signals.insert(2, "year", signals["date"].dt.year)
+    return signals.sort_values(["date", "ticker"]).reset_index(drop=True)
+
+def aggregate(signals, by):
+    """
+    Groups the signals by columns (or Series of bucket bounds) and returns, per group, the number of
+    signals, the win rate and average return to the natural exit, the average bars held and the average
+    return at every horizon (percentages).
+    """
+    forward = [column for column in signals.columns if column.startswith("return_")]
+    grouped = signals.groupby(by, sort=True)
+    table = pd.DataFrame({
+        "Signals": grouped.size(),
+        "Win Rate (%)": grouped["exit_return"].apply(lambda r: (r.dropna() > 0).mean() * 100 if r.notna().any() else np.nan),
+        "Avg Exit Return (%)": grouped["exit_return"].mean() * 100,
+        "Avg Bars": grouped["exit_bars"].mean(),
+        **{f"Avg {column.split('_')[1]}-Bar Return (%)": grouped[column].mean() * 100 for column in forward}
+    })
+    return table[table["Signals"] >= MIN_SIGNALS].round(2)
+
+def bucket(values, width):
+    """Returns the lower bound of the `width`-wide bucket of every value (e.g. 0.5 for an RSI of 0.7 with width 0.5)."""
+    return (np.floor(values / width) * width).round(6)
+
+def study_tables(signals):
+    """Returns the aggregated tables of a study: {"All", "RSI(2)", "HV(100)", "ADX(14)", "Year", "Ticker"}."""
+    if signals.empty:
+        return {}
+    rsi = signals["rsi"].where(signals["side"] == "NORMAL", 100 - signals["rsi"]) # INVERSE: distance to RSI 100
+    return {
+        "All": aggregate(signals, signals["side"]),
+        "RSI(2)": aggregate(signals, [signals["side"], bucket(rsi, RSI_BUCKET).rename("rsi_from")]),
+        "HV(100)": aggregate(signals, [signals["side"], bucket(signals["hv"], HV_BUCKET).rename("hv_from")]),
+        "ADX(14)": aggregate(signals, [signals["side"], bucket(signals["adx"], ADX_BUCKET).rename("adx_from")]),
+        "Year": aggregate(signals, ["side", "year"]),
+        "Ticker": aggregate(signals, ["side", "ticker"]).sort_values("Avg Exit Return (%)", ascending=False),
+    }
+
+def run_study(all_historical_data, master_index, sides):
+    """Returns the signals of every side in one DataFrame (with a 'side' column)."""
+    frames = [study_signals(all_historical_data, master_index, side).assign(side=side) for side in sides]
+    return pd.concat([frame for frame in frames if not frame.empty] or frames, ignore_index=True)
+
+def save_study_report(tables, sides, num_signals):
+    """Saves the aggregated tables to a markdown file and returns its path."""
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    filename_base = f"EDGE-{'-'.join(sides)}-{backtest.START_DATE}-{backtest.END_DATE}"
+    filename = os.path.join(OUTPUT_DIR, f"{filename_base}.md")
+    i = 1
+    while os.path.exists(filename):
+        filename = os.path.join(OUTPUT_DIR, f"{filename_base}-{i}.md")
+        i += 1
+
+    with open(filename, 'w') as f:
+        f.write(f"# Signal Edge Study: {', '.join(sides)}\n\n")
+        f.write(f"**Date Range:** {backtest.START_DATE} to {backtest.END_DATE}\n")
+        f.write(f"**Signals:** {num_signals}\n")
+        f.write(f"**Horizons (bars):** {', '.join(str(h) for h in horizons())}\n")
+        f.write(f"**Exit rules:** TIME_STOP={backtest.TIME_STOP}, CLOSE_ON_SMA200_CROSS={backtest.CLOSE_ON_SMA200_CROSS}\n")
+        f.write(f"**Groups with fewer than {MIN_SIGNALS} signals are not shown.**\n")
+        for name, table in tables.items():
+            f.write(f"\n---\n\n## By {name}\n\n" if name != "All" else "\n---\n\n## All Signals\n\n")
+            f.write(table.reset_index().to_markdown(index=False))
+            f.write("\n")
+
+    print(f"\nEdge study saved to {filename}")
+    return filename
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the forward returns of every buy signal, independently of the portfolio.")
+    parser.add_argument('--strategy', choices=['NORMAL', 'INVERSE', 'BOTH'], default='BOTH', help="Signals to study (default: both).")
+    parser.add_argument('--prepared', action='store_true', help="Use the data last prepared by backtest.py (see panel_store.py) instead of downloading it.")
+    args = parser.parse_args()
+    sides = ["NORMAL", "INVERSE"] if args.strategy == 'BOTH' else [args.strategy]
+
+    start_time = time.perf_counter()
+    if args.prepared:
+        panel = panel_store.open_panel()
+        if panel is None:
+            parser.error("no prepared data found. Run backtest.py with USE_PANEL_STORE = True first.")
+        print(f"Using the prepared data stored in {panel.path}")
+        all_historical_data, master_index = panel.to_frames(), panel.dates
+    else:
+        tickers_to_run, membership_intervals = backtest.load_universe()
+        all_historical_data, master_index, _, _, _ = backtest.prepare_data(tickers_to_run, membership_intervals)
+
+    study_start = time.perf_counter()
+    signals = run_study(all_historical_data, master_index, sides)
+    tables = study_tables(signals)
+    print(f"\n--- Edge study of {len(signals)} signals ({', '.join(sides)}) in {time.perf_counter() - study_start:.2f} seconds ---")
+    for name, table in tables.items():
+        print(f"\n--- By {name} ---" if name != "All" else "\n--- All Signals ---")
+        print(table.to_string())
+    if tables:
+        save_study_report(tables, sides, len(signals))
+    elapsed_seconds = time.perf_counter() - start_time
+    minutes, seconds = divmod(elapsed_seconds, 60)
+    print(f"\nTotal execution time: {int(minutes)} minutes {seconds:.1f} seconds")
+
+if __name__ == '__main__':
+    main()
@@ -1,17 +1,41 @@
 """
 This script generates CSV files containing ticker symbols for various market indices.
 In this case, it fetches the list of S&P 500 companies from Wikipedia and saves them to 'data/sp500.csv'.
+It also maintains the point-in-time membership of the index in 'data/membership/sp500.csv' from the
+table of historical changes (see membership.py).
 """
 
 import pandas as pd
-import requests
 import os
+import membership
+
+def parse_sp500_changes(table):
+    """
+    Converts the Wikipedia table of S&P 500 changes (columns Effective Date, Added/Ticker, Removed/Ticker...)
+    into a DataFrame with 'Date', 'Added' and 'Removed' tickers, as expected by membership.py.
+    """
+    # The header has two levels, e.g. ('Added', 'Ticker') and ('Removed', 'Ticker')
+    columns = [' '.join(str(level) for level in col) if isinstance(col, tuple) else str(col) for col in table.columns]
+    table = table.copy()
+    table.columns = columns
+    date_column = next(c for c in columns if c.startswith('Effective Date') or c.startswith('Date'))
+    added_column = next(c for c in columns if c.startswith('Added') and 'Ticker' in c)
+    removed_column = next(c for c in columns if c.startswith('Removed') and 'Ticker' in c)
+
+    changes = pd.DataFrame({
+        'Date': pd.to_datetime(table[date_column], errors='coerce', format='mixed'),
+        'Added': table[added_column].str.replace('.', '-', regex=False),
+        'Removed': table[removed_column].str.replace('.', '-', regex=False)
+    })
+    return changes.dropna(subset=['Date'])
 
 def generate_sp500_csv():
     """
     Fetches the list of S&P 500 companies from Wikipedia and saves it to a CSV file.
     """
     try:
+        import requests
+
         url = "https://en.wikipedia.org/wiki/List_of_S%26P_500_companies"
         print(f"Fetching S&P 500 constituents from Wikipedia: {url}")
 
@@ -53,6 +77,13 @@ def generate_sp500_csv():
         
         print(f"Successfully created '{output_path}' with {len(tickers_df)} tickers.")
 
+        # The second table of the page lists the historical changes of the index
+        if len(tables) > 1:
+            changes = parse_sp500_changes(tables[1])
+            membership.update_membership(membership.membership_path(output_path), tickers_df['Ticker'].tolist(), changes, pd.Timestamp.today())
+        else:
+            print("Warning: Could not find the table of S&P 500 changes. Membership history was not updated.")
+
     except Exception as e:
         print(f"An unexpected error occurred: {e}")
         print("Please ensure you have the required libraries: pip install pandas lxml requests")
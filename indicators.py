@@ -0,0 +1,328 @@
+"""
+This script provides vectorized implementations of the indicators used by the strategy:
+SMA, Wilder's RSI, ADX and historical volatility (HV).
+
+Every function accepts a 1-D array (one ticker) or a 2-D array of shape (dates, tickers) and
+computes all columns at once. The results reproduce the pandas_ta formulas (RMA is an
+exponentially weighted mean with alpha = 1 / length, like pandas_ta.rma), including the handling
+of leading NaNs. The recursive RMA kernel is JIT-compiled if numba is installed; otherwise it
+falls back to the pandas ewm kernel, which already runs in compiled code.
+
+Run `python indicators.py --validate` to compare the results against pandas_ta.
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+def _as_2d(values):
+    """Returns (values as a float 2-D array, whether the input was 1-D)."""
+    values = np.asarray(values, dtype=np.float64)
+    if values.ndim == 1:
+        return values[:, None], True
+    return values, False
+
+def _restore(result, was_1d):
+    return result[:, 0] if was_1d else result
+
+def _shift(values, periods=1):
+    """Shifts rows down by `periods`, filling the first rows with NaN."""
+    shifted = np.full_like(values, np.nan)
+    shifted[periods:] = values[:-periods]
+    return shifted
+
+def _rolling_sum(values, length, block_size=16):
+    """
+    Rolling sum over `length` rows. Windows that contain a NaN (or that are incomplete) are NaN,
+    like pandas rolling(length, min_periods=length).
+
+    Cumulative sums restart every `block_size` rows, so the rounding error does not grow with the
+    length of the history.
+    """
+    num_rows, num_cols = values.shape
+    block_size = max(block_size, length)
+    valid = ~np.isnan(values)
+    filled = np.where(valid, values, 0.0)
+
+    num_blocks = -(-num_rows // block_size)
+    padded = np.zeros((num_blocks * block_size, num_cols))
+    padded[:num_rows] = filled
+    block_cumsum = np.cumsum(padded.reshape(num_blocks, block_size, num_cols), axis=1)
+    block_totals = block_cumsum[:, -1, :]
+    block_cumsum = block_cumsum.reshape(-1, num_cols)[:num_rows]
+
+    # Sum of rows (start, end] = cumsum[end] - cumsum[start], crossing at most one block boundary
+    ends = np.arange(length - 1, num_rows)
+    starts = ends - length
+    window_sum = np.full((num_rows, num_cols), np.nan)
+    if len(ends):
+        same_block = (starts >= 0) & (starts // block_size == ends // block_size)
+        start_cumsum = np.where(starts[:, None] >= 0, block_cumsum[np.maximum(starts, 0)], 0.0)
+        crossing = (starts >= 0) & ~same_block
+        start_totals = block_totals[np.maximum(starts, 0) // block_size]
+        window_sum[ends] = np.where(same_block[:, None], block_cumsum[ends] - start_cumsum,
+                                    np.where(crossing[:, None], start_totals - start_cumsum + block_cumsum[ends], block_cumsum[ends]))
+
+    count = np.cumsum(valid, axis=0)
+    window_count = count.copy()
+    window_count[length:] -= count[:-length]
+    window_sum[window_count < length] = np.nan
+    return window_sum
+
+def _rma_pandas(values, length):
+    """RMA along the rows using the pandas ewm kernel, column by column."""
+    import pandas as pd
+    # copy=True: with copy-on-write the array of a pandas result is read-only
+    return pd.DataFrame(values).ewm(alpha=1.0 / length, min_periods=length).mean().to_numpy(copy=True)
+
+if njit is not None:
+    @njit(cache=True)
+    def _rma_jit(values, length):
+        decay = 1.0 - 1.0 / length
+        num_rows, num_cols = values.shape
+        result = np.full((num_rows, num_cols), np.nan)
+        for j in range(num_cols):
+            weighted_sum = 0.0
+            weight = 0.0
+            observations = 0
+            for i in range(num_rows):
+                value = values[i, j]
+                weighted_sum *= decay
+                weight *= decay
+                if not np.isnan(value):
+                    weighted_sum += value
+                    weight += 1.0
+                    observations += 1
+                if observations >= length and weight > 0:
+                    result[i, j] = weighted_sum / weight
+        return result
+
+def rma(values, length):
+    """Wilder's moving average (pandas_ta.rma): ewm(alpha=1/length, min_periods=length).mean()."""
+    values, was_1d = _as_2d(values)
+    if njit is not None:
+        result = _rma_jit(np.ascontiguousarray(values), length)
+    else:
+        result = _rma_pandas(values, length)
+    return _restore(result, was_1d)
+
+def sma(values, length):
+    """Simple moving average (pandas_ta.sma)."""
+    values, was_1d = _as_2d(values)
+    return _restore(_rolling_sum(values, length) / length, was_1d)
+
+def rsi(close, length=2):
+    """Wilder's Relative Strength Index (pandas_ta.rsi)."""
+    close, was_1d = _as_2d(close)
+    diff = close - _shift(close)
+    gains = np.where(diff > 0, diff, 0.0)
+    losses = np.where(diff < 0, -diff, 0.0)
+    gains[np.isnan(diff)] = np.nan
+    losses[np.isnan(diff)] = np.nan
+    average_gain = rma(gains, length)
+    average_loss = rma(losses, length)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        result = 100 * average_gain / (average_gain + average_loss)
+    return _restore(result, was_1d)
+
+def true_range(high, low, close):
+    """True range (pandas_ta.true_range), NaN on the first row."""
+    high, was_1d = _as_2d(high)
+    low, _ = _as_2d(low)
+    close, _ = _as_2d(close)
+    high_low = high - low
+    # pandas_ta adds epsilon to the whole series when any range is zero
+    zero_range = np.any(high_low == 0, axis=0)
+    high_low = high_low + np.where(zero_range, np.finfo(float).eps, 0.0)
+    previous_close = _shift(close)
+    result = np.fmax(np.fmax(np.abs(high_low), np.abs(high - previous_close)), np.abs(previous_close - low))
+    result[:1] = np.nan
+    return _restore(result, was_1d)
+
+def adx(high, low, close, length=14):
+    """Average Directional Index (the ADX column of pandas_ta.adx)."""
+    high, was_1d = _as_2d(high)
+    low, _ = _as_2d(low)
+    close, _ = _as_2d(close)
+    eps = np.finfo(float).eps
+
+    atr = rma(true_range(high, low, close), length)
+    up = high - _shift(high)
+    down = _shift(low) - low
+    with np.errstate(invalid='ignore'):
+        plus_dm = np.where((up > down) & (up > 0), up, 0.0)
+        minus_dm = np.where((down > up) & (down > 0), down, 0.0)
+    plus_dm[np.isnan(up)] = np.nan
+    minus_dm[np.isnan(down)] = np.nan
+    plus_dm[np.abs(plus_dm) < eps] = 0.0
+    minus_dm[np.abs(minus_dm) < eps] = 0.0
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        k = 100 / atr
+        plus_di = k * rma(plus_dm, length)
+        minus_di = k * rma(minus_dm, length)
+        dx = 100 * np.abs(plus_di - minus_di) / (plus_di + minus_di)
+    dx[~np.isfinite(dx)] = np.nan
+    return _restore(rma(dx, length), was_1d)
+
+def log_returns(close):
+    """Daily log returns, NaN on the first row."""
+    close, was_1d = _as_2d(close)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        result = np.log(close / _shift(close))
+    return _restore(result, was_1d)
+
+def historical_volatility(close, length=100, periods_per_year=252):
+    """Annualized rolling standard deviation of the log returns (ddof=1)."""
+    returns, was_1d = _as_2d(log_returns(close))
+    window_sum = _rolling_sum(returns, length)
+    window_sum_sq = _rolling_sum(returns * returns, length)
+    variance = (window_sum_sq - window_sum * window_sum / length) / (length - 1)
+    result = np.sqrt(np.maximum(variance, 0.0)) * np.sqrt(periods_per_year)
+    return _restore(result, was_1d)
+
+def compact(values, traded):
+    """
+    Moves the traded rows of every column to the top, in order, so each column holds the ticker's own
+    trading calendar. Returns an array of shape (max traded rows, tickers) padded with NaN at the bottom.
+    """
+    values, _ = _as_2d(values)
+    traded = np.asarray(traded, dtype=bool).reshape(values.shape)
+    position = np.cumsum(traded, axis=0) - 1
+    compacted = np.full((max(int(traded.sum(axis=0).max(initial=0)), 1), values.shape[1]), np.nan)
+    rows, cols = np.nonzero(traded)
+    compacted[position[rows, cols], cols] = values[rows, cols]
+    return compacted
+
+def expand(compacted, traded):
+    """
+    Inverse of compact: scatters the rows back onto the aligned dates. Dates on which the ticker did not
+    trade carry the value of its previous trading day (NaN before its first one).
+    """
+    traded = np.asarray(traded, dtype=bool)
+    position = np.cumsum(traded, axis=0) - 1
+    result = np.take_along_axis(compacted, np.maximum(position, 0), axis=0)
+    result[position < 0] = np.nan
+    return result
+
+def compute_indicators(close, high, low, traded=None, names=None):
+    """
+    Computes every indicator used by the strategy at once.
+
+    Args:
+        close, high, low: arrays of shape (dates,) or (dates, tickers).
+        traded: optional boolean array of the same shape, True on the dates each ticker actually traded.
+            The indicators are then computed on each ticker's own calendar (forward-filled dates are
+            skipped) and the values of the last trading day are carried over the other dates.
+        names: optional list of the indicators to compute (default: all of them). The values do not
+            depend on which other indicators are computed (see screening.py).
+
+    Returns:
+        dict: 'sma_200', 'sma_5', 'rsi_2', 'log_returns', 'hv_100' and 'adx_14' arrays (or only `names`) with the same shape.
+    """
+    if traded is not None:
+        close, was_1d = _as_2d(close)
+        high, _ = _as_2d(high)
+        low, _ = _as_2d(low)
+        traded = np.asarray(traded, dtype=bool).reshape(close.shape)
+        columns = compute_indicators(close, high, low, names=names)
+        # Only tickers with missing sessions after their first bar (holidays, delisting) need their own calendar;
+        # leading NaNs before the first bar are already skipped by the kernels
+        gaps = np.any((np.cumsum(traded, axis=0) > 0) & ~traded, axis=0)
+        if gaps.any():
+            traded_gaps = traded[:, gaps]
+            own_calendar = compute_indicators(compact(close[:, gaps], traded_gaps), compact(high[:, gaps], traded_gaps), compact(low[:, gaps], traded_gaps), names=names)
+            for name, values in own_calendar.items():
+                columns[name][:, gaps] = expand(values, traded_gaps)
+        return {name: _restore(values, was_1d) for name, values in columns.items()}
+
+    functions = {
+        "sma_200": lambda: sma(close, 200),
+        "sma_5": lambda: sma(close, 5),
+        "rsi_2": lambda: rsi(close, 2),
+        "log_returns": lambda: log_returns(close),
+        "hv_100": lambda: historical_volatility(close, 100),
+        "adx_14": lambda: adx(high, low, close, 14)
+    }
+    return {name: functions[name]() for name in (functions if names is None else names)}
+
+def validate_against_pandas_ta(num_tickers=50, num_years=5):
+    """
+    Compares compute_indicators with pandas_ta on a synthetic universe and prints the maximum
+    absolute difference of every indicator and the time taken by each implementation.
+
+    Returns:
+        dict: maximum absolute difference per indicator.
+    """
+    import pandas as pd
+    import pandas_ta as ta
+    from benchmark import generate_synthetic_universe
+
+    all_historical_data, _, _, _ = generate_synthetic_universe(num_tickers, num_years)
+
+    start_time = time.perf_counter()
+    expected = {}
+    for ticker, df in all_historical_data.items():
+        adx_df = ta.adx(df["High"], df["Low"], df["Close"], length=14)
+        log_ret = np.log(df["Close"] / df["Close"].shift(1))
+        expected[ticker] = pd.DataFrame({
+            "sma_200": ta.sma(df["Close"], length=200),
+            "sma_5": ta.sma(df["Close"], length=5),
+            "rsi_2": ta.rsi(df["Close"], length=2),
+            "log_returns": log_ret,
+            "hv_100": log_ret.rolling(window=100).std() * np.sqrt(252),
+            "adx_14": adx_df.iloc[:, 0]
+        })
+    reference_time = time.perf_counter() - start_time
+
+    # Every ticker is validated on its own calendar, so the kernels run on a ragged 2-D array
+    max_len = max(len(df) for df in all_historical_data.values())
+    def stack(column):
+        panel = np.full((max_len, len(all_historical_data)), np.nan)
+        for j, df in enumerate(all_historical_data.values()):
+            panel[:len(df), j] = df[column].to_numpy()
+        return panel
+
+    close, high, low = stack("Close"), stack("High"), stack("Low")
+    start_time = time.perf_counter()
+    result = compute_indicators(close, high, low)
+    kernel_time = time.perf_counter() - start_time
+
+    differences = {}
+    for name in result:
+        max_diff = 0.0
+        for j, (ticker, df) in enumerate(all_historical_data.items()):
+            ours = result[name][:len(df), j]
+            theirs = expected[ticker][name].to_numpy(dtype=float)
+            if not np.array_equal(np.isnan(ours), np.isnan(theirs)):
+                max_diff = float('inf')
+                continue
+            valid = ~np.isnan(ours)
+            if valid.any():
+                max_diff = max(max_diff, float(np.max(np.abs(ours[valid] - theirs[valid]))))
+        differences[name] = max_diff
+        print(f"{name:<12} max abs difference: {max_diff:.3e}")
+    print(f"pandas_ta: {reference_time:.3f}s | indicators.py: {kernel_time:.3f}s ({'numba' if njit is not None else 'pandas ewm'} RMA kernel)")
+    return differences
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Vectorized indicator kernels.")
+    parser.add_argument('--validate', action='store_true', help="Compare the kernels against pandas_ta on synthetic data.")
+    parser.add_argument('--tickers', type=int, default=50)
+    parser.add_argument('--years', type=int, default=5)
+    args = parser.parse_args()
+    if args.validate:
+        try:
+            import pandas_ta # noqa: F401 (optional, see requirements.txt)
+        except ImportError:
+            print("pip install pandas-ta to run --validate")
+            raise SystemExit(1)
+        validate_against_pandas_ta(args.tickers, args.years)
+    else:
+        parser.print_help()
@@ -5,8 +5,9 @@ for various market indices.
 
 import pandas as pd
 import os
+import membership
 
-def get_tickers_from_csv(file_path):
+def get_tickers_from_csv(file_path, as_of=None):
     """
     Reads tickers and a blacklist from a CSV file.
 
@@ -15,6 +16,9 @@ def get_tickers_from_csv(file_path):
 
     Args:
         file_path (str): The path to the CSV file.
+        as_of (str or datetime, optional): If given and the market has a membership file
+            (see membership.py), returns the tickers that were in the index on that date instead
+            of the current list.
 
     Returns:
         tuple: A tuple containing two lists: (tickers, blacklist).
@@ -42,7 +46,14 @@ def get_tickers_from_csv(file_path):
                     blacklist.append(line.split(',')[0])
                 else:
                     tickers.append(line.split(',')[0])
-        return tickers, blacklist
     except Exception as e:
         print(f"Error reading CSV file '{file_path}': {e}")
         return [], []
+
+    if as_of is not None:
+        intervals = membership.load_membership(membership.membership_path(file_path))
+        if intervals is not None:
+            tickers = membership.members_as_of(intervals, as_of)
+        else:
+            print(f"Warning: No membership file for '{file_path}'. Using its current tickers for {as_of}.")
+    return tickers, blacklist
@@ -0,0 +1,205 @@
+"""
+This script maintains point-in-time index membership, so backtests only trade the tickers that were
+actually in an index on each date (instead of today's constituents, which is survivorship-biased).
+
+Membership is stored per market in data/membership/<market>.csv (e.g. data/membership/sp500.csv for
+data/sp500.csv) as one row per membership interval:
+
+    Ticker,Start,End
+    AAPL,1982-11-30,
+    LEH,1994-05-02,2008-09-16
+
+Start is the first date the ticker was a member and End the first date it no longer was (empty if it
+is still a member). Tickers that were already members before the oldest recorded change start on
+1900-01-01. The files live in a subdirectory so the analyzer does not read them as markets.
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+MEMBERSHIP_DIR = "membership"
+COLUMNS = ['Ticker', 'Start', 'End']
+UNKNOWN_START = pd.Timestamp("1900-01-01") # Start of the memberships that predate the change history
+
+def membership_path(ticker_file):
+    """Returns the membership file of a market file (data/sp500.csv -> data/membership/sp500.csv)."""
+    return os.path.join(os.path.dirname(ticker_file), MEMBERSHIP_DIR, os.path.basename(ticker_file))
+
+def load_membership(path):
+    """Returns the membership intervals stored in `path` as a DataFrame, or None if the file does not exist."""
+    if not os.path.exists(path):
+        return None
+    intervals = pd.read_csv(path, dtype={'Ticker': str})
+    intervals['Start'] = pd.to_datetime(intervals['Start'])
+    intervals['End'] = pd.to_datetime(intervals['End'])
+    return intervals[COLUMNS]
+
+def save_membership(intervals, path):
+    """Writes membership intervals to `path`, sorted by ticker and start date."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    intervals = intervals.sort_values(['Ticker', 'Start']).copy()
+    intervals['Start'] = intervals['Start'].dt.strftime('%Y-%m-%d')
+    intervals['End'] = intervals['End'].dt.strftime('%Y-%m-%d')
+    intervals[COLUMNS].to_csv(path, index=False)
+
+def load_for_files(ticker_files):
+    """
+    Returns the membership intervals of all the market files (concatenated), or None if none of them has
+    a membership file. The tickers of markets without one get an open-ended interval, so a ticker listed
+    in several markets is not excluded just because it left the index that has a history.
+    """
+    from markets import get_tickers_from_csv
+
+    frames = []
+    unknown_tickers = []
+    for ticker_file in ticker_files:
+        intervals = load_membership(membership_path(ticker_file))
+        if intervals is not None:
+            frames.append(intervals)
+        else:
+            unknown_tickers.extend(get_tickers_from_csv(ticker_file)[0])
+    if not frames:
+        return None
+    if unknown_tickers:
+        frames.append(pd.DataFrame({'Ticker': sorted(set(unknown_tickers)), 'Start': UNKNOWN_START, 'End': pd.NaT}))
+    return pd.concat(frames, ignore_index=True)
+
+def members_as_of(intervals, date):
+    """Returns the sorted tickers that were members on `date`."""
+    date = pd.Timestamp(date)
+    active = (intervals['Start'] <= date) & (intervals['End'].isna() | (intervals['End'] > date))
+    return sorted(intervals.loc[active, 'Ticker'].unique())
+
+def members_between(intervals, start_date, end_date):
+    """Returns the sorted tickers that were members at any time between start_date and end_date."""
+    start_date, end_date = pd.Timestamp(start_date), pd.Timestamp(end_date)
+    active = (intervals['Start'] <= end_date) & (intervals['End'].isna() | (intervals['End'] > start_date))
+    return sorted(intervals.loc[active, 'Ticker'].unique())
+
+def membership_mask(intervals, dates, tickers):
+    """
+    Returns a boolean array of shape (dates, tickers) that is True where the ticker was a member.
+    Tickers without any interval (e.g. markets without a membership file) are always True.
+    """
+    mask = np.ones((len(dates), len(tickers)), dtype=bool)
+    if intervals is None or intervals.empty:
+        return mask
+    columns = {ticker: j for j, ticker in enumerate(tickers)}
+    covered = intervals[intervals['Ticker'].isin(columns)]
+    if covered.empty:
+        return mask
+
+    # +1 at the start of every interval and -1 at its end; the running sum is > 0 inside an interval
+    dates = pd.DatetimeIndex(dates)
+    cols = covered['Ticker'].map(columns).to_numpy()
+    starts = dates.searchsorted(covered['Start'].to_numpy())
+    ends = np.where(covered['End'].isna(), len(dates), dates.searchsorted(covered['End'].fillna(dates[-1]).to_numpy()))
+    delta = np.zeros((len(dates) + 1, len(tickers)), dtype=np.int32)
+    np.add.at(delta, (starts, cols), 1)
+    np.add.at(delta, (ends, cols), -1)
+    inside = np.cumsum(delta[:-1], axis=0) > 0
+
+    is_covered = np.zeros(len(tickers), dtype=bool)
+    is_covered[np.unique(cols)] = True
+    mask[:, is_covered] = inside[:, is_covered]
+    return mask
+
+def _clean_ticker(value):
+    """Returns the ticker as a stripped string, or None if the cell is empty."""
+    if not isinstance(value, str) or not value.strip():
+        return None
+    return value.strip()
+
+def _normalize_changes(changes):
+    """Returns the changes as a DataFrame with 'Date', 'Added' and 'Removed' columns (tickers may be None)."""
+    changes = pd.DataFrame({
+        'Date': pd.to_datetime(changes['Date']),
+        # object dtype keeps the missing tickers as None
+        'Added': pd.Series([_clean_ticker(value) for value in changes['Added']], index=changes.index, dtype=object),
+        'Removed': pd.Series([_clean_ticker(value) for value in changes['Removed']], index=changes.index, dtype=object)
+    })
+    return changes.dropna(subset=['Date']).sort_values('Date', kind='stable')
+
+def build_membership(current_tickers, changes, as_of):
+    """
+    Reconstructs the membership intervals by walking the change history backwards from the current
+    constituents.
+
+    Args:
+        current_tickers (list): Constituents on `as_of`.
+        changes (pd.DataFrame): One row per change with 'Date', 'Added' and 'Removed' tickers.
+        as_of: Date of the current constituents.
+
+    Returns:
+        pd.DataFrame: Intervals with 'Ticker', 'Start' and 'End'. The first interval of a ticker that was
+        already a member before the oldest change starts on UNKNOWN_START.
+    """
+    changes = _normalize_changes(changes)
+    changes = changes[changes['Date'] <= pd.Timestamp(as_of)]
+
+    # ends[ticker] is the End of the interval being reconstructed (NaT for current members)
+    ends = {ticker: pd.NaT for ticker in current_tickers}
+    rows = []
+    for change in changes.iloc[::-1].itertuples(index=False):
+        if change.Added is not None and change.Added in ends:
+            rows.append((change.Added, change.Date, ends.pop(change.Added)))
+        if change.Removed is not None and change.Removed not in ends:
+            ends[change.Removed] = change.Date
+    for ticker, end in ends.items():
+        rows.append((ticker, UNKNOWN_START, end))
+
+    intervals = pd.DataFrame(rows, columns=COLUMNS)
+    return intervals[intervals['End'].isna() | (intervals['End'] > intervals['Start'])].reset_index(drop=True)
+
+def update_membership(path, current_tickers, changes, as_of):
+    """
+    Creates or incrementally updates the membership file at `path`.
+
+    If the file exists, only the changes after its last recorded date are applied (new intervals are
+    opened for additions and closed for removals), and the result is reconciled with the current
+    constituents. Otherwise the whole history is reconstructed with build_membership.
+
+    Returns:
+        pd.DataFrame: The updated intervals.
+    """
+    as_of = pd.Timestamp(as_of).normalize()
+    intervals = load_membership(path)
+    if intervals is None:
+        intervals = build_membership(current_tickers, changes, as_of)
+        save_membership(intervals, path)
+        print(f"Created '{path}' with {len(intervals)} membership intervals.")
+        return intervals
+
+    last_update = intervals[['Start', 'End']].max().max()
+    changes = _normalize_changes(changes)
+    new_changes = changes[(changes['Date'] > last_update) & (changes['Date'] <= as_of)]
+
+    rows = intervals.values.tolist()
+    open_rows = {row[0]: i for i, row in enumerate(rows) if pd.isna(row[2])}
+    def close(ticker, date):
+        rows[open_rows.pop(ticker)][2] = date
+    def open_interval(ticker, date):
+        open_rows[ticker] = len(rows)
+        rows.append([ticker, date, pd.NaT])
+
+    for change in new_changes.itertuples(index=False):
+        if change.Removed is not None and change.Removed in open_rows:
+            close(change.Removed, change.Date)
+        if change.Added is not None and change.Added not in open_rows:
+            open_interval(change.Added, change.Date)
+
+    # Changes missing from the history: trust the current constituents
+    current = set(current_tickers)
+    for ticker in sorted(set(open_rows) - current):
+        close(ticker, as_of)
+    for ticker in sorted(current - set(open_rows)):
+        open_interval(ticker, as_of)
+
+    intervals = pd.DataFrame(rows, columns=COLUMNS)
+    intervals['Start'] = pd.to_datetime(intervals['Start'])
+    intervals['End'] = pd.to_datetime(intervals['End'])
+    save_membership(intervals, path)
+    print(f"Updated '{path}': {len(new_changes)} new changes, {len(intervals)} membership intervals.")
+    return intervals
@@ -0,0 +1,180 @@
+"""
+This script stores the output of prepare_data (aligned prices, indicators and signal masks) on disk as
+memory-mapped arrays, so other processes (sweep workers, batch runs, notebooks) can open it in
+milliseconds instead of rebuilding it.
+
+Each prepared panel is a directory in STORE_DIR named after its key:
+
+    manifest.json          tickers, columns (name and dtype), market frames and creation time
+    dates.npy              the master index (datetime64)
+    <column>.npy           one array of shape (tickers, dates) per column (close, rsi_2, is_buy_signal_normal...)
+    market_<name>.npy      the VIX, S&P 500 and Fed Funds Rate frames, aligned on the same dates
+
+The key is a hash of the downloaded data, of the membership intervals and of the source code of the
+alignment and signal functions, indicators.py, rules.py and membership.py, so a panel is rebuilt whenever
+any of them changes. latest-<module>.json points to the last panel written by each backtest script,
+so a process that does not download anything can still open it with open_panel().
+"""
+
+import hashlib
+import inspect
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+import pandas as pd
+
+import result_cache
+
+# ==============================================================================
+# --- CONFIGURATION ---
+# ==============================================================================
+STORE_DIR = ".cache/panels"
+MAX_STORED_PANELS = 5 # Oldest panels are removed when there are more than this
+MARKET_FRAMES = ['vix', 'sp500', 'fed_funds']
+# ==============================================================================
+
+class PreparedPanel:
+    """
+    A panel opened from the store. Columns are memory-mapped arrays of shape (tickers, dates), opened
+    copy-on-write: writes to them (or to the frames built over them) stay in this process and never reach the file.
+    """
+
+    def __init__(self, path):
+        with open(os.path.join(path, "manifest.json")) as f:
+            manifest = json.load(f)
+        self.path = path
+        self.key = manifest["key"]
+        self.tickers = manifest["tickers"]
+        self.ticker_positions = {ticker: j for j, ticker in enumerate(self.tickers)}
+        self.dates = pd.DatetimeIndex(np.load(os.path.join(path, "dates.npy")))
+        self.columns = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode='c') for name in manifest["columns"]}
+        self.market_columns = manifest["market"]
+
+    def column(self, name):
+        """Returns the (tickers, dates) array of a column without copying it."""
+        return self.columns[name]
+
+    def frame(self, ticker):
+        """Returns the prepared DataFrame of one ticker (as built by prepare_data), built over the memory-mapped rows without copying them."""
+        j = self.ticker_positions[ticker]
+        return pd.DataFrame({name: values[j] for name, values in self.columns.items()}, index=self.dates, copy=False)
+
+    def to_frames(self):
+        """Returns all the tickers as the all_historical_data dict used by the backtests."""
+        return {ticker: self.frame(ticker) for ticker in self.tickers}
+
+    def market_frames(self):
+        """Returns the (vix_data, sp500_data, fed_funds_data) frames, None for the ones that were not available."""
+        frames = []
+        for name in MARKET_FRAMES:
+            columns = self.market_columns.get(name)
+            if columns is None:
+                frames.append(None)
+            else:
+                values = np.load(os.path.join(self.path, f"market_{name}.npy"), mmap_mode='r')
+                frames.append(pd.DataFrame(values, index=self.dates, columns=columns))
+        return tuple(frames)
+
+def make_key(module, all_historical_data, market_frames, membership_intervals=None):
+    """
+    Returns the key of the panel prepared from the downloaded data: a hash of that data, of the membership
+    intervals, of the signal rules of the module and of the source of module.align_data, align_frame and
+    calculate_signals, indicators.py, rules.py and membership.py.
+    """
+    import indicators
+    import membership
+    import rules
+
+    digest = hashlib.sha256()
+    digest.update(result_cache.data_fingerprint(all_historical_data, *market_frames).encode())
+    if membership_intervals is not None:
+        digest.update(pd.util.hash_pandas_object(membership_intervals, index=False).to_numpy().tobytes())
+    for function_name in ['align_frame', 'align_data', 'calculate_signals']:
+        function = getattr(module, function_name, None)
+        if function is not None:
+            digest.update(inspect.getsource(function).encode())
+    digest.update(inspect.getsource(indicators).encode())
+    digest.update(inspect.getsource(rules).encode())
+    digest.update(inspect.getsource(membership).encode())
+    digest.update(json.dumps(getattr(module, "SIGNAL_RULES", None), sort_keys=True).encode())
+    return digest.hexdigest()
+
+def _latest_path(name):
+    return os.path.join(STORE_DIR, f"latest-{name}.json")
+
+def save(key, all_historical_data, master_index, market_frames, name="backtest"):
+    """Writes a prepared panel to the store (atomically) and marks it as the latest one of `name`."""
+    path = os.path.join(STORE_DIR, key)
+    temp_path = f"{path}.tmp-{os.getpid()}"
+    os.makedirs(temp_path, exist_ok=True)
+    tickers = list(all_historical_data.keys())
+
+    columns = {}
+    for df in all_historical_data.values():
+        for column in df.columns:
+            if column not in columns:
+                columns[column] = np.dtype(bool) if df[column].dtype == bool else np.dtype(float)
+    for column, dtype in columns.items():
+        panel = np.zeros((len(tickers), len(master_index)), dtype=dtype) if dtype == bool else np.full((len(tickers), len(master_index)), np.nan)
+        for j, ticker in enumerate(tickers):
+            df = all_historical_data[ticker]
+            if column in df.columns:
+                panel[j] = df[column].to_numpy(dtype=dtype)
+        np.save(os.path.join(temp_path, f"{column}.npy"), panel)
+    np.save(os.path.join(temp_path, "dates.npy"), np.asarray(master_index.values))
+
+    market = {}
+    for frame_name, frame in zip(MARKET_FRAMES, market_frames):
+        if frame is not None:
+            frame = frame.select_dtypes(include='number')
+            market[frame_name] = [str(c) for c in frame.columns]
+            np.save(os.path.join(temp_path, f"market_{frame_name}.npy"), frame.to_numpy(dtype=float))
+
+    manifest = {"key": key, "tickers": tickers, "columns": {c: str(d) for c, d in columns.items()},
+                "market": market, "created": time.time()}
+    with open(os.path.join(temp_path, "manifest.json"), 'w') as f:
+        json.dump(manifest, f)
+
+    if os.path.exists(path):
+        shutil.rmtree(path, ignore_errors=True)
+    os.replace(temp_path, path)
+    with open(_latest_path(name), 'w') as f:
+        json.dump({"key": key}, f)
+    evict()
+    return path
+
+def open_panel(key=None, name="backtest"):
+    """
+    Opens the panel stored under `key` (or the latest one written by `name` if key is None).
+    Returns a PreparedPanel, or None if it does not exist.
+    """
+    if key is None:
+        if not os.path.exists(_latest_path(name)):
+            return None
+        with open(_latest_path(name)) as f:
+            key = json.load(f)["key"]
+    path = os.path.join(STORE_DIR, key)
+    if not os.path.exists(os.path.join(path, "manifest.json")):
+        return None
+    try:
+        return PreparedPanel(path)
+    except Exception as e:
+        print(f"Warning: Could not open the prepared panel {key[:12]}. It will be rebuilt. Error: {e}")
+        return None
+
+def evict(max_panels=None):
+    """Removes the oldest panels until there are at most MAX_STORED_PANELS."""
+    max_panels = MAX_STORED_PANELS if max_panels is None else max_panels
+    if not os.path.isdir(STORE_DIR):
+        return
+    panels = []
+    for key in os.listdir(STORE_DIR):
+        path = os.path.join(STORE_DIR, key)
+        if os.path.isdir(path) and '.tmp-' not in key:
+            panels.append((os.path.getmtime(path), path))
+    panels.sort()
+    while len(panels) > max_panels:
+        shutil.rmtree(panels.pop(0)[1], ignore_errors=True)
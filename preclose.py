@@ -0,0 +1,341 @@
+"""
+This script runs the analyzer shortly before the close, on provisional daily bars built from intraday data.
+
+analyzer.py evaluates the last completed daily bar, while the backtest fills at the close of the signal
+day. To act on the signals on the same day, this script:
+
+1. Downloads the completed daily bars of every ticker, the S&P 500 and the VIX once per session (cached).
+2. Downloads the minute bars of the current session in batches. They are stored in INTRADAY_CACHE_DIR as
+   one compact file per session (float32 OHLCV and int32 minutes), and later polls only download the
+   minutes after the last stored one.
+3. Splices the minutes into a provisional bar for today (first open, highest high, lowest low, last price,
+   total volume) at the end of each daily series.
+4. Re-evaluates the system state and the exit / entry conditions of analyzer.analyze_ticker for the held
+   positions first and then for the rest of the universe, within TIME_BUDGET seconds (including the
+   downloads of the rest of the universe).
+
+The signals are provisional (the close can still move), so positions.txt is not modified.
+
+Usage:
+    python preclose.py
+    python preclose.py --repeat 60    # poll every 60 seconds
+"""
+
+import argparse
+import os
+import pickle
+import shutil
+import time
+
+import numpy as np
+import pandas as pd
+
+import analyzer
+from analyzer import Colors
+from indicators import sma
+from markets import get_tickers_from_csv
+
+# ==============================================================================
+# --- CONFIGURATION ---
+# ==============================================================================
+TIME_BUDGET = 30 # Seconds for a whole poll (download + evaluation); tickers not evaluated in time are listed
+DOWNLOAD_BATCH_SIZE = 100 # Tickers per intraday download request
+DAILY_HISTORY = "2y" # Daily history used to compute the indicators (as in analyzer.py)
+INTRADAY_CACHE_DIR = ".cache/intraday"
+MAX_STORED_SESSIONS = 5 # Oldest sessions are removed from the cache
+MARKET_TICKERS = ['^GSPC', '^VIX']
+# ==============================================================================
+
+BAR_FIELDS = ['open', 'high', 'low', 'close', 'volume']
+
+def _session_dir(session):
+    return os.path.join(INTRADAY_CACHE_DIR, str(session))
+
+def _ticker_frame(data, ticker):
+    """Returns the bars of one ticker from a (possibly multi-ticker) yf.download result, with lower-case columns."""
+    if isinstance(data.columns, pd.MultiIndex) and ticker in data.columns.get_level_values(0):
+        data = data[ticker]
+    return _normalize(data.copy())
+
+def _normalize(df):
+    if isinstance(df.columns, pd.MultiIndex):
+        df.columns = df.columns.get_level_values(0)
+    df.columns = [str(c).lower() for c in df.columns]
+    return df
+
+def download_daily_bars(tickers, deadline=None):
+    """
+    Downloads DAILY_HISTORY of daily bars for the tickers in batches, without starting a batch after `deadline`.
+    Returns ({ticker: DataFrame}, tickers not requested before the deadline).
+    """
+    import yfinance as yf
+    daily = {}
+    for i in range(0, len(tickers), DOWNLOAD_BATCH_SIZE):
+        if deadline is not None and time.time() > deadline:
+            return daily, tickers[i:]
+        batch = tickers[i:i + DOWNLOAD_BATCH_SIZE]
+        try:
+            data = yf.download(batch, period=DAILY_HISTORY, interval="1d", progress=False, group_by='ticker')
+            for ticker in batch:
+                try:
+                    df = _ticker_frame(data, ticker).dropna(subset=['close'])
+                    if not df.empty:
+                        daily[ticker] = df
+                except KeyError:
+                    pass # Ticker might not be in the downloaded batch
+        except Exception as e:
+            print(f"Could not download daily data for batch starting with {batch[0]}: {e}")
+    return daily, []
+
+def download_minute_bars(tickers, session, start=None, deadline=None):
+    """
+    Downloads the minute bars of `session` for the tickers in batches (from `start` on if given), without starting
+    a batch after `deadline`. Before the open or on a holiday of a ticker's exchange, period="1d" returns the
+    previous session: the minutes of any other date are dropped.
+
+    Returns:
+        tuple: ({ticker: (minutes since epoch as int32, OHLCV as float32 array of shape (n, 5))},
+                tickers not requested before the deadline).
+    """
+    import yfinance as yf
+    minutes = {}
+    for i in range(0, len(tickers), DOWNLOAD_BATCH_SIZE):
+        if deadline is not None and time.time() > deadline:
+            return minutes, tickers[i:]
+        batch = tickers[i:i + DOWNLOAD_BATCH_SIZE]
+        try:
+            period = {"start": start} if start is not None else {"period": "1d"}
+            data = yf.download(batch, interval="1m", progress=False, group_by='ticker', threads=True, **period)
+            for ticker in batch:
+                try:
+                    df = _ticker_frame(data, ticker).dropna(subset=['close'])
+                except KeyError:
+                    continue
+                # Date of every minute in the exchange's time zone
+                local_dates = (df.index.tz_localize(None) if df.index.tz is not None else df.index).normalize()
+                df = df[local_dates == pd.Timestamp(session)]
+                if df.empty:
+                    continue
+                index = df.index.tz_convert('UTC') if df.index.tz is not None else df.index
+                minute = (index.values.astype('datetime64[m]').astype(np.int64)).astype(np.int32)
+                bars = df.reindex(columns=BAR_FIELDS).to_numpy(dtype=np.float32)
+                minutes[ticker] = (minute, bars)
+        except Exception as e:
+            print(f"Could not download minute data for batch starting with {batch[0]}: {e}")
+    return minutes, []
+
+def load_daily(tickers, session, deadline=None):
+    """
+    Returns the completed daily bars (before `session`) of the tickers, downloading them once per session.
+    Tickers that could not be downloaded are stored as None, so they are not requested again. Tickers not
+    requested before `deadline` are left out (and requested by the next poll).
+    """
+    path = os.path.join(_session_dir(session), "daily.pkl")
+    daily = {}
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            daily = pickle.load(f)
+    missing = [ticker for ticker in tickers if ticker not in daily]
+    if missing:
+        print(f"--> Downloading daily bars for {len(missing)} tickers...")
+        downloaded, late = download_daily_bars(missing, deadline)
+        late = set(late)
+        for ticker in missing:
+            if ticker in late:
+                continue
+            df = downloaded.get(ticker)
+            if df is not None:
+                df.index = pd.DatetimeIndex(df.index).tz_localize(None).normalize()
+                df = df[df.index < pd.Timestamp(session)] # Today's partial bar is replaced by the provisional one
+            daily[ticker] = df
+        os.makedirs(_session_dir(session), exist_ok=True)
+        with open(path + ".tmp", 'wb') as f:
+            pickle.dump(daily, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + ".tmp", path)
+        evict()
+    return daily
+
+def load_minutes(session):
+    """Returns the stored minute bars of a session as {ticker: (minutes, bars)}."""
+    path = os.path.join(_session_dir(session), "minutes.npz")
+    if not os.path.exists(path):
+        return {}
+    with np.load(path) as store:
+        tickers, offsets, minute, bars = store["tickers"], store["offsets"], store["minute"], store["bars"]
+    return {str(ticker): (minute[offsets[j]:offsets[j + 1]], bars[offsets[j]:offsets[j + 1]]) for j, ticker in enumerate(tickers)}
+
+def save_minutes(session, minutes):
+    """Stores the minute bars of a session in a single compressed file (all tickers concatenated)."""
+    tickers = sorted(minutes)
+    os.makedirs(_session_dir(session), exist_ok=True)
+    offsets = np.concatenate([[0], np.cumsum([len(minutes[ticker][0]) for ticker in tickers])]).astype(np.int64)
+    path = os.path.join(_session_dir(session), "minutes.npz")
+    with open(path + ".tmp", 'wb') as f:
+        np.savez_compressed(f, tickers=np.array(tickers, dtype=str), offsets=offsets,
+                            minute=np.concatenate([minutes[t][0] for t in tickers]) if tickers else np.zeros(0, dtype=np.int32),
+                            bars=np.concatenate([minutes[t][1] for t in tickers]) if tickers else np.zeros((0, len(BAR_FIELDS)), dtype=np.float32))
+    os.replace(path + ".tmp", path)
+
+def update_minutes(tickers, session, deadline=None):
+    """
+    Downloads the minutes after the last stored one (until `deadline`), merges them into the session store and
+    returns (store, tickers not updated before the deadline).
+    """
+    minutes = load_minutes(session)
+    stored = [ticker for ticker in tickers if ticker in minutes and len(minutes[ticker][0])]
+    new = [ticker for ticker in tickers if ticker not in stored]
+    downloads, late = {}, []
+    if stored:
+        # Minutes after the oldest "last minute" of the stored tickers (the latest stored minute is downloaded again, as it may have been partial)
+        last_minute = min(int(minutes[ticker][0][-1]) for ticker in stored)
+        downloads, late = download_minute_bars(stored, session, start=pd.Timestamp(last_minute * 60, unit='s', tz='UTC'), deadline=deadline)
+    if new:
+        new_downloads, new_late = download_minute_bars(new, session, deadline=deadline)
+        downloads.update(new_downloads)
+        late += new_late
+    for ticker, (minute, bars) in downloads.items():
+        if ticker in minutes:
+            old_minute, old_bars = minutes[ticker]
+            keep = old_minute < minute[0] if len(minute) else np.ones(len(old_minute), dtype=bool)
+            minute, bars = np.concatenate([old_minute[keep], minute]), np.concatenate([old_bars[keep], bars])
+        minutes[ticker] = (minute, bars)
+    save_minutes(session, minutes)
+    return minutes, late
+
+def provisional_bar(bars):
+    """Aggregates the minute bars (n, 5) of the session into one daily bar (dict of open, high, low, close, volume)."""
+    return {"open": float(bars[0, 0]), "high": float(np.nanmax(bars[:, 1])), "low": float(np.nanmin(bars[:, 2])),
+            "close": float(bars[-1, 3]), "volume": float(np.nansum(bars[:, 4]))}
+
+def splice(daily_df, bar, session):
+    """Returns the daily bars with the provisional bar of `session` appended as the last row."""
+    row = pd.DataFrame([{column: bar.get(column, np.nan) for column in daily_df.columns}], index=pd.DatetimeIndex([pd.Timestamp(session)]))
+    return pd.concat([daily_df[daily_df.index < pd.Timestamp(session)], row])
+
+def spliced_frames(tickers, session, deadline=None):
+    """
+    Returns ({ticker: daily bars with today's provisional bar} for the tickers with minute data of the session,
+    tickers whose data was not downloaded before `deadline`).
+    """
+    daily = load_daily(tickers, session, deadline)
+    late = [ticker for ticker in tickers if ticker not in daily]
+    minutes, late_minutes = update_minutes([ticker for ticker in tickers if daily.get(ticker) is not None], session, deadline)
+    late += late_minutes
+    frames = {}
+    for ticker in tickers:
+        if daily.get(ticker) is not None and ticker not in late_minutes and ticker in minutes and len(minutes[ticker][0]):
+            frames[ticker] = splice(daily[ticker], provisional_bar(minutes[ticker][1]), session)
+    return frames, late
+
+def evict(max_sessions=None):
+    """Removes the oldest sessions until there are at most MAX_STORED_SESSIONS."""
+    max_sessions = MAX_STORED_SESSIONS if max_sessions is None else max_sessions
+    if not os.path.isdir(INTRADAY_CACHE_DIR):
+        return
+    sessions = sorted(name for name in os.listdir(INTRADAY_CACHE_DIR) if os.path.isdir(os.path.join(INTRADAY_CACHE_DIR, name)))
+    for name in sessions[:max(len(sessions) - max_sessions, 0)]:
+        shutil.rmtree(os.path.join(INTRADAY_CACHE_DIR, name), ignore_errors=True)
+
+def market_state(frames):
+    """Returns the latest (S&P 500 row with sma_200, VIX row) from the spliced market frames, as get_market_sentiment_data does."""
+    sp500 = frames.get('^GSPC')
+    vix = frames.get('^VIX')
+    if sp500 is None or len(sp500) < 200:
+        return None, None
+    sp500 = sp500.copy()
+    sp500['sma_200'] = sma(sp500['close'], 200)
+    return sp500.iloc[-1], vix.iloc[-1] if vix is not None else None
+
+def scan(tickers, held_positions, session, deadline):
+    """
+    Evaluates the held positions (exits) and then, until `deadline`, the other tickers (entries) on their
+    spliced bars. The market tickers and held positions are always downloaded; the data of the other tickers
+    is only downloaded if the system is on, until `deadline`.
+    Returns (exit signals, buy signals, tickers not evaluated in time, system shut off).
+    """
+    frames, _ = spliced_frames(MARKET_TICKERS + held_positions, session)
+    sp500_latest, vix_latest = market_state(frames)
+    system_shut_off = analyzer.check_system_state(sp500_latest, vix_latest)
+    others = [] if system_shut_off else [t for t in tickers if t not in held_positions]
+    late = []
+    if others:
+        other_frames, late = spliced_frames(others, session, deadline)
+        frames.update(other_frames)
+    late = set(late)
+
+    exit_signals, buy_signals, skipped = [], [], []
+    candidates = held_positions + others
+    for k, ticker in enumerate(candidates):
+        if k >= len(held_positions) and time.time() > deadline: # Held positions are always checked
+            skipped += candidates[k:]
+            break
+        if ticker in late:
+            skipped.append(ticker)
+            continue
+        if ticker not in frames:
+            continue
+        analysis = analyzer.analyze_ticker(ticker, analyzer.STRATEGY_TYPE, df=frames[ticker].copy())
+        if analysis is None:
+            continue
+        if ticker in held_positions:
+            if analysis["is_exit_signal"]:
+                exit_signals.append(analysis)
+        elif analysis["is_buy_signal"]:
+            buy_signals.append(analysis)
+    return exit_signals, buy_signals, skipped, system_shut_off
+
+def poll(tickers, blacklisted_tickers, time_budget=TIME_BUDGET):
+    """Runs one pre-close scan and prints the provisional signals."""
+    start = time.time()
+    session = pd.Timestamp.now(tz='UTC').date()
+    held_positions = analyzer.load_positions()
+    print(f"\n--- Pre-close scan ({pd.Timestamp.now().strftime('%Y-%m-%d %H:%M:%S')}, provisional bars of {session}) ---")
+    exit_signals, buy_signals, skipped, system_shut_off = scan(tickers, held_positions, session, start + time_budget)
+
+    print("\n--- Provisional EXIT signals in held positions ---")
+    for analysis in exit_signals:
+        print(f"{Colors.RED}!!! EXIT SIGNAL for {analysis['ticker']} at price {analysis['price']:.2f} (Strategy: {analysis.get('strategy', 'N/A')}) !!!{Colors.RESET}")
+    if not exit_signals:
+        print("No exit signals." if held_positions else "No positions currently held.")
+
+    if system_shut_off:
+        print("\n--- Scanning for new BUY signals HALTED due to system being OFF. ---")
+    else:
+        print(f"\n--- Provisional BUY signals (Sorted by {analyzer.PRIORITIZATION_METHOD}) ---")
+        analyzer.sort_buy_signals(buy_signals)
+        for signal in buy_signals:
+            color = Colors.YELLOW if signal['ticker'] in blacklisted_tickers else Colors.GREEN
+            label = "BLACKLISTED BUY" if signal['ticker'] in blacklisted_tickers else "BUY"
+            print(f"{color}{label} ({signal['strategy']}): {signal['ticker']} @ ${signal['price']:.2f} (RSI: {signal['rsi']:.2f}, HV: {signal.get('hv', 0):.2f}, ADX: {signal.get('adx', 0):.2f}){Colors.RESET}")
+        if not buy_signals:
+            print("No buy signals.")
+    if skipped:
+        print(f"{Colors.YELLOW}Warning: {len(skipped)} tickers were not evaluated within the {time_budget}s budget: {', '.join(skipped[:20])}{' ...' if len(skipped) > 20 else ''}{Colors.RESET}")
+    print(f"\nScan completed in {time.time() - start:.1f} seconds.")
+
+def run(time_budget=TIME_BUDGET, repeat=None):
+    """Loads the tickers of every market file and polls them, every `repeat` seconds if given."""
+    market_files = [os.path.join("data", f) for f in os.listdir("data") if f.endswith(".csv")]
+    all_tickers, all_blacklisted_tickers = [], []
+    for f in market_files:
+        tickers, blacklist = get_tickers_from_csv(f)
+        all_tickers.extend(tickers)
+        all_blacklisted_tickers.extend(blacklist)
+    unique_tickers = sorted(set(all_tickers))
+    print(f"--> Pre-close scan of {len(unique_tickers)} unique tickers.")
+
+    while True:
+        poll(unique_tickers, set(all_blacklisted_tickers), time_budget)
+        if not repeat:
+            break
+        time.sleep(repeat)
+
+def main():
+    parser = argparse.ArgumentParser(description="Scan for provisional signals before the close using intraday bars.")
+    parser.add_argument('--budget', type=float, default=TIME_BUDGET, help=f"Time budget of a poll in seconds (default: {TIME_BUDGET}).")
+    parser.add_argument('--repeat', type=float, metavar='SECONDS', help="Poll again every SECONDS until interrupted.")
+    args = parser.parse_args()
+    run(args.budget, args.repeat)
+
+if __name__ == "__main__":
+    main()
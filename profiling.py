@@ -0,0 +1,137 @@
+"""
+This script provides lightweight instrumentation for the backtest.
+
+Code is split into named phases with `phase(name)`. When profiling is enabled, each phase records
+its wall time, call count and peak memory (tracemalloc), optionally broken down per simulated day.
+When profiling is disabled, `phase` is a no-op, so the instrumentation can stay in the hot paths.
+"""
+
+import cProfile
+import json
+import time
+import tracemalloc
+from contextlib import contextmanager
+from functools import wraps
+
+_enabled = False
+_track_memory = False
+_per_day = False
+_phases = {}
+_days = []
+_current_day = None
+_stack = []
+
+def start(track_memory=True, per_day=False):
+    """Resets all records and enables profiling."""
+    global _enabled, _track_memory, _per_day, _current_day
+    reset()
+    _enabled = True
+    _track_memory = track_memory
+    _per_day = per_day
+    _current_day = None
+    if _track_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+def stop():
+    """Disables profiling. Records are kept until the next start() or reset()."""
+    global _enabled
+    _enabled = False
+    if _track_memory and tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+def reset():
+    """Clears all phase and day records."""
+    global _current_day
+    _phases.clear()
+    _days.clear()
+    _stack.clear()
+    _current_day = None
+
+def is_enabled():
+    return _enabled
+
+@contextmanager
+def phase(name):
+    """Records wall time, call count and peak memory of the enclosed block under `name`."""
+    if not _enabled:
+        yield
+        return
+
+    if _track_memory:
+        if _stack:
+            # Keep the peak reached so far by the enclosing phase before resetting it
+            _stack[-1]["peak"] = max(_stack[-1]["peak"], tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+    entry = {"peak": 0}
+    _stack.append(entry)
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start_time
+        _stack.pop()
+        peak = 0
+        if _track_memory:
+            peak = max(entry["peak"], tracemalloc.get_traced_memory()[1])
+            if _stack:
+                _stack[-1]["peak"] = max(_stack[-1]["peak"], peak)
+
+        record = _phases.setdefault(name, {"calls": 0, "wall_time": 0.0, "peak_memory": 0})
+        record["calls"] += 1
+        record["wall_time"] += elapsed
+        record["peak_memory"] = max(record["peak_memory"], peak)
+
+        if _per_day and _current_day is not None:
+            _current_day["phases"][name] = _current_day["phases"].get(name, 0.0) + elapsed
+
+def profiled(name):
+    """Decorator that records every call of the decorated function as phase `name`."""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with phase(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def start_day(date):
+    """Starts the per-day record for a simulated day (only when per-day profiling is enabled)."""
+    global _current_day
+    if not (_enabled and _per_day):
+        return
+    _current_day = {"date": str(date.date()) if hasattr(date, 'date') else str(date), "phases": {}}
+    _days.append(_current_day)
+
+def get_summary():
+    """Returns the recorded phases (and days, if any) as a JSON-serializable dict."""
+    summary = {"phases": {name: dict(record) for name, record in _phases.items()}}
+    if _days:
+        summary["days"] = list(_days)
+    return summary
+
+def print_summary():
+    """Prints the recorded phases sorted by wall time."""
+    if not _phases:
+        return
+    print("\n--- Profiling Summary ---")
+    print(f"{'Phase':<28} {'Calls':>10} {'Wall time (s)':>14} {'Peak memory (MB)':>17}")
+    for name, record in sorted(_phases.items(), key=lambda item: -item[1]["wall_time"]):
+        print(f"{name:<28} {record['calls']:>10} {record['wall_time']:>14.3f} {record['peak_memory'] / 1e6:>17.1f}")
+
+def write_summary(path):
+    """Writes the recorded phases (and days, if any) to a JSON file."""
+    with open(path, 'w') as f:
+        json.dump(get_summary(), f, indent=2)
+    print(f"Profiling summary saved to {path}")
+
+def start_cprofile():
+    """Starts a cProfile profiler and returns it (dump it later with stop_cprofile)."""
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+def stop_cprofile(profiler, path):
+    """Stops a profiler returned by start_cprofile and dumps its stats to `path`."""
+    profiler.disable()
+    profiler.dump_stats(path)
+    print(f"cProfile stats saved to {path} (inspect with: python -m pstats {path})")
@@ -0,0 +1,93 @@
+"""
+This script precomputes the market regime (system on / shut off) used by the backtests.
+
+The regime only depends on the VIX, the S&P 500 and the thresholds, not on the portfolio, so it is
+computed once per (VIX_PROTECTION, SP500_ENTRY_THRESHOLD) pair as per-date arrays instead of being
+re-evaluated inside the daily loop of every simulation:
+
+- Shut off: VIX > VIX_PROTECTION (if enabled) OR S&P 500 < 200-day SMA
+- Shut on: (VIX protection disabled OR VIX < VIX_PROTECTION * 0.8) AND S&P 500 > 200-day SMA * SP500_ENTRY_THRESHOLD
+
+backtest.py uses "shut off" to stop opening positions, backtest-switching.py to switch from NORMAL to
+INVERSE, and batch_simulation.py shares the arrays between the configurations with the same thresholds.
+"""
+
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+# Events (the reason of a state change on a date)
+NO_EVENT = 0
+SHUT_OFF_VIX = 1
+SHUT_OFF_SP500 = 2
+SHUT_ON = 3
+
+_cache = {}
+
+def compute_regime(dates, vix_data, sp500_data, vix_protection, sp500_entry_threshold, start_date=None, initially_shut_off=False):
+    """
+    Steps the shut off / shut on hysteresis over `dates` (starting on start_date; the state is
+    `initially_shut_off` before it).
+
+    Returns:
+        dict: Arrays aligned with `dates`:
+            "shut_off" (bool): state at the end of the date.
+            "event" (int8): SHUT_OFF_VIX, SHUT_OFF_SP500 or SHUT_ON on the dates the state changed, NO_EVENT otherwise.
+            "sp500_strong", "sp500_bearish" (bool): S&P 500 above its SMA(200) * threshold / below its SMA(200).
+            "vix_known" (bool): VIX protection is enabled and the date is in the VIX data.
+            "vix", "sp500_close", "sp500_sma" (float): the values used (NaN if not available).
+    """
+    dates = pd.DatetimeIndex(dates)
+    num_dates = len(dates)
+    vix = vix_data['vix_close'].reindex(dates).to_numpy(dtype=float) if vix_data is not None else np.full(num_dates, np.nan)
+    sp500_close = sp500_data['close'].reindex(dates).to_numpy(dtype=float) if sp500_data is not None else np.full(num_dates, np.nan)
+    sp500_sma = sp500_data['sma_200'].reindex(dates).to_numpy(dtype=float) if sp500_data is not None else np.full(num_dates, np.nan)
+
+    # Dates missing from the VIX data do not block the reactivation (as if VIX protection were disabled)
+    vix_known = np.zeros(num_dates, dtype=bool)
+    if vix_protection > 0 and vix_data is not None:
+        vix_known = dates.isin(vix_data.index)
+    has_sp500 = ~np.isnan(sp500_close) & ~np.isnan(sp500_sma)
+    with np.errstate(invalid='ignore'):
+        sp500_bearish = has_sp500 & (sp500_close < sp500_sma)
+        sp500_strong = has_sp500 & (sp500_close > (sp500_sma * sp500_entry_threshold))
+        vix_shut_off = vix_known & (vix > vix_protection)
+        vix_ok = ~vix_known | (vix < vix_protection * 0.8)
+    shut_on = vix_ok & sp500_strong
+
+    shut_off = np.zeros(num_dates, dtype=bool)
+    event = np.zeros(num_dates, dtype=np.int8)
+    first = 0 if start_date is None else int(dates.searchsorted(pd.Timestamp(start_date)))
+    shut_off[:first] = initially_shut_off
+    state = bool(initially_shut_off)
+    for i in range(first, num_dates):
+        if not state:
+            if vix_shut_off[i]:
+                state, event[i] = True, SHUT_OFF_VIX
+            elif sp500_bearish[i]:
+                state, event[i] = True, SHUT_OFF_SP500
+        elif shut_on[i]:
+            state, event[i] = False, SHUT_ON
+        shut_off[i] = state
+
+    return {"shut_off": shut_off, "event": event, "sp500_strong": sp500_strong, "sp500_bearish": sp500_bearish,
+            "vix_known": vix_known, "vix": vix, "sp500_close": sp500_close, "sp500_sma": sp500_sma}
+
+def _market_fingerprint(dates, vix_data, sp500_data):
+    digest = hashlib.sha256(np.asarray(dates, dtype='datetime64[ns]').view('i8').tobytes())
+    for frame, columns in ((vix_data, ['vix_close']), (sp500_data, ['close', 'sma_200'])):
+        if frame is None:
+            digest.update(b"none")
+        else:
+            digest.update(np.asarray(frame.index, dtype='datetime64[ns]').view('i8').tobytes())
+            digest.update(np.ascontiguousarray(frame[columns].to_numpy(dtype=float)).tobytes())
+    return digest.hexdigest()
+
+def get_regime(dates, vix_data, sp500_data, vix_protection, sp500_entry_threshold, start_date=None, initially_shut_off=False):
+    """Returns compute_regime(...), reusing the arrays already computed for the same market data and thresholds."""
+    key = (_market_fingerprint(dates, vix_data, sp500_data), float(vix_protection), float(sp500_entry_threshold),
+           None if start_date is None else str(pd.Timestamp(start_date)), bool(initially_shut_off))
+    if key not in _cache:
+        _cache[key] = compute_regime(dates, vix_data, sp500_data, vix_protection, sp500_entry_threshold, start_date, initially_shut_off)
+    return _cache[key]
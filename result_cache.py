@@ -0,0 +1,180 @@
+"""
+This script provides a content-addressed cache for backtest results.
+
+A run is identified by a hash of:
+- the effective configuration (every upper-case constant of the backtest module),
+- the contents of the ticker files (tickers and blacklist), of their membership files and the source code of the
+  backtest and of every project module it uses (indicators.py, rules.py, regime.py, correlation.py...),
+- a fingerprint of the input data,
+- the run parameters (prioritization method, strategy...).
+
+Completed results (summary, trades, equity curve, open positions and the simulation log) are stored
+under that key in CACHE_DIR. Entries are evicted in least-recently-used order when the cache exceeds
+MAX_CACHE_SIZE_MB or MAX_CACHE_ENTRIES.
+"""
+
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import sys
+import time
+import types
+
+import numpy as np
+
+import membership
+
+# ==============================================================================
+# --- CONFIGURATION ---
+# ==============================================================================
+CACHE_DIR = ".cache/results"
+MAX_CACHE_SIZE_MB = 500
+MAX_CACHE_ENTRIES = 500
+# Constants that do not change the result of a single simulation
+IGNORED_CONSTANTS = ['PRIORITIZATION_METHOD', 'ALL_METHODS', 'STRATEGY_TYPE', 'USE_RESULT_CACHE', 'CHECKPOINT',
+                     'USE_PANEL_STORE', 'PROFILE', 'PROFILE_PER_DAY', 'PROFILE_CPROFILE']
+# ==============================================================================
+
+def _hash_file(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+def code_fingerprint(module):
+    """
+    Returns {file name: hash} of the source of `module` and of every project module (a .py file in the same
+    directory) it uses, directly or through other project modules, e.g. indicators.py, regime.py and
+    correlation.py for backtest.py.
+    """
+    project_dir = os.path.dirname(os.path.abspath(getattr(module, "__file__", "") or "."))
+
+    def project_file(candidate):
+        path = getattr(candidate, "__file__", None)
+        return path if path and os.path.dirname(os.path.abspath(path)) == project_dir else None
+
+    hashes = {}
+    pending = [module]
+    while pending:
+        current = pending.pop()
+        path = project_file(current)
+        if path is None or os.path.basename(path) in hashes:
+            continue
+        hashes[os.path.basename(path)] = _hash_file(path)
+        for value in vars(current).values():
+            if not isinstance(value, types.ModuleType):
+                # Names imported with 'from module import name'
+                value = sys.modules.get(getattr(value, "__module__", None) or "")
+            if value is not None and project_file(value):
+                pending.append(value)
+    return hashes
+
+def config_fingerprint(module):
+    """
+    Returns a JSON-serializable description of the effective configuration of a backtest module:
+    its upper-case constants, the hash of every ticker file and the hash of its source code and of the
+    project modules it uses (see code_fingerprint).
+    """
+    constants = {}
+    for name in sorted(dir(module)):
+        if not name.isupper() or name in IGNORED_CONSTANTS:
+            continue
+        value = getattr(module, name)
+        if isinstance(value, (bool, int, float, str, list, tuple, dict, type(None))):
+            constants[name] = value
+    return {
+        "constants": constants,
+        "ticker_files": {path: _hash_file(path) for path in getattr(module, "TICKER_FILES", [])},
+        "membership_files": {path: _hash_file(membership.membership_path(path)) for path in getattr(module, "TICKER_FILES", [])},
+        "code": code_fingerprint(module),
+    }
+
+def data_fingerprint(all_historical_data, *market_frames):
+    """Returns a hash of the prices of every ticker and of the market frames (VIX, S&P 500, Fed rate)."""
+    digest = hashlib.sha256()
+    for ticker in sorted(all_historical_data):
+        df = all_historical_data[ticker]
+        digest.update(ticker.encode())
+        digest.update(np.asarray(df.index, dtype='datetime64[ns]').view('i8').tobytes())
+        columns = [c for c in df.columns if str(c).lower() in ('open', 'high', 'low', 'close', 'traded')]
+        digest.update(np.ascontiguousarray(df[columns].to_numpy(dtype=float)).tobytes())
+    for frame in market_frames:
+        if frame is None:
+            digest.update(b"none")
+            continue
+        digest.update(np.asarray(frame.index, dtype='datetime64[ns]').view('i8').tobytes())
+        digest.update(np.ascontiguousarray(frame.select_dtypes(include='number').to_numpy(dtype=float)).tobytes())
+    return digest.hexdigest()
+
+def make_key(config, data_hash, **run_parameters):
+    """Returns the cache key of a run."""
+    payload = json.dumps({"config": config, "data": data_hash, "run": run_parameters}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+def _entry_dir(key):
+    return os.path.join(CACHE_DIR, key)
+
+def load(key):
+    """
+    Returns the cached entry for `key` as a dict with 'results', 'summary', 'log' and 'metadata',
+    or None if the key is not cached. Loading an entry marks it as recently used.
+    """
+    entry_dir = _entry_dir(key)
+    results_path = os.path.join(entry_dir, "results.pkl")
+    if not os.path.exists(results_path):
+        return None
+    try:
+        with open(results_path, 'rb') as f:
+            entry = pickle.load(f)
+    except Exception as e:
+        print(f"Warning: Could not read cached results {key[:12]}. They will be recomputed. Error: {e}")
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        return None
+    now = time.time()
+    os.utime(entry_dir, (now, now))
+    return entry
+
+def store(key, results, summary=None, log="", metadata=None):
+    """Stores the results of a run under `key` and evicts old entries if the cache is too large."""
+    entry_dir = _entry_dir(key)
+    os.makedirs(entry_dir, exist_ok=True)
+    entry = {"results": results, "summary": summary, "log": log, "metadata": metadata or {}}
+    temp_path = os.path.join(entry_dir, "results.pkl.tmp")
+    with open(temp_path, 'wb') as f:
+        pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temp_path, os.path.join(entry_dir, "results.pkl"))
+    with open(os.path.join(entry_dir, "summary.json"), 'w') as f:
+        json.dump({"summary": summary, "metadata": metadata or {}}, f, indent=2, default=str)
+    evict()
+
+def update_metadata(key, **values):
+    """Adds values (e.g. the path of the written report) to the metadata of a cached entry."""
+    entry = load(key)
+    if entry is None:
+        return
+    entry["metadata"].update(values)
+    store(key, entry["results"], entry["summary"], entry["log"], entry["metadata"])
+
+def evict(max_size_mb=None, max_entries=None):
+    """Removes least-recently-used entries until the cache fits in the size and entry limits."""
+    max_size = (MAX_CACHE_SIZE_MB if max_size_mb is None else max_size_mb) * 1024 * 1024
+    max_entries = MAX_CACHE_ENTRIES if max_entries is None else max_entries
+    if not os.path.isdir(CACHE_DIR):
+        return
+
+    entries = []
+    for key in os.listdir(CACHE_DIR):
+        entry_dir = _entry_dir(key)
+        if not os.path.isdir(entry_dir):
+            continue
+        size = sum(os.path.getsize(os.path.join(entry_dir, f)) for f in os.listdir(entry_dir))
+        entries.append((os.path.getmtime(entry_dir), size, entry_dir))
+    entries.sort()
+
+    total_size = sum(size for _, size, _ in entries)
+    while entries and (total_size > max_size or len(entries) > max_entries):
+        _, size, entry_dir = entries.pop(0)
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        total_size -= size
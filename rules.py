@@ -0,0 +1,153 @@
+"""
+This module declares the entry and exit rules of the strategy once, for analyzer.py, backtest.py and
+backtest-switching.py.
+
+A rule set maps a signal column to a boolean expression over the indicator columns (see
+indicators.compute_indicators), written in Python syntax:
+
+    "is_buy_signal_normal": "close > sma_200 and rsi_2 < 5 and close < sma_5 and not adx_14 >= 50"
+
+Allowed: column names, numbers, comparisons (also chained, e.g. "5 < rsi_2 < 30"), arithmetic (+ - * /)
+and and / or / not. Comparisons with a missing value (NaN) are False, so "not adx_14 >= 50" is True when
+the ADX is not available.
+
+A rule set is compiled once into a single Python function over arrays: every distinct subexpression of
+every rule ("close > sma_5" is both the NORMAL exit and part of the INVERSE entry, "a < b" and "b > a" are
+the same) is computed once, and and / or / not become the element-wise & / | / ~. The function evaluates
+the whole (dates, tickers) panel of the backtests at once, or the last bar of one ticker in the analyzer.
+
+The point-in-time membership and traded-day masks are not part of the rules; the backtests apply them
+to the compiled signals.
+"""
+
+import ast
+
+import numpy as np
+
+# Rules of analyzer.py and backtest.py (and of the scripts that read their signal columns)
+RULES = {
+    "is_buy_signal_normal": "close > sma_200 and rsi_2 < 5 and close < sma_5 and not adx_14 >= 50",
+    "is_exit_signal_normal": "close > sma_5",
+    "is_buy_signal_inverse": "close < sma_200 and rsi_2 > 95 and close > sma_5 and not adx_14 >= 50",
+    "is_exit_signal_inverse": "close < sma_5",
+}
+
+# backtest-switching.py shorts earlier and exits shorts on an RSI(2) recovery as well
+SWITCHING_RULES = dict(RULES,
+    is_buy_signal_normal="close > sma_200 and rsi_2 < 5 and close < sma_5",
+    is_buy_signal_inverse="close < sma_200 and rsi_2 > 85",
+    is_exit_signal_inverse="rsi_2 < 30 or close < sma_5",
+)
+
+_OPERATORS = {ast.Add: "+", ast.Sub: "-", ast.Mult: "*", ast.Div: "/",
+              ast.Gt: ">", ast.GtE: ">=", ast.Lt: "<", ast.LtE: "<=", ast.Eq: "==", ast.NotEq: "!="}
+_FLIPPED = {ast.Lt: ">", ast.LtE: ">="} # "a < b" is computed as "b > a"
+
+_cache = {}
+
+class _Compiler:
+    """Translates the rules into the statements of one function, sharing the identical subexpressions."""
+
+    def __init__(self):
+        self.statements = []
+        self.temporaries = {} # Canonical expression -> temporary holding it
+        self.names = set()
+
+    def _temporary(self, expression):
+        if expression not in self.temporaries:
+            self.temporaries[expression] = f"_t{len(self.temporaries)}"
+            self.statements.append(f"    {self.temporaries[expression]} = {expression}")
+        return self.temporaries[expression]
+
+    def visit(self, node):
+        """Returns the name (column, constant or temporary) holding the value of `node`."""
+        if isinstance(node, ast.Name):
+            if node.id.startswith("_"):
+                raise ValueError(f"Invalid column name '{node.id}'")
+            self.names.add(node.id)
+            return node.id
+        if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)) and not isinstance(node.value, bool):
+            return repr(float(node.value))
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
+            return self._temporary(f"~{self.visit(node.operand)}")
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub):
+            return self._temporary(f"-{self.visit(node.operand)}")
+        if isinstance(node, ast.BinOp) and type(node.op) in _OPERATORS:
+            return self._temporary(f"{self.visit(node.left)} {_OPERATORS[type(node.op)]} {self.visit(node.right)}")
+        if isinstance(node, ast.BoolOp):
+            # & and | do not short-circuit, so the operands can be sorted to share "a and b" with "b and a"
+            operands = sorted(set(self.visit(value) for value in node.values))
+            return self._temporary(f" {'&' if isinstance(node.op, ast.And) else '|'} ".join(operands))
+        if isinstance(node, ast.Compare) and all(type(op) in _OPERATORS for op in node.ops):
+            operands = [node.left] + list(node.comparators)
+            parts = []
+            for left, op, right in zip(operands, node.ops, operands[1:]):
+                left, right = self.visit(left), self.visit(right)
+                if type(op) in _FLIPPED:
+                    parts.append(self._temporary(f"{right} {_FLIPPED[type(op)]} {left}"))
+                else:
+                    parts.append(self._temporary(f"{left} {_OPERATORS[type(op)]} {right}"))
+            return parts[0] if len(parts) == 1 else self._temporary(" & ".join(sorted(set(parts))))
+        raise ValueError(f"Unsupported expression in rule: {ast.unparse(node)}")
+
+def compile_rules(rules):
+    """
+    Compiles a rule set (dict of signal column -> expression) into a function that takes a mapping of
+    column name -> array (or Series) and returns {signal column: bool array}. Compiled rule sets are cached.
+
+    The generated source is available as the `source` attribute of the function.
+    """
+    cache_key = tuple(sorted(rules.items()))
+    if cache_key in _cache:
+        return _cache[cache_key]
+
+    compiler = _Compiler()
+    results = {}
+    for name, expression in rules.items():
+        try:
+            tree = ast.parse(expression, mode="eval")
+        except SyntaxError as e:
+            raise ValueError(f"Invalid rule {name}: {expression!r} ({e.msg})") from None
+        result = compiler.visit(tree.body)
+        if not result.startswith("_t"): # A bare column: copy it as a boolean array
+            result = compiler._temporary(f"_asarray({result}, dtype=bool)")
+        results[name] = result
+
+    loads = [f"    {name} = _asarray(values[{name!r}], dtype=float)" for name in sorted(compiler.names)]
+    source = "\n".join(
+        ["def evaluate(values):"] + loads + compiler.statements +
+        ["    return {" + ", ".join(f"{name!r}: {result}" for name, result in results.items()) + "}"])
+    namespace = {"_asarray": np.asarray}
+    exec(compile(source, "<rules>", "exec"), namespace)
+    evaluate = namespace["evaluate"]
+    evaluate.source = source
+    _cache[cache_key] = evaluate
+    return evaluate
+
+def conjuncts(expression):
+    """Splits a rule into its top-level 'and' operands (a list with the rule itself if it is not an 'and')."""
+    try:
+        tree = ast.parse(expression, mode="eval").body
+    except SyntaxError as e:
+        raise ValueError(f"Invalid rule: {expression!r} ({e.msg})") from None
+    if isinstance(tree, ast.BoolOp) and isinstance(tree.op, ast.And):
+        return [ast.unparse(value) for value in tree.values]
+    return [expression]
+
+def columns_of(expression):
+    """Returns the set of column names used by a rule."""
+    return {node.id for node in ast.walk(ast.parse(expression, mode="eval")) if isinstance(node, ast.Name)}
+
+def evaluate_rules(rules, values):
+    """
+    Evaluates a rule set on the given columns (mapping of name -> array of the same shape).
+
+    Returns:
+        dict: {signal column: bool array}.
+    """
+    evaluate = compile_rules(rules)
+    try:
+        with np.errstate(invalid="ignore"):
+            return evaluate(values)
+    except KeyError as e:
+        raise ValueError(f"The rules use the column {e.args[0]!r}, which is not available. Columns: {sorted(values)}") from None
@@ -0,0 +1,224 @@
+"""
+This script scores the strategy on every ticker of the universe independently and maintains the
+Blacklist sections of the ticker files (data/*.csv) from those scores.
+
+Each ticker is traded alone, as if it had a dedicated slot: a position is opened on every buy signal
+while the system is on (same VIX / S&P 500 rules as backtest.py) and no position is open, and closed on
+its natural exit (exit signal, TIME_STOP or SMA(200) cross, see backtest.compute_exit_bars). Returns are
+per trade and unleveraged. The scorecard of a ticker is:
+
+- Trades, Win Rate (%) and Expectancy (%): average return per trade,
+- Worst Trade Drawdown (%): the largest adverse move from the entry price while a trade was open,
+- Signals per Year: how often the ticker gives a buy signal.
+
+The tickers are scored in parallel by a process pool. A ticker is blacklisted when it has at least
+MIN_TRADES trades and fails any of the thresholds; tickers with fewer trades keep their current status.
+
+Usage:
+    python scorecard.py            # print the scorecards and the proposed blacklist changes
+    python scorecard.py --write    # also rewrite the Blacklist sections of TICKER_FILES
+"""
+
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import backtest
+import regime
+from markets import get_tickers_from_csv
+
+# ==============================================================================
+# --- CONFIGURATION ---
+# ==============================================================================
+WORKERS = os.cpu_count() or 1
+CHUNK_SIZE = 25 # Tickers per task sent to a worker
+# Blacklist thresholds
+MIN_TRADES = 10 # Tickers with fewer trades are not judged (they keep their current status)
+MIN_WIN_RATE = 55.0 # %
+MIN_EXPECTANCY = 0.0 # % per trade
+MAX_TRADE_DRAWDOWN = 25.0 # %, worst adverse move of a single trade
+MIN_SIGNALS_PER_YEAR = 0.0 # 0 disables this threshold
+OUTPUT_DIR = "docs/comparatives/scorecards"
+# ==============================================================================
+
+# Constants of backtest.py that change the exits; sent to the workers so they score with the same configuration
+EXIT_CONSTANTS = ['TIME_STOP', 'CLOSE_ON_SMA200_CROSS']
+
+def _init_worker(constants):
+    for name, value in constants.items():
+        setattr(backtest, name, value)
+
+def score_ticker(ticker, df, master_index, entry_allowed, side, first_bar, num_years):
+    """Returns the scorecard (dict) of one ticker traded alone. `entry_allowed` marks the bars the system is on."""
+    sign = -1.0 if side == "INVERSE" else 1.0
+    signal_bars = np.flatnonzero(df[f"is_buy_signal_{side.lower()}"].to_numpy(dtype=bool))
+    signal_bars = signal_bars[signal_bars >= first_bar]
+    close = df["close"].to_numpy(dtype=float)
+    exit_bars = backtest.compute_exit_bars({ticker: df}, master_index, side).get(ticker, {})
+
+    # One position at a time: a signal is taken if the previous trade has exited (exits run before entries)
+    entries, exits = [], []
+    free_from = first_bar
+    for bar in signal_bars[entry_allowed[signal_bars]].tolist():
+        if bar < free_from or np.isnan(close[bar]):
+            continue
+        scheduled = exit_bars.get(bar)
+        if scheduled is None:
+            break # Still open at the end of the data
+        entries.append(bar)
+        exits.append(scheduled[0])
+        free_from = scheduled[0]
+
+    scorecard = {"Ticker": ticker, "Trades": len(entries), "Win Rate (%)": np.nan, "Expectancy (%)": np.nan,
+                 "Worst Trade Drawdown (%)": np.nan, "Signals per Year": round(len(signal_bars) / num_years, 2) if num_years > 0 else np.nan}
+    if not entries:
+        return scorecard
+    entries, exits = np.array(entries), np.array(exits)
+    returns = sign * (close[exits] / close[entries] - 1)
+
+    # Worst price while each trade was open (bars entry+1 .. exit): one reduceat over the consecutive segments
+    segments = np.column_stack([entries + 1, exits + 1]).ravel()
+    padded = np.append(close, np.nan)
+    worst_price = (np.fmin.reduceat(padded, segments) if side == "NORMAL" else np.fmax.reduceat(padded, segments))[::2]
+    adverse = np.minimum(sign * (worst_price / close[entries] - 1), 0)
+
+    scorecard.update({"Win Rate (%)": round((returns > 0).mean() * 100, 2), "Expectancy (%)": round(returns.mean() * 100, 2),
+                      "Worst Trade Drawdown (%)": round(-np.nanmin(adverse) * 100, 2)})
+    return scorecard
+
+def _score_chunk(frames, master_index, entry_allowed, side, first_bar, num_years):
+    return [score_ticker(ticker, df, master_index, entry_allowed, side, first_bar, num_years) for ticker, df in frames.items()]
+
+def score_universe(all_historical_data, master_index, vix_data, sp500_data, side, workers=WORKERS):
+    """Scores every ticker in parallel and returns a DataFrame with one scorecard per row."""
+    market_regime = regime.get_regime(master_index, vix_data, sp500_data, backtest.VIX_PROTECTION, backtest.SP500_ENTRY_THRESHOLD, start_date=backtest.START_DATE)
+    entry_allowed = ~market_regime["shut_off"] & market_regime["sp500_strong"]
+    first_bar = int(master_index.searchsorted(pd.Timestamp(backtest.START_DATE)))
+    num_years = (master_index[-1] - master_index[first_bar]).days / 365.25 if first_bar < len(master_index) else 0
+
+    columns = ["close", "traded", "sma_200", f"is_buy_signal_{side.lower()}", f"is_exit_signal_{side.lower()}"]
+    tickers = list(all_historical_data.keys())
+    chunks = [{ticker: all_historical_data[ticker][[c for c in columns if c in all_historical_data[ticker].columns]] for ticker in tickers[i:i + CHUNK_SIZE]}
+              for i in range(0, len(tickers), CHUNK_SIZE)]
+    if workers <= 1 or len(chunks) <= 1:
+        scorecards = [card for chunk in chunks for card in _score_chunk(chunk, master_index, entry_allowed, side, first_bar, num_years)]
+    else:
+        constants = {name: getattr(backtest, name) for name in EXIT_CONSTANTS}
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(constants,)) as executor:
+            futures = [executor.submit(_score_chunk, chunk, master_index, entry_allowed, side, first_bar, num_years) for chunk in chunks]
+            scorecards = [card for future in futures for card in future.result()]
+    return pd.DataFrame(scorecards).sort_values("Expectancy (%)", ascending=False, na_position='last').reset_index(drop=True)
+
+def failed_thresholds(scorecard):
+    """Returns the thresholds a scorecard fails (empty if it passes or has fewer than MIN_TRADES trades)."""
+    if scorecard["Trades"] < MIN_TRADES:
+        return []
+    failed = []
+    if scorecard["Win Rate (%)"] < MIN_WIN_RATE:
+        failed.append("win rate")
+    if scorecard["Expectancy (%)"] < MIN_EXPECTANCY:
+        failed.append("expectancy")
+    if scorecard["Worst Trade Drawdown (%)"] > MAX_TRADE_DRAWDOWN:
+        failed.append("drawdown")
+    if MIN_SIGNALS_PER_YEAR > 0 and scorecard["Signals per Year"] < MIN_SIGNALS_PER_YEAR:
+        failed.append("signal frequency")
+    return failed
+
+def propose_blacklist(scorecards, current_blacklist):
+    """Returns the new blacklist: the tickers that fail a threshold plus the current ones that could not be judged."""
+    blacklist = set()
+    for _, scorecard in scorecards.iterrows():
+        if failed_thresholds(scorecard):
+            blacklist.add(scorecard["Ticker"])
+        elif scorecard["Trades"] < MIN_TRADES and scorecard["Ticker"] in current_blacklist:
+            blacklist.add(scorecard["Ticker"])
+    scored = set(scorecards["Ticker"])
+    blacklist |= {ticker for ticker in current_blacklist if ticker not in scored}
+    return blacklist
+
+def write_blacklist(file_path, blacklist):
+    """
+    Rewrites the Blacklist section of a ticker file, keeping the ticker list above it unchanged.
+    Tickers that stay blacklisted keep their order and the new ones are appended.
+    """
+    with open(file_path, 'r') as f:
+        lines = f.read().splitlines()
+    end = next((i for i, line in enumerate(lines) if line.strip().lower().startswith('blacklist')), len(lines))
+    ticker_lines = lines[:end]
+    while ticker_lines and not ticker_lines[-1].strip():
+        ticker_lines.pop()
+    current = [line.strip().split(',')[0] for line in lines[end + 1:] if line.strip()]
+    ordered = [ticker for ticker in current if ticker in blacklist] + sorted(set(blacklist) - set(current))
+    content = "\n".join(ticker_lines)
+    if ordered:
+        content += "\n\nBlacklist:\n" + "\n".join(ordered)
+    with open(file_path, 'w') as f:
+        f.write(content + "\n")
+
+def save_scorecard_report(scorecards, side, changes):
+    """Saves the scorecards and the blacklist changes to a markdown file and returns its path."""
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    filename_base = f"SCORECARD-{side}-{backtest.START_DATE}-{backtest.END_DATE}"
+    filename = os.path.join(OUTPUT_DIR, f"{filename_base}.md")
+    i = 1
+    while os.path.exists(filename):
+        filename = os.path.join(OUTPUT_DIR, f"{filename_base}-{i}.md")
+        i += 1
+
+    with open(filename, 'w') as f:
+        f.write(f"# Ticker Scorecards: {side}\n\n")
+        f.write(f"**Date Range:** {backtest.START_DATE} to {backtest.END_DATE}\n")
+        f.write(f"**Thresholds:** {MIN_TRADES} trades minimum, win rate >= {MIN_WIN_RATE}%, expectancy >= {MIN_EXPECTANCY}%, "
+                f"worst trade drawdown <= {MAX_TRADE_DRAWDOWN}%" + (f", signals per year >= {MIN_SIGNALS_PER_YEAR}" if MIN_SIGNALS_PER_YEAR > 0 else "") + "\n")
+        f.write("\n---\n\n## Blacklist Changes\n\n")
+        for file_path, (added, removed) in changes.items():
+            f.write(f"- **{file_path}:** added {', '.join(sorted(added)) or 'none'}; removed {', '.join(sorted(removed)) or 'none'}\n")
+        f.write("\n---\n\n## Scorecards\n\n")
+        f.write(scorecards.to_markdown(index=False))
+
+    print(f"\nScorecard report saved to {filename}")
+    return filename
+
+def main():
+    parser = argparse.ArgumentParser(description="Score the strategy on every ticker and maintain the Blacklist sections of the ticker files.")
+    parser.add_argument('--strategy', choices=['NORMAL', 'INVERSE'], default='NORMAL', help="Signals to score (default: NORMAL).")
+    parser.add_argument('--workers', type=int, default=WORKERS, help=f"Worker processes (default: {WORKERS}).")
+    parser.add_argument('--write', action='store_true', help="Rewrite the Blacklist sections of TICKER_FILES with the result.")
+    args = parser.parse_args()
+
+    start_time = time.perf_counter()
+    # Blacklisted tickers are scored too, so they can leave the blacklist
+    ticker_lists = {file_path: get_tickers_from_csv(file_path) for file_path in backtest.TICKER_FILES}
+    all_tickers = sorted({ticker for tickers, blacklist in ticker_lists.values() for ticker in tickers + blacklist})
+    all_historical_data, master_index, vix_data, sp500_data, _ = backtest.prepare_data(all_tickers)
+
+    score_start = time.perf_counter()
+    scorecards = score_universe(all_historical_data, master_index, vix_data, sp500_data, args.strategy, args.workers)
+    print(f"\n--- Scorecards of {len(scorecards)} tickers ({args.strategy}) in {time.perf_counter() - score_start:.1f} seconds ---")
+    print(scorecards.to_string(index=False))
+
+    changes = {}
+    print("\n--- Blacklist Changes ---")
+    for file_path, (tickers, current_blacklist) in ticker_lists.items():
+        file_scorecards = scorecards[scorecards["Ticker"].isin(set(tickers) | set(current_blacklist))]
+        new_blacklist = propose_blacklist(file_scorecards, set(current_blacklist))
+        added, removed = new_blacklist - set(current_blacklist), set(current_blacklist) - new_blacklist
+        changes[file_path] = (added, removed)
+        print(f"{file_path}: {len(new_blacklist)} blacklisted | added: {', '.join(sorted(added)) or 'none'} | removed: {', '.join(sorted(removed)) or 'none'}")
+        if args.write and (added or removed):
+            write_blacklist(file_path, new_blacklist)
+            print(f"  Blacklist section of {file_path} rewritten.")
+    if not args.write:
+        print("Run with --write to apply these changes to the ticker files.")
+    save_scorecard_report(scorecards, args.strategy, changes)
+
+    elapsed_seconds = time.perf_counter() - start_time
+    minutes, seconds = divmod(elapsed_seconds, 60)
+    print(f"\nTotal execution time: {int(minutes)} minutes {seconds:.1f} seconds")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+"""
+This module screens a universe with the buy rules (see rules.py) in ordered stages, so the expensive
+indicators are only computed for the tickers that pass the cheap checks. analyzer.py uses it for the daily
+scan (the latest bar of every ticker) and asof.py for the replay over a date range.
+
+STAGES lists the columns each stage computes, from the cheapest to the most expensive. Every top-level 'and'
+operand of a buy rule is checked at the first stage where all its columns are available. With the default
+rules:
+
+    trend     close, sma_200     close > sma_200 (NORMAL), close < sma_200 (INVERSE)
+    setup     sma_5, rsi_2       rsi_2 < 5 and close < sma_5, rsi_2 > 95 and close > sma_5
+    strength  adx_14             not adx_14 >= 50
+
+A stage only computes its columns for the tickers that still have a cell (a date) that passed every earlier
+stage, on any side. A rule is the 'and' of its operands, so the buy signals are the same as evaluating the
+whole rules on every ticker. Operands on columns that are not in a stage (e.g. hv_100 in a custom rule) are
+checked in a last stage. The tickers with a buy signal, plus the ones the caller asks for (e.g. held
+positions), then get REPORT_COLUMNS (used to sort and print the signals) and their exit signals.
+
+The caller provides the columns with a function compute(names, columns) -> {name: array of shape
+(rows, len(columns))}, where `columns` is an index array of ticker columns. It can slice prepared arrays or
+compute the indicators on demand (indicators.compute_indicators with `names`).
+"""
+
+import numpy as np
+
+import rules
+
+# ==============================================================================
+# --- CONFIGURATION ---
+# ==============================================================================
+STAGES = [ # (name, columns computed at this stage), cheapest first
+    ("trend", ["close", "sma_200"]),
+    ("setup", ["sma_5", "rsi_2"]),
+    ("strength", ["adx_14"]),
+]
+REPORT_COLUMNS = ["close", "sma_200", "sma_5", "rsi_2", "hv_100", "adx_14"] # Computed for the tickers with a signal only
+# ==============================================================================
+
+def plan_stages(rule_set, sides, required=()):
+    """
+    Assigns the operands of the buy rules of `sides` to the stages.
+
+    Returns:
+        list: (stage name, columns, {side: expression checked at this stage or None}) per stage, with a last
+              'other' stage for the columns of the rules (and `required`) that are not in STAGES.
+    """
+    stages = [(name, list(columns), {side: [] for side in sides}) for name, columns in STAGES]
+    staged_columns = {column for _, columns in STAGES for column in columns}
+    other = [column for column in required if column not in staged_columns]
+    other_operands = {side: [] for side in sides}
+    for side in sides:
+        for operand in rules.conjuncts(rule_set[f"is_buy_signal_{side.lower()}"]):
+            needed = rules.columns_of(operand)
+            available = set()
+            for _, columns, operands in stages:
+                available.update(columns)
+                if needed <= available:
+                    operands[side].append(operand)
+                    break
+            else:
+                other += [column for column in sorted(needed - staged_columns) if column not in other]
+                other_operands[side].append(operand)
+    if other or any(other_operands.values()):
+        stages.append(("other", other, other_operands))
+    return [(name, columns, {side: " and ".join(f"({operand})" for operand in operands) or None for side, operands in side_operands.items()})
+            for name, columns, side_operands in stages]
+
+def screen(compute, eligible, rule_set, sides, required=(), columns=None, extra_columns=()):
+    """
+    Screens the buy rules of `sides` stage by stage (see the module docstring).
+
+    Args:
+        compute (callable): compute(names, columns) -> {name: (rows, len(columns)) array}.
+        eligible (np.ndarray): (rows, tickers) bool, the cells with enough history to give a signal.
+        rule_set (dict): Signal rules (e.g. rules.RULES).
+        sides (list): 'NORMAL' and/or 'INVERSE'.
+        required (list): Columns that must not be NaN on a cell that gives a signal.
+        columns (array): Ticker columns screened for buy signals (default: all of them).
+        extra_columns (array): Ticker columns that also need REPORT_COLUMNS and their exit signals (e.g. held positions).
+
+    Returns:
+        tuple: (values: {name: (rows, tickers) array, NaN for the tickers it was not computed for},
+                valid: (rows, tickers) bool, eligible cells with the required columns (False outside the detail tickers),
+                signals: {signal: (rows, tickers) bool}, buy signals of the screened columns and exit signals of
+                         the detail tickers (the ones with a buy signal and extra_columns),
+                report: [(stage name, columns, tickers in, tickers out, cells out)]).
+    """
+    num_rows, num_tickers = eligible.shape
+    values = {}
+    computed = {}
+
+    def fetch(names, columns):
+        # The names missing for the same ticker columns are computed in one call
+        requests = {}
+        for name in names:
+            if name not in values:
+                values[name] = np.full((num_rows, num_tickers), np.nan)
+                computed[name] = np.zeros(num_tickers, dtype=bool)
+            missing = columns[~computed[name][columns]]
+            if len(missing):
+                requests.setdefault(missing.tobytes(), (missing, []))[1].append(name)
+        for missing, request_names in requests.values():
+            for name, result in compute(request_names, missing).items():
+                values[name][:, missing] = result
+                computed[name][missing] = True
+
+    def not_missing(names, columns):
+        ok = np.ones((num_rows, len(columns)), dtype=bool)
+        for name in names:
+            ok &= ~np.isnan(values[name][:, columns])
+        return ok
+
+    screened = np.zeros(num_tickers, dtype=bool)
+    screened[np.arange(num_tickers) if columns is None else np.asarray(columns, dtype=np.int64)] = True
+    alive = {side: eligible & screened for side in sides}
+    survivors = np.flatnonzero((eligible & screened).any(axis=0))
+    report = []
+    with np.errstate(invalid='ignore'):
+        for stage_name, stage_columns, expressions in plan_stages(rule_set, sides, required):
+            tickers_in = len(survivors)
+            if tickers_in:
+                fetch(stage_columns, survivors)
+                ok = not_missing([column for column in required if column in stage_columns], survivors)
+                stage_rules = {f"is_buy_signal_{side.lower()}": expression for side, expression in expressions.items() if expression}
+                stage_signals = rules.evaluate_rules(stage_rules, {name: values[name][:, survivors] for name in values}) if stage_rules else {}
+                for side in sides:
+                    alive[side][:, survivors] &= ok & stage_signals.get(f"is_buy_signal_{side.lower()}", True)
+                survivors = survivors[np.any([alive[side][:, survivors].any(axis=0) for side in sides], axis=0)]
+            cells = int(np.logical_or.reduce([alive[side] for side in sides]).sum()) if sides else 0
+            report.append((stage_name, stage_columns, tickers_in, len(survivors), cells))
+
+    # Detail tickers: every column needed to report the signals, and the exit signals
+    detail = np.union1d(survivors, np.asarray(extra_columns, dtype=np.int64))
+    exit_rules = {f"is_exit_signal_{side.lower()}": rule_set[f"is_exit_signal_{side.lower()}"] for side in sides}
+    exit_columns = set().union(*[rules.columns_of(rule) for rule in exit_rules.values()]) if exit_rules else set()
+    fetch(list(dict.fromkeys(REPORT_COLUMNS + list(required) + sorted(exit_columns))), detail)
+    valid = np.zeros((num_rows, num_tickers), dtype=bool)
+    valid[:, detail] = eligible[:, detail] & not_missing(required, detail)
+    signals = {f"is_buy_signal_{side.lower()}": alive[side] for side in sides}
+    detail_signals = rules.evaluate_rules(exit_rules, {name: values[name][:, detail] for name in values}) if exit_rules and len(detail) else {}
+    for name in exit_rules:
+        signals[name] = np.zeros((num_rows, num_tickers), dtype=bool)
+        if name in detail_signals:
+            signals[name][:, detail] = detail_signals[name]
+    return values, valid, signals, report
+
+def print_report(report, cells_label=None):
+    """Prints the tickers left after every stage (and the cells, e.g. ticker-days, if `cells_label` is given)."""
+    if not report:
+        return
+    print(f"--> Screening: {report[0][2]} tickers")
+    for stage_name, columns, tickers_in, tickers_out, cells in report:
+        cells_text = f" ({cells} {cells_label})" if cells_label else ""
+        print(f"    {stage_name} ({', '.join(columns)}): {tickers_in} -> {tickers_out} tickers{cells_text}")
@@ -0,0 +1,283 @@
+"""
+This script searches the backtest parameters adaptively (successive halving) instead of running every
+configuration of a grid over the whole period.
+
+The backtest period is split into NUM_RUNGS windows that grow geometrically: the k-th of them ends after
+1/ETA^(NUM_RUNGS - k) of the period (1/27, 1/9, 1/3 and all of it with the defaults). All the sampled
+configurations are simulated up to the end of the first window, the best 1/ETA of them (by return so far)
+continue up to the end of the second window, and so on until the survivors reach END_DATE. Each rung then
+costs about the same number of simulated days. A configuration that continues resumes from
+the state where it stopped (as a checkpoint), so no day is simulated twice. Runs are also stopped early:
+
+- on a margin call (as in backtest.py),
+- when their drawdown exceeds MAX_DRAWDOWN,
+- when their value falls more than MAX_GAP_TO_BEST below the best run seen at the same date, so they can
+  no longer realistically beat it.
+
+Most configurations are therefore only simulated over the first windows, and the same number of simulated
+days covers about 10 times more configurations than a full grid (see --validate).
+
+Usage:
+    python search.py --grid TIME_STOP=5,10,15 VIX_PROTECTION=0,35,45 LEVERAGE_FACTOR=1,2,5 --configs 81
+    python search.py --grid TIME_STOP=5,10,15 MAX_CONCURRENT_POSITIONS=5,10,20 --prepared
+    python search.py --validate
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+import backtest
+import batch_simulation
+import panel_store
+
+# ==============================================================================
+# --- CONFIGURATION ---
+# ==============================================================================
+NUM_CONFIGS = 81 # Configurations sampled from the grid (all of them if the grid is smaller)
+ETA = 3 # Each rung keeps the best 1/ETA of the configurations
+NUM_RUNGS = 4 # The period is split into this many windows (the first one is 1/ETA^(NUM_RUNGS-1) of the period)
+MAX_DRAWDOWN = 50.0 # %, runs with a larger drawdown are stopped (0 disables)
+MAX_GAP_TO_BEST = 50.0 # %, runs this far below the best run at the same date are stopped (0 disables)
+RANDOM_SEED = 42
+OUTPUT_DIR = "docs/comparatives/backtests-comps"
+VALIDATION_TICKERS = 20 # Size of the synthetic universe used by --validate
+VALIDATION_YEARS = 3
+# ==============================================================================
+
+def sample_configs(grid, num_configs=NUM_CONFIGS, seed=RANDOM_SEED):
+    """Returns `num_configs` configurations drawn without replacement from the grid (all of them if it is smaller)."""
+    configs = batch_simulation.build_grid(**grid)
+    if len(configs) <= num_configs:
+        return configs
+    chosen = np.random.default_rng(seed).choice(len(configs), size=num_configs, replace=False)
+    return [configs[i] for i in sorted(chosen)]
+
+def window_ends(master_index, num_rungs=NUM_RUNGS, eta=ETA):
+    """
+    Returns the last date of each of the `num_rungs` windows of the backtest period. The k-th window (from 1)
+    ends after 1/eta^(num_rungs - k) of the period, so each rung, with 1/eta of the configurations of the
+    previous one, simulates about the same number of days. With eta <= 1 (every configuration continues)
+    the windows have the same length.
+    """
+    dates = master_index[(master_index >= pd.Timestamp(backtest.START_DATE)) & (master_index <= pd.Timestamp(backtest.END_DATE))]
+    fractions = [float(eta) ** (k + 1 - num_rungs) if eta > 1 else (k + 1) / num_rungs for k in range(num_rungs)]
+    return [dates[max(int(round(len(dates) * fraction)) - 1, 0)] for fraction in fractions]
+
+def make_stop_condition(best_values):
+    """
+    Returns the stop condition of one run (see backtest.run_simulation): it tracks the peak value of the run
+    and compares it with `best_values` (date -> best value of the runs that were not stopped).
+    """
+    peak = [backtest.INITIAL_CAPITAL]
+    def stop_condition(date, value):
+        peak[0] = max(peak[0], value)
+        if MAX_DRAWDOWN > 0 and value < peak[0] * (1 - MAX_DRAWDOWN / 100):
+            return f"drawdown > {MAX_DRAWDOWN:g}%"
+        best = best_values.get(date)
+        if MAX_GAP_TO_BEST > 0 and best is not None and value < best * (1 - MAX_GAP_TO_BEST / 100):
+            return f"{MAX_GAP_TO_BEST:g}% below the best run"
+        return None
+    return stop_condition
+
+def _apply(config, defaults):
+    for name, value in {**defaults, **config}.items():
+        setattr(backtest, name, value)
+
+def _run_value(state):
+    history = state["portfolio_value_history"]
+    return history[-1]["value"] if history else backtest.INITIAL_CAPITAL
+
+def successive_halving(all_historical_data, master_index, configs, prioritization_method, strategy_type, vix_data, sp500_data, fed_funds_data,
+                       eta=ETA, num_rungs=NUM_RUNGS, early_stop=True):
+    """
+    Runs the search and returns (trials, simulated_days). Each trial is a dict with the configuration, the
+    rung it reached, its value and return at that point, the reason it was stopped (if any) and the results
+    of its last simulation. The trials that reached END_DATE come first, sorted by total return.
+    """
+    defaults = {name: getattr(backtest, name) for name in batch_simulation.BATCH_PARAMETERS}
+    trials = [{"config": config, "rung": 0, "state": None, "results": None, "stopped": None,
+               "stop_condition": None} for config in configs]
+    best_values = {}
+    simulated_days = 0
+    alive = list(trials)
+    try:
+        for rung, end_date in enumerate(window_ends(master_index, num_rungs, eta)):
+            for trial in alive:
+                _apply(trial["config"], defaults)
+                if early_stop and trial["stop_condition"] is None:
+                    trial["stop_condition"] = make_stop_condition(best_values)
+                days_before = len(trial["state"]["portfolio_value_history"]) if trial["state"] else 0
+                with contextlib.redirect_stdout(io.StringIO()):
+                    results = backtest.run_simulation(all_historical_data, master_index, prioritization_method, strategy_type, vix_data, sp500_data,
+                                                      fed_funds_data, verbose=False, initial_state=trial["state"], end_date=end_date,
+                                                      stop_condition=trial["stop_condition"])
+                state = results["state"]
+                history = state["portfolio_value_history"]
+                simulated_days += len(history) - days_before
+                trial.update({"rung": rung + 1, "state": state, "results": results})
+                if state["halted"]:
+                    trial["stopped"] = "margin call"
+                elif state["stopped"]:
+                    trial["stopped"] = state["stopped"]
+                else:
+                    for point in history[days_before:]:
+                        if point["value"] > best_values.get(point["date"], -np.inf):
+                            best_values[point["date"]] = point["value"]
+
+            running = sorted((trial for trial in alive if trial["stopped"] is None), key=lambda trial: _run_value(trial["state"]), reverse=True)
+            alive = running if rung == num_rungs - 1 else running[:max(1, len(running) // eta)]
+            if not alive:
+                break
+    finally:
+        _apply({}, defaults)
+
+    for trial in trials:
+        trial["value"] = _run_value(trial["state"]) if trial["state"] else backtest.INITIAL_CAPITAL
+        trial["return"] = (trial["value"] / backtest.INITIAL_CAPITAL - 1) * 100
+        trial["last_date"] = trial["state"]["last_date"] if trial["state"] else None
+    trials.sort(key=lambda trial: (trial["rung"] == num_rungs and trial["stopped"] is None, trial["rung"], trial["value"]), reverse=True)
+    return trials, simulated_days
+
+def summarize(trials, num_rungs=NUM_RUNGS):
+    """Returns a DataFrame with one row per trial: its configuration, how far it got and its return there."""
+    rows = []
+    for trial in trials:
+        rows.append({**trial["config"], "Rung": f"{trial['rung']}/{num_rungs}", "Stopped": trial["stopped"] or "",
+                     "Last Date": trial["last_date"].date() if trial["last_date"] is not None else None,
+                     "Value": f"${trial['value']:,.2f}", "Return": f"{trial['return']:.2f}%"})
+    return pd.DataFrame(rows)
+
+def save_search_report(summary_df, grid, strategy, prioritization_method, best_summary, budget):
+    """Saves the result of a search to a markdown file and returns its path."""
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    filename_base = "SEARCH-" + "-".join(grid.keys())
+    filename = os.path.join(OUTPUT_DIR, f"{filename_base}.md")
+    i = 1
+    while os.path.exists(filename):
+        filename = os.path.join(OUTPUT_DIR, f"{filename_base}-{i}.md")
+        i += 1
+
+    with open(filename, 'w') as f:
+        f.write(f"# Adaptive Search Report: {', '.join(grid.keys())}\n\n")
+        f.write(f"**Strategy:** {strategy}\n")
+        f.write(f"**Prioritization Method:** {prioritization_method}\n")
+        f.write(f"**Date Range:** {backtest.START_DATE} to {backtest.END_DATE}\n")
+        for name, values in grid.items():
+            f.write(f"**{name}:** {', '.join(str(value) for value in values)}\n")
+        f.write(f"**Search:** successive halving, {NUM_RUNGS} windows, ETA={ETA}, MAX_DRAWDOWN={MAX_DRAWDOWN:g}%, MAX_GAP_TO_BEST={MAX_GAP_TO_BEST:g}%\n")
+        f.write(f"**Budget:** {budget}\n")
+        if best_summary:
+            f.write("\n---\n\n## Best Configuration\n\n")
+            for key, value in best_summary.items():
+                f.write(f"- **{key}:** {value}\n")
+        f.write(f"\n---\n\n## Configurations ({len(summary_df)})\n\n")
+        f.write(summary_df.to_markdown(index=False))
+
+    print(f"\nSearch report saved to {filename}")
+    return filename
+
+def validate(num_tickers=VALIDATION_TICKERS, num_years=VALIDATION_YEARS):
+    """
+    Checks on a synthetic universe that a run resumed window by window gives the same equity curve as a single
+    run, and compares the search with the full grid (best configuration found and simulated days).
+    Returns True if the resumed runs match and the search finds a configuration within 1% of the grid's best.
+    """
+    import benchmark
+
+    all_historical_data, vix_data, sp500_data, fed_funds_data = benchmark.generate_synthetic_universe(num_tickers, num_years)
+    backtest.START_DATE = str((pd.Timestamp(benchmark.END_DATE) - pd.DateOffset(years=num_years)).date())
+    backtest.END_DATE = benchmark.END_DATE
+    with contextlib.redirect_stdout(io.StringIO()):
+        master_index, vix_data, sp500_data, fed_funds_data = backtest.align_data(all_historical_data, vix_data, sp500_data, fed_funds_data)
+        backtest.calculate_signals(all_historical_data)
+    grid = {"TIME_STOP": [0, 5, 10], "MAX_CONCURRENT_POSITIONS": [3, 10], "LEVERAGE_FACTOR": [1, 3, 8], "VIX_PROTECTION": [0, 25]}
+    configs = batch_simulation.build_grid(**grid)
+
+    start = time.perf_counter()
+    full_runs = batch_simulation.run_separately(all_historical_data, master_index, configs, 'RSI', 'NORMAL', vix_data, sp500_data, fed_funds_data)
+    grid_seconds = time.perf_counter() - start
+    grid_days = sum(len(result["state"]["portfolio_value_history"]) for result in full_runs)
+    start = time.perf_counter()
+    trials, search_days = successive_halving(all_historical_data, master_index, configs, 'RSI', 'NORMAL', vix_data, sp500_data, fed_funds_data)
+    search_seconds = time.perf_counter() - start
+    resumed, _ = successive_halving(all_historical_data, master_index, configs, 'RSI', 'NORMAL', vix_data, sp500_data, fed_funds_data, eta=1, early_stop=False)
+
+    mismatches = 0
+    for trial in resumed:
+        full = full_runs[configs.index(trial["config"])]
+        if not trial["results"]["portfolio_df"].equals(full["portfolio_df"]) or len(trial["results"]["completed_trades"]) != len(full["completed_trades"]):
+            mismatches += 1
+    print(f"Resumed window by window vs single run: {len(resumed) - mismatches}/{len(resumed)} configurations match")
+
+    final_values = [result["state"]["portfolio_value_history"][-1]["value"] for result in full_runs]
+    grid_best = configs[int(np.argmax(final_values))]
+    search_best = trials[0]
+    print(f"Full grid: {len(configs)} configurations, {grid_days} simulated days, {grid_seconds:.1f}s. Best: {grid_best} (${max(final_values):,.2f})")
+    print(f"Search:    {len(configs)} configurations, {search_days} simulated days ({search_days / grid_days * 100:.1f}%, "
+          f"{grid_days / max(search_days, 1):.1f}x more configurations for the same budget), {search_seconds:.1f}s. "
+          f"Best: {search_best['config']} (${search_best['value']:,.2f})")
+    found = search_best["value"] >= max(final_values) * 0.99
+    print("Search validation passed." if mismatches == 0 and found else "Search validation FAILED.")
+    return mismatches == 0 and found
+
+def main():
+    parser = argparse.ArgumentParser(description="Search the backtest parameters with successive halving and early-stopped simulations.")
+    parser.add_argument('--grid', nargs='+', metavar='NAME=V1,V2', help=f"Values to search, for any of {', '.join(batch_simulation.BATCH_PARAMETERS)}.")
+    parser.add_argument('--configs', type=int, default=NUM_CONFIGS, help=f"Configurations sampled from the grid (default: {NUM_CONFIGS}).")
+    parser.add_argument('--validate', action='store_true', help="Check the resumed runs and compare the search with the full grid on synthetic data.")
+    parser.add_argument('--prepared', action='store_true', help="Use the data last prepared by backtest.py (see panel_store.py) instead of downloading it.")
+    args = parser.parse_args()
+
+    if args.validate:
+        raise SystemExit(0 if validate() else 1)
+    if not args.grid:
+        parser.error("--grid or --validate is required")
+
+    grid = batch_simulation.parse_grid(args.grid)
+    configs = sample_configs(grid, args.configs)
+    strategy = backtest.STRATEGY_TYPE if backtest.STRATEGY_TYPE in ("NORMAL", "INVERSE", "COMBINED") else "NORMAL"
+    method = backtest.PRIORITIZATION_METHOD if isinstance(backtest.PRIORITIZATION_METHOD, str) and backtest.PRIORITIZATION_METHOD != 'ALL' else 'RSI'
+
+    start_time = time.perf_counter()
+    if args.prepared:
+        panel = panel_store.open_panel()
+        if panel is None:
+            parser.error("no prepared data found. Run backtest.py with USE_PANEL_STORE = True first.")
+        print(f"Using the prepared data stored in {panel.path}")
+        all_historical_data, master_index = panel.to_frames(), panel.dates
+        vix_data, sp500_data, fed_funds_data = panel.market_frames()
+    else:
+        tickers_to_run, membership_intervals = backtest.load_universe()
+        all_historical_data, master_index, vix_data, sp500_data, fed_funds_data = backtest.prepare_data(tickers_to_run, membership_intervals)
+
+    grid_size = len(batch_simulation.build_grid(**grid))
+    print(f"\n--- Searching {len(configs)} of {grid_size} configurations ({strategy}, {method}) ---")
+    trials, simulated_days = successive_halving(all_historical_data, master_index, configs, method, strategy, vix_data, sp500_data, fed_funds_data)
+    period_days = len(master_index[(master_index >= pd.Timestamp(backtest.START_DATE)) & (master_index <= pd.Timestamp(backtest.END_DATE))])
+    budget = (f"{simulated_days} simulated days, {simulated_days / (period_days * len(configs)) * 100:.1f}% of running the "
+              f"{len(configs)} configurations over the whole period")
+
+    summary_df = summarize(trials)
+    print(summary_df.to_string(index=False))
+    print(f"\n{budget}")
+    best_summary = None
+    if trials and trials[0]["rung"] == NUM_RUNGS and trials[0]["stopped"] is None:
+        best = trials[0]
+        best_summary = {**best["config"], **backtest.calculate_summary_performance(best["results"]["portfolio_df"], best["results"]["completed_trades"])}
+        print("\n--- Best Configuration ---")
+        for key, value in best_summary.items():
+            print(f"{key}: {value}")
+    if not summary_df.empty:
+        save_search_report(summary_df, grid, strategy, method, best_summary, budget)
+    elapsed_seconds = time.perf_counter() - start_time
+    minutes, seconds = divmod(elapsed_seconds, 60)
+    print(f"\nTotal execution time: {int(minutes)} minutes {seconds:.1f} seconds")
+
+if __name__ == '__main__':
+    main()
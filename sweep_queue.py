@@ -0,0 +1,492 @@
+"""
+This script runs large backtest sweeps (methods x strategies x parameter grid x windows) on several worker
+processes, on one machine or on several, through a file-based work queue.
+
+The coordinator (`run`) splits the sweep into one task per configuration. The task id is a hash of the
+configuration, so running the same sweep again only runs the tasks that have no result yet. The tasks are
+written to a sweep directory in QUEUE_DIR:
+
+    sweep.json     the prepared panel key, the backtest.py constants, the methods, windows and grid
+    pending/       tasks waiting for a worker
+    running/       tasks claimed by a worker (claimed with an atomic rename, so a task runs on one worker)
+    done/          results (the summary row of backtest.calculate_summary_performance)
+    failed/        tasks that raised, with the error, until the coordinator re-issues them
+    abandoned/     tasks that failed MAX_ATTEMPTS times
+    FINISHED       written when every task is done or abandoned, so the workers exit
+
+Workers (`worker`) open the prepared panel locally (panel_store.open_panel with the key of the sweep), claim
+pending tasks, run backtest.run_simulation and write the results. While a task runs, the worker touches its
+file in running/ so the coordinator knows it is alive. The coordinator re-issues failed tasks, and tasks
+whose worker stopped touching them for LEASE_SECONDS (a crashed process or node), up to MAX_ATTEMPTS
+attempts. It also starts the local workers and replaces the ones that exit early.
+
+The results of every (window, strategy, parameters) group are merged into the comparison report of
+backtest.py (backtest.save_comparison_report).
+
+To use other machines, put QUEUE_DIR on a shared filesystem. Copy the prepared panel (.cache/panels/<key>,
+see panel_store.py) to each node, or run backtest.py on it with the same data, and start workers there.
+
+Usage:
+    python sweep_queue.py run --methods RSI RSI_DESC --strategies NORMAL INVERSE --grid TIME_STOP=5,15 --workers 4
+    python sweep_queue.py run --window 2020=2020-01-01:2020-12-31 --window 2022=2022-01-01:2022-12-31 --prepared
+    python sweep_queue.py worker                  # on another node, for the latest sweep
+    python sweep_queue.py --validate
+"""
+
+import argparse
+import contextlib
+import hashlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+import uuid
+
+import pandas as pd
+
+import backtest
+import batch_simulation
+import comparative
+import panel_store
+
+# ==============================================================================
+# --- CONFIGURATION ---
+# ==============================================================================
+QUEUE_DIR = ".cache/sweeps" # Put it on a shared filesystem to run workers on other machines
+WORKERS = os.cpu_count() or 1 # Local worker processes started by the coordinator (0 = only remote workers)
+MAX_ATTEMPTS = 3 # Attempts per task before it is abandoned
+LEASE_SECONDS = 120 # A running task whose worker shows no sign of life for this long is re-issued
+POLL_SECONDS = 1.0
+# ==============================================================================
+VALIDATION_TICKERS = 30
+VALIDATION_YEARS = 3
+# ==============================================================================
+
+STATES = ['pending', 'running', 'done', 'failed', 'abandoned']
+MOVING_SUFFIX = ".moving-" # Private name of a task file while its state changes (see _move)
+
+def _read_json(path):
+    with open(path) as f:
+        return json.load(f)
+
+def _write_json(path, data):
+    """Writes a JSON file atomically, so a reader never sees a partial file."""
+    temp_path = f"{path}.tmp-{os.getpid()}"
+    with open(temp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(temp_path, path)
+
+def _task_files(sweep_dir, state):
+    directory = os.path.join(sweep_dir, state)
+    return sorted(os.path.join(directory, name) for name in os.listdir(directory) if name.endswith(".json"))
+
+def _task_id(path):
+    return os.path.basename(path)[:-len(".json")]
+
+def _move(path, state, task):
+    """
+    Moves a task file to the `state` directory with the contents `task`. The file is first renamed to a private
+    name in that directory, which fails if another process moved it first, so a file that is no longer ours is
+    never recreated or overwritten. The private file is then rewritten and published under the task name.
+    Returns False if the file had already been moved.
+    """
+    target = os.path.join(os.path.dirname(os.path.dirname(path)), state, f"{task['id']}.json")
+    moving = f"{target}{MOVING_SUFFIX}{uuid.uuid4().hex[:12]}"
+    try:
+        os.rename(path, moving)
+    except FileNotFoundError:
+        return False
+    _write_json(moving, task)
+    os.replace(moving, target)
+    return True
+
+def _interrupted_moves(sweep_dir):
+    """Returns the private files of _move calls (without their temporary files), e.g. of a process that died in one."""
+    return [os.path.join(sweep_dir, state, name) for state in STATES for name in sorted(os.listdir(os.path.join(sweep_dir, state)))
+            if MOVING_SUFFIX in name and ".tmp-" not in name]
+
+def make_tasks(windows, methods, strategies, configs):
+    """Returns one task (dict) per (window, strategy, parameters, method), keyed by a hash of its configuration."""
+    tasks = []
+    for window, (start_date, end_date) in windows.items():
+        for strategy in strategies:
+            for params in configs:
+                for method in methods:
+                    task = {"window": window, "start": start_date, "end": end_date, "strategy": strategy, "params": params, "method": method}
+                    task["id"] = hashlib.sha1(json.dumps(task, sort_keys=True).encode()).hexdigest()[:16]
+                    task["attempts"] = 0
+                    tasks.append(task)
+    return tasks
+
+def submit(name, panel_key, windows, methods, method_config, strategies, configs):
+    """Creates (or resumes) a sweep in QUEUE_DIR/<name>. Tasks that already have a result are not queued again. Returns the sweep directory."""
+    sweep_dir = os.path.join(QUEUE_DIR, name)
+    for state in STATES:
+        os.makedirs(os.path.join(sweep_dir, state), exist_ok=True)
+    tasks = make_tasks(windows, methods, strategies, configs)
+    sweep = {"name": name, "panel_key": panel_key, "constants": comparative.constants(), "windows": windows, "methods": methods,
+             "method_config": method_config, "strategies": strategies, "configs": configs, "lease_seconds": LEASE_SECONDS,
+             "tasks": [task["id"] for task in tasks]}
+    _write_json(os.path.join(sweep_dir, "sweep.json"), sweep)
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(os.path.join(sweep_dir, "FINISHED"))
+    queued = 0
+    for task in tasks:
+        if any(os.path.exists(os.path.join(sweep_dir, state, f"{task['id']}.json")) for state in ['done', 'pending', 'running', 'failed']):
+            continue
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(os.path.join(sweep_dir, "abandoned", f"{task['id']}.json")) # Submitted again: try once more
+        _write_json(os.path.join(sweep_dir, "pending", f"{task['id']}.json"), task)
+        queued += 1
+    _write_json(os.path.join(QUEUE_DIR, "latest.json"), {"name": name})
+    print(f"Sweep {name}: {len(tasks)} tasks, {queued} queued, {len(tasks) - queued} already done or in progress.")
+    return sweep_dir
+
+# ==============================================================================
+# --- WORKER ---
+# ==============================================================================
+
+class _Heartbeat:
+    """Touches the file of a running task every third of the lease, so the coordinator does not re-issue it."""
+
+    def __init__(self, path, lease_seconds):
+        self.path = path
+        self.interval = lease_seconds / 3
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            with contextlib.suppress(FileNotFoundError):
+                os.utime(self.path)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        self.thread.join()
+
+def claim(sweep_dir):
+    """Moves the first pending task to running/ and returns its path, or None if there is none."""
+    for path in _task_files(sweep_dir, "pending"):
+        target = os.path.join(sweep_dir, "running", os.path.basename(path))
+        try:
+            os.rename(path, target)
+        except FileNotFoundError:
+            continue # Claimed by another worker
+        os.utime(target)
+        return target
+    return None
+
+def run_task(task, data, constants):
+    """Runs the simulation of one task on the prepared data. Returns its summary row (empty if there were no trading days)."""
+    all_historical_data, master_index, vix_data, sp500_data, fed_funds_data = data
+    for name, value in {**constants, **task["params"], "START_DATE": task["start"], "END_DATE": task["end"]}.items():
+        setattr(backtest, name, value)
+    with contextlib.redirect_stdout(io.StringIO()):
+        results = backtest.run_simulation(all_historical_data, master_index, task["method"], task["strategy"],
+                                          vix_data, sp500_data, fed_funds_data, verbose=False, end_date=task["end"])
+    return backtest.calculate_summary_performance(results["portfolio_df"], results["completed_trades"]) or {}
+
+def work(sweep_dir, worker_id, inject_failures=False, crash=False):
+    """
+    Runs the tasks of a sweep until the coordinator marks it as finished. Returns the exit code.
+    `inject_failures` fails the first attempt of one task in three and `crash` exits abruptly after the
+    first claim (both for --validate).
+    """
+    sweep = _read_json(os.path.join(sweep_dir, "sweep.json"))
+    panel = panel_store.open_panel(sweep["panel_key"])
+    if panel is None:
+        print(f"Worker {worker_id}: the prepared panel {sweep['panel_key'][:12]} is not in {panel_store.STORE_DIR}. "
+              f"Copy it from the coordinator or run backtest.py on this machine with the same data.")
+        return 1
+    data = (panel.to_frames(), panel.dates) + panel.market_frames()
+    completed = 0
+    while not os.path.exists(os.path.join(sweep_dir, "FINISHED")):
+        path = claim(sweep_dir)
+        if path is None:
+            time.sleep(POLL_SECONDS)
+            continue
+        if crash:
+            os._exit(1)
+        task = _read_json(path)
+        start_time = time.perf_counter()
+        with _Heartbeat(path, sweep["lease_seconds"]):
+            try:
+                if inject_failures and task["attempts"] == 0 and int(task["id"], 16) % 3 == 0:
+                    raise RuntimeError("injected failure")
+                result = run_task(task, data, sweep["constants"])
+                state, task = "done", dict(task, result=result, worker=worker_id, seconds=round(time.perf_counter() - start_time, 2))
+            except Exception as e:
+                state, task = "failed", dict(task, error=f"{type(e).__name__}: {e}", worker=worker_id)
+        if _move(path, state, task):
+            completed += state == "done"
+        else:
+            print(f"Worker {worker_id}: task {task['id']} was re-issued while it ran; its result is discarded.")
+    print(f"Worker {worker_id}: {completed} tasks completed.")
+    return 0
+
+# ==============================================================================
+# --- COORDINATOR ---
+# ==============================================================================
+
+def _reissue(sweep_dir, path, task, reason):
+    """Moves the task at `path` back to pending/ (or to abandoned/ after MAX_ATTEMPTS attempts). Returns True if re-issued."""
+    task = {key: value for key, value in task.items() if key not in ("error", "worker")}
+    task["attempts"] += 1
+    state = "pending" if task["attempts"] < MAX_ATTEMPTS else "abandoned"
+    if not _move(path, state, dict(task, last_error=reason)):
+        return False # Finished meanwhile
+    print(f"Task {task['id']} ({task['window']}, {task['strategy']}, {task['method']}, {task['params']}): {reason}. "
+          + (f"Re-issued (attempt {task['attempts'] + 1}/{MAX_ATTEMPTS})." if state == "pending" else "Abandoned."))
+    return state == "pending"
+
+def _start_worker(name, worker_id, options=(), quiet=False):
+    command = [sys.executable, os.path.abspath(__file__), "worker", "--name", name, "--id", worker_id,
+               "--queue-dir", QUEUE_DIR, "--store-dir", panel_store.STORE_DIR, *options]
+    return subprocess.Popen(command, stdout=subprocess.DEVNULL if quiet else None)
+
+def coordinate(sweep_dir, local_workers=WORKERS, worker_options=(), first_worker_options=(), quiet_workers=False):
+    """
+    Starts the local workers and re-issues failed and stale tasks until every task is done or abandoned.
+    `worker_options` are extra command-line options of the local workers, and `first_worker_options` of the
+    first one only (for --validate). Returns the number of re-issued tasks.
+    """
+    sweep = _read_json(os.path.join(sweep_dir, "sweep.json"))
+    name = sweep["name"]
+    task_ids = set(sweep["tasks"])
+    workers = [_start_worker(name, f"local-{i}", (*worker_options, *(first_worker_options if i == 0 else ())), quiet_workers)
+               for i in range(local_workers)]
+    restarts = 0
+    reissued = 0
+    last_progress = None
+    try:
+        while True:
+            for path in _task_files(sweep_dir, "failed"):
+                task = _read_json(path)
+                reissued += _reissue(sweep_dir, path, task, task.get("error", "failed"))
+            now = time.time()
+            for path in _task_files(sweep_dir, "running"):
+                try:
+                    idle_seconds = now - os.path.getmtime(path)
+                    task = _read_json(path) if idle_seconds > sweep["lease_seconds"] else None
+                except (FileNotFoundError, json.JSONDecodeError):
+                    continue # Finished meanwhile
+                if task is not None:
+                    reissued += _reissue(sweep_dir, path, task, f"no sign of life from its worker for {idle_seconds:.0f}s")
+            for path in _interrupted_moves(sweep_dir):
+                try:
+                    idle_seconds = now - os.path.getmtime(path)
+                    task = _read_json(path) if idle_seconds > sweep["lease_seconds"] else None
+                except (FileNotFoundError, json.JSONDecodeError):
+                    continue # Published meanwhile
+                if task is not None:
+                    reissued += _reissue(sweep_dir, path, task, "its process stopped while changing its state")
+
+            finished = {_task_id(path) for state in ['done', 'abandoned'] for path in _task_files(sweep_dir, state)}
+            progress = len(finished & task_ids)
+            if progress != last_progress:
+                print(f"Progress: {progress}/{len(task_ids)} tasks finished.")
+                last_progress = progress
+            if task_ids <= finished:
+                break
+            for i, process in enumerate(workers):
+                if process.poll() is not None and restarts < MAX_ATTEMPTS * max(local_workers, 1):
+                    print(f"Local worker {i} exited (code {process.returncode}). Starting a new one.")
+                    workers[i] = _start_worker(name, f"local-{i}-{restarts}", worker_options, quiet_workers)
+                    restarts += 1
+            time.sleep(POLL_SECONDS)
+    finally:
+        with open(os.path.join(sweep_dir, "FINISHED"), 'w') as f:
+            f.write(f"{time.time()}\n")
+        for process in workers:
+            process.wait()
+    return reissued
+
+def collect(sweep_dir):
+    """Returns the results of a sweep: (done tasks with their result, abandoned tasks)."""
+    sweep = _read_json(os.path.join(sweep_dir, "sweep.json"))
+    task_ids = set(sweep["tasks"])
+    done = [_read_json(path) for path in _task_files(sweep_dir, "done") if _task_id(path) in task_ids]
+    abandoned = [_read_json(path) for path in _task_files(sweep_dir, "abandoned") if _task_id(path) in task_ids]
+    return done, abandoned
+
+def save_reports(sweep, done, save=True):
+    """
+    Merges the results of every (window, strategy, parameters) group into a summary table like backtest.py
+    and saves it with backtest.save_comparison_report (with the window and parameters of the group).
+    Returns {(window, strategy, parameters as JSON): summary DataFrame}.
+    """
+    order = {task_id: i for i, task_id in enumerate(sweep["tasks"])}
+    groups = {}
+    for task in sorted(done, key=lambda task: order[task["id"]]):
+        key = (task["window"], task["strategy"], json.dumps(task["params"], sort_keys=True))
+        if task["result"]:
+            groups.setdefault(key, []).append(dict(task["result"], Method=task["method"]))
+    defaults = comparative.constants()
+    summaries = {}
+    try:
+        for (window, strategy, params), rows in groups.items():
+            start_date, end_date = sweep["windows"][window]
+            for name, value in {**sweep["constants"], **json.loads(params), "START_DATE": start_date, "END_DATE": end_date}.items():
+                setattr(backtest, name, value)
+            summary_df = pd.DataFrame(rows).set_index("Method")
+            summary_df['Total Return (sort)'] = summary_df['Total Return'].str.replace('%', '').astype(float)
+            summary_df = summary_df.sort_values(by='Total Return (sort)', ascending=False).drop(columns=['Total Return (sort)'])
+            summaries[(window, strategy, params)] = summary_df
+            print(f"\n--- {window} ({start_date} to {end_date}), {strategy}, {json.loads(params) or 'backtest.py parameters'} ---")
+            print(summary_df)
+            if save:
+                backtest.save_comparison_report(summary_df, sweep["methods"], strategy, sweep["method_config"])
+    finally:
+        for name, value in defaults.items():
+            setattr(backtest, name, value)
+    return summaries
+
+def validate(num_tickers=VALIDATION_TICKERS, num_years=VALIDATION_YEARS):
+    """
+    Runs a sweep on a synthetic universe with two local workers in a temporary directory. The first worker
+    crashes after claiming its first task, and the first attempt of one task in three fails. Checks that every
+    task is re-issued until it completes and that the merged results equal running the same configurations
+    in this process on the data cut at the end of their window (the FIRST window ends a year before the data).
+    Returns True if they do.
+    """
+    import tempfile
+    import benchmark
+
+    global QUEUE_DIR, LEASE_SECONDS
+    all_historical_data, vix_data, sp500_data, fed_funds_data = benchmark.generate_synthetic_universe(num_tickers, num_years)
+    with contextlib.redirect_stdout(io.StringIO()):
+        master_index, vix_data, sp500_data, fed_funds_data = backtest.align_data(all_historical_data, vix_data, sp500_data, fed_funds_data)
+        backtest.calculate_signals(all_historical_data)
+    end_date = pd.Timestamp(benchmark.END_DATE)
+    windows = {"FIRST": (str((end_date - pd.DateOffset(years=num_years)).date()), str((end_date - pd.DateOffset(years=1)).date())),
+               "LAST": (str((end_date - pd.DateOffset(years=1)).date()), str(end_date.date()))}
+    methods = ['RSI', 'RSI_DESC', 'A-Z']
+    configs = batch_simulation.build_grid(TIME_STOP=[5, 15])
+
+    saved = (QUEUE_DIR, LEASE_SECONDS, panel_store.STORE_DIR)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        QUEUE_DIR, LEASE_SECONDS = os.path.join(temp_dir, "sweeps"), 3
+        panel_store.STORE_DIR = os.path.join(temp_dir, "panels")
+        os.makedirs(panel_store.STORE_DIR)
+        try:
+            panel_store.save("validation", all_historical_data, master_index, (vix_data, sp500_data, fed_funds_data))
+            sweep_dir = submit("validation", "validation", windows, methods, methods, ['NORMAL', 'INVERSE'], configs)
+            start_time = time.perf_counter()
+            reissued = coordinate(sweep_dir, local_workers=2, worker_options=("--inject-failures",), first_worker_options=("--crash",), quiet_workers=True)
+            seconds = time.perf_counter() - start_time
+            sweep = _read_json(os.path.join(sweep_dir, "sweep.json"))
+            done, abandoned = collect(sweep_dir)
+            with contextlib.redirect_stdout(io.StringIO()):
+                summaries = save_reports(sweep, done, save=False)
+        finally:
+            QUEUE_DIR, LEASE_SECONDS, panel_store.STORE_DIR = saved
+
+    panel_data = (all_historical_data, master_index, vix_data, sp500_data, fed_funds_data)
+    defaults = comparative.constants()
+    mismatches = 0
+    try:
+        for task in done:
+            # Reference: a separate run on the data cut at the window end (see comparative.truncate_data)
+            if task["result"] != run_task(task, comparative.truncate_data(panel_data, task["end"]), sweep["constants"]):
+                mismatches += 1
+                print(f"MISMATCH {task['window']} {task['strategy']} {task['method']} {task['params']}")
+    finally:
+        for name, value in defaults.items():
+            setattr(backtest, name, value)
+    all_valid = mismatches == 0 and not abandoned and len(done) == len(sweep["tasks"]) and reissued > 0
+    print(f"\n{len(done)}/{len(sweep['tasks'])} tasks done in {seconds:.1f}s ({reissued} re-issued, {len(abandoned)} abandoned), "
+          f"{len(summaries)} comparison tables, {mismatches} results differ from separate runs cut at the window end.")
+    return all_valid
+
+def main():
+    global QUEUE_DIR
+    parser = argparse.ArgumentParser(description="Run backtest sweeps on several worker processes or machines through a file-based work queue.")
+    parser.add_argument('--validate', action='store_true', help="Run a sweep with injected failures and a crashing worker on synthetic data.")
+    subparsers = parser.add_subparsers(dest='command')
+
+    run = subparsers.add_parser('run', help="Queue a sweep, run it with local workers (and any remote ones) and save the comparison reports.")
+    run.add_argument('--methods', nargs='+', help="Prioritization methods (default: PRIORITIZATION_METHOD of backtest.py, or all of them).")
+    run.add_argument('--strategies', nargs='+', choices=['NORMAL', 'INVERSE', 'COMBINED'], help="Strategies (default: STRATEGY_TYPE of backtest.py).")
+    run.add_argument('--grid', nargs='+', metavar='NAME=V1,V2', help=f"Parameter values to combine, for any of {', '.join(batch_simulation.BATCH_PARAMETERS)}.")
+    run.add_argument('--window', action='append', metavar='NAME=START:END', help="Date window (repeat for several). Default: START_DATE to END_DATE.")
+    run.add_argument('--workers', type=int, default=WORKERS, help=f"Local worker processes (default: {WORKERS}, 0 = only remote workers).")
+    run.add_argument('--name', help="Sweep name (default: a hash of the sweep, so the same sweep is resumed).")
+    run.add_argument('--prepared', action='store_true', help="Use the data last prepared by backtest.py instead of downloading it.")
+
+    worker = subparsers.add_parser('worker', help="Run the tasks of a sweep (on this or another machine).")
+    worker.add_argument('--name', help="Sweep name (default: the latest sweep in the queue directory).")
+    worker.add_argument('--id', default=f"{platform.node()}-{os.getpid()}", help="Worker name shown in the results.")
+    worker.add_argument('--queue-dir', default=QUEUE_DIR, help=f"Queue directory (default: {QUEUE_DIR}).")
+    worker.add_argument('--store-dir', default=panel_store.STORE_DIR, help=f"Directory of the prepared panels on this machine (default: {panel_store.STORE_DIR}).")
+    worker.add_argument('--inject-failures', action='store_true', help=argparse.SUPPRESS)
+    worker.add_argument('--crash', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.validate:
+        raise SystemExit(0 if validate() else 1)
+    if args.command is None:
+        parser.error("a command (run or worker) or --validate is required")
+
+    if args.command == 'worker':
+        QUEUE_DIR, panel_store.STORE_DIR = args.queue_dir, args.store_dir
+        name = args.name
+        if name is None:
+            latest = os.path.join(QUEUE_DIR, "latest.json")
+            if not os.path.exists(latest):
+                parser.error(f"no sweep found in {QUEUE_DIR}")
+            name = _read_json(latest)["name"]
+        raise SystemExit(work(os.path.join(QUEUE_DIR, name), args.id, args.inject_failures, args.crash))
+
+    try:
+        windows = comparative.parse_windows(args.window) if args.window else {"BACKTEST": (backtest.START_DATE, backtest.END_DATE)}
+        configs = batch_simulation.build_grid(**batch_simulation.parse_grid(args.grid)) if args.grid else [{}]
+    except ValueError as e:
+        parser.error(str(e))
+    method_config = args.methods if args.methods else backtest.PRIORITIZATION_METHOD
+    methods = method_config if isinstance(method_config, list) else (backtest.ALL_METHODS if method_config == 'ALL' else [method_config])
+    strategies = args.strategies if args.strategies else (['NORMAL', 'INVERSE'] if backtest.STRATEGY_TYPE == 'BOTH' else [backtest.STRATEGY_TYPE])
+
+    start_time = time.perf_counter()
+    first_date, last_date = min(start for start, _ in windows.values()), max(end for _, end in windows.values())
+    if args.prepared:
+        panel = panel_store.open_panel()
+        if panel is None:
+            parser.error("no prepared data found. Run backtest.py with USE_PANEL_STORE = True first.")
+    else:
+        # The workers open the prepared data from the panel store
+        backtest.USE_PANEL_STORE = True
+        backtest.START_DATE, backtest.END_DATE = first_date, last_date
+        tickers_to_run, membership_intervals = backtest.load_universe()
+        master_index = backtest.prepare_data(tickers_to_run, membership_intervals)[1]
+        panel = panel_store.open_panel()
+        if panel is None or not panel.dates.equals(master_index):
+            parser.error(f"the prepared data could not be stored in {panel_store.STORE_DIR}.")
+    print(f"Using the prepared data stored in {panel.path}")
+    if panel.dates[0] > pd.Timestamp(first_date) or panel.dates[-1] < pd.Timestamp(last_date):
+        print(f"Warning: The prepared data ({panel.dates[0].date()} to {panel.dates[-1].date()}) does not cover every window ({first_date} to {last_date}).")
+
+    name = args.name or hashlib.sha1(json.dumps([panel.key, comparative.constants(), windows, methods, strategies, configs],
+                                                sort_keys=True, default=str).encode()).hexdigest()[:12]
+    sweep_dir = submit(name, panel.key, windows, methods, method_config, strategies, configs)
+    print(f"Workers on other machines: python sweep_queue.py worker --name {name} (with {QUEUE_DIR} on a shared filesystem)")
+    coordinate(sweep_dir, args.workers)
+
+    sweep = _read_json(os.path.join(sweep_dir, "sweep.json"))
+    done, abandoned = collect(sweep_dir)
+    for task in abandoned:
+        print(f"Abandoned: {task['window']}, {task['strategy']}, {task['method']}, {task['params']} ({task.get('last_error')})")
+    save_reports(sweep, done)
+    elapsed_seconds = time.perf_counter() - start_time
+    minutes, seconds = divmod(elapsed_seconds, 60)
+    print(f"\nTotal execution time: {int(minutes)} minutes {seconds:.1f} seconds")
+
+if __name__ == '__main__':
+    main()